@@ -0,0 +1,298 @@
+"""
+Local stand-in for the DDS web service, serving synthetic payloads of realistic size
+for the drops2 benchmarks. It implements the endpoints used by drops2.coverages and drops2.sensors.
+
+usage:
+    python benchmarks/mock_dds.py --port 8800 --sensors 10000 --coverage-mb 2048
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+
+DATE_FORMAT = '%Y%m%d%H%M'
+BASE_PATH = '/dds/rest'
+WRITE_CHUNK = 1024 ** 2
+
+
+class MockConfig:
+    """
+    sizes of the synthetic payloads
+    """
+
+    def __init__(self, n_sensors=10000, series_step=600, coverage_mb=256, coverage_times=24,
+                 n_variables=4, n_levels=4, n_features=2000, aggregation_times=240,
+                 map_shape=(575, 630), workdir=None):
+        """
+        :param n_sensors: sensors in the anagraphic
+        :param series_step: seconds between two samples of the sensor series
+        :param coverage_mb: size of the coverage returned for date_selected='all', in MB
+        :param coverage_times: timesteps of the coverages
+        :param n_variables: variables of the coverages
+        :param n_levels: levels of each variable
+        :param n_features: features of the aggregation responses
+        :param aggregation_times: timesteps of the aggregation responses
+        :param map_shape: (rows, cols) of the sensor maps
+        :param workdir: directory of the generated NetCDF files (temporary if None)
+        """
+        self.n_sensors = n_sensors
+        self.series_step = series_step
+        self.coverage_mb = coverage_mb
+        self.coverage_times = coverage_times
+        self.n_variables = n_variables
+        self.n_levels = n_levels
+        self.n_features = n_features
+        self.aggregation_times = aggregation_times
+        self.map_shape = map_shape
+        self.workdir = workdir or tempfile.mkdtemp(prefix='drops2-bench-')
+
+
+def _timeline(date_from, date_to, step_seconds):
+    start = np.datetime64(datetime.strptime(date_from, DATE_FORMAT), 's')
+    end = np.datetime64(datetime.strptime(date_to, DATE_FORMAT), 's')
+    times = np.arange(start, end + np.timedelta64(1, 's'), np.timedelta64(step_seconds, 's'))
+    return [t.item().strftime(DATE_FORMAT) for t in times]
+
+
+def _write_netcdf(path, variable, n_times, ny, nx, date_ref):
+    """
+    writes a coverage one timestep at a time, so that multi-GB files need little memory
+    """
+    import netCDF4
+
+    with netCDF4.Dataset(path + '.part', 'w') as nc:
+        nc.createDimension('time', n_times)
+        nc.createDimension('lat', ny)
+        nc.createDimension('lon', nx)
+        time_var = nc.createVariable('time', 'f8', ('time',))
+        time_var.units = 'hours since %s' % datetime.strptime(date_ref, DATE_FORMAT).strftime('%Y-%m-%d %H:%M:00')
+        time_var[:] = np.arange(n_times)
+        nc.createVariable('lat', 'f8', ('lat',))[:] = np.linspace(36, 47.5, ny)
+        nc.createVariable('lon', 'f8', ('lon',))[:] = np.linspace(6, 18.6, nx)
+        data = nc.createVariable(variable, 'f4', ('time', 'lat', 'lon'))
+        rng = np.random.default_rng(0)
+        field = rng.random((ny, nx), dtype=np.float32)
+        for t in range(n_times):
+            data[t, :, :] = field + t
+    os.replace(path + '.part', path)
+
+
+class MockDDS:
+    """
+    the mock server, started on a background thread
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or MockConfig()
+        self.stats_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.requests = 0
+        self.__files_lock = threading.Lock()
+
+        handler = type('Handler', (_Handler,), {'mock': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, BASE_PATH)
+
+    def start(self) -> 'MockDDS':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.bytes_sent = 0
+            self.requests = 0
+
+    def coverage_grid(self):
+        c = self.config
+        cells = int(c.coverage_mb * 1024 ** 2 / 4 / c.coverage_times)
+        ny = max(1, int(np.sqrt(cells * 0.9)))
+        nx = max(1, cells // ny)
+        return ny, nx
+
+    def coverage_file(self, variable, date_ref, n_times) -> str:
+        ny, nx = self.coverage_grid()
+        path = os.path.join(self.config.workdir, 'cov_%s_%s_%d_%dx%d.nc' % (variable, date_ref, n_times, ny, nx))
+        with self.__files_lock:
+            if not os.path.exists(path):
+                _write_netcdf(path, variable, n_times, ny, nx, date_ref)
+        return path
+
+    def map_file(self, n_times) -> str:
+        ny, nx = self.config.map_shape
+        path = os.path.join(self.config.workdir, 'map_%d_%dx%d.nc' % (n_times, ny, nx))
+        with self.__files_lock:
+            if not os.path.exists(path):
+                _write_netcdf(path, 'map', n_times, ny, nx, '202001010000')
+        return path
+
+    @lru_cache(maxsize=4)
+    def anagraphic(self) -> bytes:
+        rng = np.random.default_rng(1)
+        lats = rng.uniform(36, 47.5, self.config.n_sensors)
+        lons = rng.uniform(6, 18.6, self.config.n_sensors)
+        sensors = [
+            dict(id='%d' % (100000 + i), station=i // 3,
+                 stationName='station %d' % (i // 3), lat=float(lats[i]), lon=float(lons[i]),
+                 sensorMU='mm', municipality='municipality %d' % (i % 500))
+            for i in range(self.config.n_sensors)
+        ]
+        return json.dumps(sensors).encode()
+
+    @lru_cache(maxsize=16)
+    def series_fragments(self, date_from, date_to, step):
+        """
+        json fragments shared by all the sensors of a series request
+        """
+        timeline = _timeline(date_from, date_to, step)
+        values = np.round(np.abs(np.sin(np.arange(len(timeline)) / 50.0)) * 10, 1)
+        return (
+            json.dumps(timeline).encode(),
+            json.dumps(values.tolist()).encode(),
+            json.dumps([1] * len(timeline)).encode(),
+        )
+
+    @lru_cache(maxsize=4)
+    def aggregation(self) -> bytes:
+        c = self.config
+        t0 = int(datetime(2020, 1, 1).timestamp() * 1000)
+        times = [t0 + i * 3600 * 1000 for i in range(c.aggregation_times)]
+        rng = np.random.default_rng(2)
+        data = [
+            dict(fid='%d' % i, **{'from': times, 'to': times},
+                 values=np.round(rng.random(c.aggregation_times), 3).tolist())
+            for i in range(c.n_features)
+        ]
+        return json.dumps(data).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def __send_parts(self, parts, content_type='application/json', status=200):
+        length = sum(len(p) for p in parts)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        self.wfile.write(b''.join(parts))
+        with self.mock.stats_lock:
+            self.mock.bytes_sent += length
+            self.mock.requests += 1
+
+    def __send_json(self, data):
+        self.__send_parts([json.dumps(data).encode()])
+
+    def __send_file(self, path, content_type='application/x-netcdf'):
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(WRITE_CHUNK)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+        with self.mock.stats_lock:
+            self.mock.bytes_sent += size
+            self.mock.requests += 1
+
+    def __not_found(self):
+        self.__send_parts([b'{"error": "not found"}'], status=404)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        if not path.startswith(BASE_PATH):
+            return self.__not_found()
+        parts = [p for p in path[len(BASE_PATH):].split('/') if p]
+        c = self.mock.config
+        route = tuple(parts[:2])
+
+        if route == ('drops_coverages', 'supported'):
+            return self.__send_json(['MODEL_%d' % i for i in range(20)])
+        if route == ('drops_coverages', 'dates'):
+            date_from, date_to = parts[3], parts[4]
+            return self.__send_json(_timeline(date_from, date_to, 12 * 3600))
+        if route == ('drops_coverages', 'variables'):
+            return self.__send_json(['VAR_%d' % i for i in range(c.n_variables)])
+        if route == ('drops_coverages', 'levels'):
+            return self.__send_json(['%d' % (1000 - 100 * i) for i in range(c.n_levels)])
+        if route == ('drops_coverages', 'timeline'):
+            date_ref = parts[3]
+            date_to = (datetime.strptime(date_ref, DATE_FORMAT) + timedelta(hours=c.coverage_times - 1))
+            return self.__send_json(_timeline(date_ref, date_to.strftime(DATE_FORMAT), 3600))
+        if route == ('drops_coverages', 'coverage'):
+            date_ref, variable, date_selected = parts[3], parts[4], parts[6]
+            n_times = c.coverage_times if date_selected == 'all' else 1
+            return self.__send_file(self.mock.coverage_file(variable, date_ref, n_times))
+        if route == ('drops_coverages', 'aggregation'):
+            return self.__send_parts([self.mock.aggregation()])
+        if route == ('drops_sensors', 'classes'):
+            return self.__send_json(['PLUVIOMETRO', 'TERMOMETRO', 'IGROMETRO', 'ANEMOMETRO'])
+        if route == ('drops_sensors', 'aggregations'):
+            return self.__send_json(['AVG', 'MAX', 'MIN', 'SUM'])
+        if route == ('drops_sensors', 'anag'):
+            return self.__send_parts([self.mock.anagraphic()])
+        return self.__not_found()
+
+    def do_POST(self):
+        path = unquote(urlsplit(self.path).path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        parts = [p for p in path[len(BASE_PATH):].split('/') if p]
+        route = tuple(parts[:2])
+
+        if route[0] == 'drops_sensors' and route[1].startswith('serie'):
+            step = int(body.get('step') or self.mock.config.series_step)
+            timeline, values, samples = self.mock.series_fragments(body['from'], body['to'], step)
+            chunks = [b'[']
+            for i, sensor_id in enumerate(body['ids']):
+                if i:
+                    chunks.append(b',')
+                chunks += [b'{"sensorId":', json.dumps(sensor_id).encode(), b',"timeline":', timeline,
+                           b',"values":', values, b',"validSamples":', samples, b'}']
+            chunks.append(b']')
+            return self.__send_parts(chunks)
+        if route == ('drops_sensors', 'map'):
+            return self.__send_file(self.mock.map_file(len(body['timeline'])))
+        return self.__not_found()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local stand-in for the DDS web service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--sensors', type=int, default=10000)
+    parser.add_argument('--coverage-mb', type=float, default=256)
+    args = parser.parse_args()
+
+    mock = MockDDS(MockConfig(n_sensors=args.sensors, coverage_mb=args.coverage_mb), args.host, args.port)
+    print('serving on %s' % mock.url)
+    mock.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
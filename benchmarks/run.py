@@ -0,0 +1,234 @@
+"""
+drops2 benchmarks against the local mock DDS server (benchmarks/mock_dds.py).
+For every benchmark the runner measures the wall time of `repeat` runs, then the peak
+of the python allocations (tracemalloc) in a separate run, and the bytes served by the mock.
+Results are written as json, one record per benchmark, to track them over time.
+
+usage:
+    python benchmarks/run.py                                   # default sizes
+    python benchmarks/run.py --sensors 20000 --coverage-mb 2048 --output results.json
+    python benchmarks/run.py --filter sensors. --repeat 5
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import drops2  # noqa: E402
+from drops2 import coverages, sensors  # noqa: E402
+from drops2.sensors import SensorList  # noqa: E402
+from drops2.utils import DropsCredentials  # noqa: E402
+
+from mock_dds import MockConfig, MockDDS  # noqa: E402
+
+DATA_ID = 'MODEL_0'
+DATE_REF = '202001010000'
+SENSOR_CLASS = 'PLUVIOMETRO'
+YEAR_FROM, YEAR_TO = '202001010000', '202012312350'
+DAY_FROM, DAY_TO = '202006010000', '202006020000'
+
+try:
+    import dask  # noqa: F401
+    LAZY = {}     # open the streamed coverages lazily
+except ImportError:
+    # dask is optional, the coverages are loaded in memory
+    LAZY = None
+
+
+class Benchmark:
+    """
+    a benchmark: setup(context) returns the arguments of func, items is the number of
+    processed elements (sensors, samples, cells...) for the throughput
+    """
+
+    def __init__(self, name, func, setup=None, items=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.items = items
+
+
+def _benchmarks(args):
+    ids_year = lambda ctx: ctx['sensor_list'].ids[:args.year_sensors].tolist()
+    ids_day = lambda ctx: ctx['sensor_list'].ids[:args.day_sensors].tolist()
+    n_year = args.year_sensors * 52704
+    n_day = args.day_sensors * 145
+
+    return [
+        # coverages
+        Benchmark('coverages.get_supported_data', lambda ctx: coverages.get_supported_data(auth=ctx['auth'])),
+        Benchmark('coverages.get_dates',
+                  lambda ctx: coverages.get_dates(DATA_ID, YEAR_FROM, YEAR_TO, auth=ctx['auth']), items=732),
+        Benchmark('coverages.get_variables', lambda ctx: coverages.get_variables(DATA_ID, DATE_REF, auth=ctx['auth'])),
+        Benchmark('coverages.get_levels',
+                  lambda ctx: coverages.get_levels(DATA_ID, DATE_REF, 'VAR_0', auth=ctx['auth'])),
+        Benchmark('coverages.get_timeline',
+                  lambda ctx: coverages.get_timeline(DATA_ID, DATE_REF, 'VAR_0', '1000', auth=ctx['auth'])),
+        Benchmark('coverages.describe_coverage',
+                  lambda ctx: coverages.describe_coverage(DATA_ID, DATE_REF, auth=ctx['auth'])),
+        Benchmark('coverages.get_data',
+                  lambda ctx: coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=ctx['auth']).load()),
+        Benchmark('coverages.get_data[stream_to]',
+                  lambda ctx: coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all',
+                                                 auth=ctx['auth'], stream_to=True, chunks=LAZY)),
+        Benchmark('coverages.get_data[points]',
+                  lambda ctx: coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=ctx['auth'],
+                                                 points=ctx['sensor_list'][:500], interp='bilinear').load(),
+                  items=500 * 24),
+        Benchmark('coverages.get_data_multi',
+                  lambda ctx: coverages.get_data_multi(DATA_ID, DATE_REF, ['VAR_0', 'VAR_1'], ['1000', '900'],
+                                                       'all', auth=ctx['auth'], stream_to=True, chunks=LAZY)),
+        Benchmark('coverages.get_aggregation',
+                  lambda ctx: coverages.get_aggregation(DATA_ID, DATE_REF, 'VAR_0', '1000', 'shp', 'id',
+                                                        auth=ctx['auth']), items=args.features * 240),
+        # sensors
+        Benchmark('sensors.get_sensor_classes', lambda ctx: sensors.get_sensor_classes(auth=ctx['auth'])),
+        Benchmark('sensors.get_aggregation_functions', lambda ctx: sensors.get_aggregation_functions(auth=ctx['auth'])),
+        Benchmark('sensors.get_sensor_list',
+                  lambda ctx: sensors.get_sensor_list(SENSOR_CLASS, auth=ctx['auth']), items=args.sensors),
+        Benchmark('sensors.SensorList.from_json',
+                  lambda ctx: SensorList.from_json(ctx['anagraphic'], None), items=args.sensors),
+        Benchmark('sensors.SensorList.select_bbox',
+                  lambda ctx: ctx['sensor_list'].select_bbox((8.0, 40.0, 12.0, 44.0)), items=args.sensors),
+        Benchmark('sensors.get_sensor_data[year,json]',
+                  lambda ctx: sensors.get_sensor_data(SENSOR_CLASS, ids_year(ctx), YEAR_FROM, YEAR_TO,
+                                                      auth=ctx['auth']), items=n_year),
+        Benchmark('sensors.get_sensor_data[year,pandas]',
+                  lambda ctx: sensors.get_sensor_data(SENSOR_CLASS, ids_year(ctx), YEAR_FROM, YEAR_TO,
+                                                      as_pandas=True, auth=ctx['auth']), items=n_year),
+        Benchmark('sensors.get_sensor_data[year,pandas,stream]',
+                  lambda ctx: sensors.get_sensor_data(SENSOR_CLASS, ids_year(ctx), YEAR_FROM, YEAR_TO,
+                                                      as_pandas=True, stream=True, auth=ctx['auth']), items=n_year),
+        Benchmark('sensors.get_sensor_data[day,all sensors,pandas]',
+                  lambda ctx: sensors.get_sensor_data(SENSOR_CLASS, ids_day(ctx), DAY_FROM, DAY_TO,
+                                                      as_pandas=True, auth=ctx['auth']), items=n_day),
+        Benchmark('sensors.get_sensor_data_aggr',
+                  lambda ctx: sensors.get_sensor_data_aggr(SENSOR_CLASS, ids_year(ctx), YEAR_FROM, YEAR_TO,
+                                                           3600, 'SUM', as_pandas=True, auth=ctx['auth']),
+                  items=args.year_sensors * 8784),
+        Benchmark('sensors.iter_sensor_data',
+                  lambda ctx: sum(len(v) for _, _, v, _ in sensors.iter_sensor_data(
+                      SENSOR_CLASS, ids_year(ctx), YEAR_FROM, YEAR_TO, auth=ctx['auth'])), items=n_year),
+        Benchmark('sensors.get_sensor_map',
+                  lambda ctx: sensors.get_sensor_map(SENSOR_CLASS, ['202006010000', '202006010100', '202006010200'],
+                                                     auth=ctx['auth']).load()),
+        Benchmark('sensors.get_sensor_map[dates_per_request]',
+                  lambda ctx: sensors.get_sensor_map(SENSOR_CLASS, ['202006010000', '202006010100', '202006010200'],
+                                                     dates_per_request=1, auth=ctx['auth']).load()),
+    ]
+
+
+def _measure(benchmark, ctx, repeat):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = benchmark.func(ctx)
+        times.append(time.perf_counter() - start)
+        del result
+
+    # memory in a separate run, tracemalloc slows down the python code
+    ctx['mock'].reset_stats()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = benchmark.func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    with ctx['mock'].stats_lock:
+        bytes_sent, requests = ctx['mock'].bytes_sent, ctx['mock'].requests
+
+    median = statistics.median(times)
+    record = dict(
+        name=benchmark.name,
+        repeat=repeat,
+        seconds_min=min(times),
+        seconds_median=median,
+        seconds_max=max(times),
+        peak_memory_bytes=peak,
+        bytes_transferred=bytes_sent,
+        requests=requests,
+        mb_per_second=bytes_sent / 1024 ** 2 / median if median > 0 else None,
+    )
+    if benchmark.items:
+        record['items'] = benchmark.items
+        record['items_per_second'] = benchmark.items / median if median > 0 else None
+    return record
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='drops2 benchmarks against a local mock DDS server')
+    parser.add_argument('--sensors', type=int, default=10000, help='sensors in the anagraphic')
+    parser.add_argument('--year-sensors', type=int, default=20, help='sensors of the year-long series requests')
+    parser.add_argument('--day-sensors', type=int, default=2000, help='sensors of the one day series requests')
+    parser.add_argument('--coverage-mb', type=float, default=256, help='size of the coverages in MB')
+    parser.add_argument('--features', type=int, default=2000, help='features of the aggregations')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--filter', default=None, help='run only the benchmarks containing this string')
+    parser.add_argument('--workdir', default=None, help='directory of the generated NetCDF files')
+    parser.add_argument('--output', default=None, help='json results file (stdout if missing)')
+    args = parser.parse_args()
+
+    config = MockConfig(n_sensors=args.sensors, coverage_mb=args.coverage_mb, n_features=args.features,
+                        workdir=args.workdir or tempfile.mkdtemp(prefix='drops2-bench-'))
+    mock = MockDDS(config).start()
+
+    with DropsCredentials(mock.url, ('bench', 'bench')) as auth:
+        ctx = dict(mock=mock, auth=auth)
+        ctx['anagraphic'] = json.loads(mock.anagraphic())
+        ctx['sensor_list'] = sensors.get_sensor_list(SENSOR_CLASS, auth=auth)
+
+        results = []
+        for benchmark in _benchmarks(args):
+            if args.filter and args.filter not in benchmark.name:
+                continue
+            # warm up: generates the mock payloads and the pooled connections
+            benchmark.func(ctx)
+            record = _measure(benchmark, ctx, args.repeat)
+            print('%-50s %9.4fs  peak %8.1f MB' % (
+                record['name'], record['seconds_median'], record['peak_memory_bytes'] / 1024 ** 2
+            ), file=sys.stderr)
+            results.append(record)
+
+    mock.stop()
+
+    report = dict(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        git_revision=_git_revision(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        drops2_path=os.path.dirname(drops2.__file__),
+        config=vars(args),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == '__main__':
+    main()
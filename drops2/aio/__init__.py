@@ -0,0 +1,9 @@
+"""
+asyncio versions of the drops2 coverages and sensors functions
+requires aiohttp (pip install drops2[aio])
+"""
+from .client import AsyncDropsClient, AsyncResponse
+from .coverages import (get_data, get_dates, get_levels, get_timeline,
+                        get_variables)
+from .sensors import (get_sensor_data, get_sensor_data_aggr, get_sensor_list,
+                      get_sensor_map)
@@ -0,0 +1,180 @@
+"""
+aiohttp client shared by the drops2.aio coroutines.
+Transient failures of the idempotent requests are retried with the RetryPolicy of the
+transport of the credentials (so the two clients back off the same way), and the
+request and retry metrics are emitted like the pooled transport does. The async client
+has no circuit breaker and no client-side rate limiter: bound the load with max_concurrency.
+"""
+import asyncio
+import base64
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+try:
+    import aiohttp
+except ImportError as err:
+    raise ImportError(
+        'drops2.aio requires aiohttp, install it with `pip install drops2[aio]`'
+    ) from err
+
+from .. import metrics
+from ..transport import IDEMPOTENT_METHODS
+from ..utils import REQUESTS_TIMEOUT, DropsCredentials
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+# transient failures, including a connection dropped while the body is read
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+class AsyncResponse:
+    """
+    Fully read http response, exposes the subset of the requests response
+    interface used by drops2 (and by DropsException)
+    """
+
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncDropsClient:
+    """
+    Asynchronous client for the drops webservice.
+    Owns an aiohttp session and bounds the number of concurrent requests
+    with a semaphore. Share one client between the calls you want to fan out.
+    example:
+
+    async with AsyncDropsClient(auth, max_concurrency=32) as client:
+        levels = await asyncio.gather(*[
+            aio.get_levels(data_id, date_ref, v, client=client) for v in variables
+        ])
+    """
+
+    def __init__(self, auth=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, limit_per_host=0, retry=None):
+        """
+        :param auth: authentication object (optional)
+        :param max_concurrency: maximum number of requests in flight
+        :param limit_per_host: maximum number of connections per host (0 for no limit)
+        :param retry: RetryPolicy, None for the policy of the transport of auth, False to disable the retries
+        """
+        if auth is None:
+            auth = DropsCredentials.default()
+
+        self.auth = auth
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.retry = auth.transport().retry if retry is None else retry
+
+        self.__semaphore = None
+        self.__session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    def __build_session(self) -> aiohttp.ClientSession:
+        connect_timeout, read_timeout = REQUESTS_TIMEOUT
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.limit_per_host
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={'Authorization': self.__authorization()},
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        )
+
+    def __authorization(self) -> str:
+        # same encoding as the basic auth of requests
+        user, password = self.auth.auth_info()
+        credentials = ('%s:%s' % (user, password)).encode('latin1')
+        return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+    async def request(self, method, url, idempotent=None, **kwargs) -> AsyncResponse:
+        """
+        performs an http request and reads the whole body, retrying the transient failures
+        :param method: http method
+        :param url: request url
+        :param idempotent: the request can be safely repeated,
+                           by default True for GET, HEAD, OPTIONS, PUT, DELETE
+        :param kwargs: same arguments accepted by aiohttp
+        :return: AsyncResponse object
+        """
+        if self.__session is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__session = self.__build_session()
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        max_retries = self.retry.max_retries if (self.retry and idempotent) else 0
+        endpoint = metrics.endpoint_of(url)
+
+        attempt = 0
+        while True:
+            logging.debug('[%s] %s', method, url)
+            start = time.perf_counter()
+            try:
+                async with self.__semaphore:
+                    async with self.__session.request(method, url, **kwargs) as response:
+                        content = await response.read()
+                        response = AsyncResponse(
+                            str(response.url), response.status, response.reason,
+                            response.headers, content
+                        )
+            except RETRYABLE_EXCEPTIONS as exp:
+                metrics.emit('request', endpoint, time.perf_counter() - start,
+                             method=method, status=type(exp).__name__)
+                if attempt >= max_retries:
+                    raise
+                delay = self.retry.backoff(attempt)
+                reason = str(exp) or type(exp).__name__
+            else:
+                metrics.emit('request', endpoint, time.perf_counter() - start,
+                             method=method, status=response.status_code)
+                if attempt >= max_retries or not self.retry.is_retryable(response.status_code):
+                    return response
+                delay = self.retry.backoff(attempt, response)
+                reason = '%s %s' % (response.status_code, response.reason)
+
+            attempt += 1
+            metrics.emit('retry', endpoint, method=method)
+            logging.warning('[%s] %s: %s, retry %d/%d in %.1fs', method, url, reason, attempt, max_retries, delay)
+            await asyncio.sleep(delay)
+
+    async def get(self, url, **kwargs) -> AsyncResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, idempotent=False, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    async def close(self):
+        """
+        closes the underlying session
+        """
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+
+@asynccontextmanager
+async def _client_for(auth, client):
+    """
+    yields the given client, or a temporary one bound to auth
+    """
+    if client is not None:
+        yield client
+        return
+
+    async with AsyncDropsClient(auth) as tmp_client:
+        yield tmp_client
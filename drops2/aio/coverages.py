@@ -0,0 +1,193 @@
+import asyncio
+import io
+import logging
+
+import xarray as xr
+
+from ..coverages import (_COVERAGE_URL, _DATES_URL, _LEVELS_URL,
+                         _TIMELINE_URL, _VARIABLES_URL, _decode_dates,
+                         _query_url)
+from ..utils import DropsCredentials, DropsException, format_dates
+from .client import _client_for
+
+
+def _resolve_auth(auth, client):
+    if auth is not None:
+        return auth
+    if client is not None:
+        return client.auth
+    return DropsCredentials.default()
+
+
+@format_dates()
+async def get_dates(data_id, date_from, date_to, date_as_string=False, auth=None, client=None):
+    """
+    gets the timeline for the selected coverage during the selected time period
+    :param data_id: coverage id
+    :param date_from: date from (date object or formatted string)
+    :param date_to: date to (date object or formatted string)
+    :param date_as_string: format the return values as strings instead of date objects
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: list of datetime objects or date strings
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        data_id=data_id,
+        date_from=date_from,
+        date_to=date_to
+    )
+    req_url = _query_url(auth, _DATES_URL, query_data)
+
+    async with _client_for(auth, client) as c:
+        r = await c.get(req_url)
+
+    if r.status_code != 200:
+        raise DropsException(
+            "Error while fetching dates for %s between %s and %s" %
+            (data_id, date_from, date_to),
+            response=r
+        )
+
+    return _decode_dates(r.json(), date_as_string)
+
+
+@format_dates()
+async def get_variables(data_id, date_ref, auth=None, client=None):
+    """
+    get the available variables for the selected coverage on the reference date
+    :param data_id: coverage id
+    :param date_ref: selected date
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: list of variables
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        data_id=data_id,
+        date_ref=date_ref
+    )
+    req_url = _query_url(auth, _VARIABLES_URL, query_data)
+
+    async with _client_for(auth, client) as c:
+        r = await c.get(req_url)
+
+    if r.status_code != 200:
+        raise DropsException(
+            "Error while fetching variables for %s for date %s" %
+            (data_id, date_ref),
+            response=r
+        )
+
+    return r.json()
+
+
+@format_dates()
+async def get_levels(data_id, date_ref, variable, auth=None, client=None):
+    """
+    get the available levels for the selected coverage and variable on the reference date
+    :param data_id: coverage id
+    :param date_ref: selected date
+    :param variable: selected variable
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: list of levels
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        data_id=data_id,
+        date_ref=date_ref,
+        variable=variable
+    )
+    req_url = _query_url(auth, _LEVELS_URL, query_data)
+
+    async with _client_for(auth, client) as c:
+        r = await c.get(req_url)
+
+    if r.status_code != 200:
+        raise DropsException(
+            "Error while fetching levels for %s - %s, variable: %s" %
+            (data_id, variable, date_ref),
+            response=r
+        )
+
+    return r.json()
+
+
+@format_dates()
+async def get_timeline(data_id, date_ref, variable, level, date_as_string=False, auth=None, client=None):
+    """
+    gets the timeline of the required coverage, variable, and level on the reference date
+    :param data_id: coverage id
+    :param date_ref: selected date
+    :param variable: selected variable
+    :param level: selected level
+    :param date_as_string: format the return values as strings instead of date objects
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: list of date objects or formatted date strings
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        data_id=data_id,
+        date_ref=date_ref,
+        variable=variable,
+        level=level
+    )
+    req_url = _query_url(auth, _TIMELINE_URL, query_data)
+
+    async with _client_for(auth, client) as c:
+        r = await c.get(req_url)
+
+    if r.status_code != 200:
+        raise DropsException(
+            "Error while fetching dates for %s - %s, variable: %s, level: %s" %
+            (data_id, variable, date_ref, level),
+            response=r
+        )
+
+    return _decode_dates(r.json(), date_as_string)
+
+
+@format_dates()
+async def get_data(data_id, date_ref, variable, level, date_selected='all', auth=None, client=None):
+    """
+    get the data for the selected coverage, variable, level on the selected date and reference date
+    :param data_id: coverage id
+    :param date_ref: reference date
+    :param variable: selected variable
+    :param level: selected level
+    :param date_selected: selected date
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: a xarray dataset
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        data_id=data_id,
+        date_ref=date_ref,
+        variable=variable,
+        level=level,
+        date_selected=date_selected
+    )
+    req_url = _query_url(auth, _COVERAGE_URL, query_data)
+
+    async with _client_for(auth, client) as c:
+        response = await c.get(req_url)
+
+    if response.status_code != 200:
+        raise DropsException(
+            "Error while fetching data for %s - %s, variable: %s, level: %s, selected date: %s" %
+            (data_id, date_ref, variable, level, date_selected),
+            response=response
+        )
+
+    try:
+        # decoded in a thread, not to block the event loop
+        raw_data = io.BytesIO(response.content)
+        cf_data = await asyncio.to_thread(xr.open_dataset, raw_data)
+    except Exception as exp:
+        logging.error('Error loading dataset from %s' % req_url)
+        raise exp
+
+    return cf_data
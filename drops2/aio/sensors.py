@@ -0,0 +1,164 @@
+import asyncio
+import io
+import logging
+
+import xarray as xr
+from requests.utils import quote
+
+from ..sensors import (_ANAG_URL, _MAP_URL, _SERIE_AGGR_SMART_URL,
+                       _SERIE_AGGR_URL, _SERIE_URL, SensorList,
+                       _convert_sensor_data, _sensor_data_post,
+                       _sensor_map_post)
+from ..utils import DropsException, format_dates
+from .client import _client_for
+from .coverages import _resolve_auth
+
+
+async def get_sensor_list(sensor_class, group='Dewetra%Default', geo_win=None, auth=None, client=None):
+    """
+    gets the list of available sensors for the selected class and group
+    :param sensor_class: selected sensor class
+    :param group: selected group
+    :param geo_win: optional geographical window for the selected sensors (lon_min, lat_min, lon_max, lat_max)
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :return: list of sensors objects
+    """
+    auth = _resolve_auth(auth, client)
+    query_data = dict(
+        sensor_class=sensor_class,
+        group=group
+    )
+    req_url = auth.dds_url() + quote(_ANAG_URL % query_data)
+
+    async with _client_for(auth, client) as c:
+        r = await c.get(req_url)
+
+    if r.status_code != 200:
+        raise DropsException(
+            "Error while fetching sensor anagraphic for %s on group %s" % (sensor_class, group),
+            response=r
+        )
+
+    return SensorList.from_json(sensor_list=r.json(), geo_win=geo_win)
+
+
+async def _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth, client, df_format='wide'):
+    req_url = auth.dds_url() + quote(query_url)
+
+    async with _client_for(auth, client) as c:
+        r = await c.post(req_url, json=post_data, idempotent=True)
+
+    if r.status_code != 200:
+        raise DropsException("Error while fetching sensor data", response=r)
+
+    return _convert_sensor_data(r.json(), as_pandas, date_as_string, df_format)
+
+
+@format_dates()
+async def get_sensor_data_aggr(
+    sensor_class,
+    sensors,
+    date_from,
+    date_to,
+    aggr_time,
+    aggr_func,
+    date_as_string=False,
+    as_pandas=False,
+    auth=None,
+    client=None,
+    df_format='wide'
+):
+    """
+    get data from selected sensors on the selected date range, aggregating on time using the selected `aggr_func` function
+    :param sensor_class: sensor class string
+    :param sensors: SensorList Object, or list of Sensors or list of sensors id
+    :param date_from: date from
+    :param date_to: date to
+    :param aggr_time: aggregation time as number of seconds or datetime.timedelta object or pd.timedelta object
+    :param aggr_func: aggregation function for the dataset (returned by `get_aggregation_funtions`)
+    :param date_as_string: return dates as string or datetime objects (default)
+    :param as_pandas: return data converted as pandas dataframe (default)
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :param df_format: layout of the dataframe, 'wide' (default) or 'long'
+    :return: raw data as json, or pandas dataframe
+    """
+    auth = _resolve_auth(auth, client)
+    post_data = _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time, aggr_func)
+
+    return await _get_sensor_data(_SERIE_AGGR_SMART_URL, post_data, as_pandas, date_as_string, auth, client, df_format)
+
+
+@format_dates()
+async def get_sensor_data(
+    sensor_class,
+    sensors,
+    date_from,
+    date_to,
+    aggr_time=None,
+    date_as_string=False,
+    as_pandas=False,
+    auth=None,
+    client=None,
+    df_format='wide'
+):
+    """
+    get data from selected sensors on the selected date range
+    :param sensor_class: sensor class string
+    :param sensors: SensorList Object, or list of Sensors or list of sensors id
+    :param date_from: date from
+    :param date_to: date to
+    :param aggr_time: aggregation time as number of seconds or datetime.timedelta object or pd.timedelta object
+    :param date_as_string: return dates as string or datetime objects (default)
+    :param as_pandas: return data converted as pandas dataframe (default)
+    :param auth: authentication object (optional)
+    :param client: AsyncDropsClient to use (optional)
+    :param df_format: layout of the dataframe, 'wide' (default) or 'long'
+    :return: raw data as json, or pandas dataframe
+    """
+    auth = _resolve_auth(auth, client)
+    query_url = _SERIE_URL if aggr_time is None else _SERIE_AGGR_URL
+    post_data = _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time)
+
+    return await _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth, client, df_format)
+
+
+@format_dates(parameters=['dates_selected'])
+async def get_sensor_map(sensor_class, dates_selected, group='Dewetra%Default',
+                         cum_hours=3, geo_win=(6.0, 36.0, 18.6, 47.5),
+                         interpolator=None,
+                         img_dim=(630, 575), radius=0.5,
+                         mode=None,
+                         auth=None, client=None):
+    """
+    get a map for the selected sensor class on the selected geowindow
+    see drops2.sensors.get_sensor_map for the description of the parameters
+    :param client: AsyncDropsClient to use (optional)
+    :return: xarray dataset
+    """
+    auth = _resolve_auth(auth, client)
+    post_data = _sensor_map_post(sensor_class, dates_selected, group,
+                                 cum_hours, geo_win, interpolator,
+                                 img_dim, radius, mode)
+    req_url = auth.dds_url() + quote(_MAP_URL)
+
+    async with _client_for(auth, client) as c:
+        response = await c.post(req_url, json=post_data, idempotent=True)
+
+    if response.status_code != 200:
+        raise DropsException(
+            "Error while fetching data for %s" %
+            (sensor_class,),
+            response=response
+        )
+
+    try:
+        # decoded in a thread, not to block the event loop
+        raw_data = io.BytesIO(response.content)
+        cf_data = await asyncio.to_thread(xr.open_dataset, raw_data)
+    except Exception as exp:
+        logging.error('Error loading dataset from %s' % req_url)
+        raise exp
+
+    return cf_data
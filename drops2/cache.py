@@ -0,0 +1,368 @@
+import copy as _copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytz
+
+from . import metrics
+from .utils import date_format
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3          # 10 GB
+DEFAULT_RECENT_WINDOW = timedelta(days=2)   # date_ref values that may still be updated
+DEFAULT_RECENT_TTL = 3600                   # seconds
+DEFAULT_METADATA_TTL = 300                  # seconds
+DEFAULT_METADATA_MAX_ENTRIES = 1024
+EVICT_TO = 0.9  # fraction of max_bytes left after an eviction, not to scan on every write of a full cache
+
+
+class DiskCache:
+    """
+    Content addressed on-disk cache for immutable downloads (e.g. coverages).
+    Entries are keyed on the hash of the request parameters, written atomically
+    (safe across processes sharing the same directory) and evicted in least
+    recently used order when the cache grows over max_bytes (down to EVICT_TO of max_bytes).
+    The size of the cache is scanned once and then tracked on every write, the directory
+    is scanned again only to evict (the writes of other processes are seen at that point).
+    Entries for a recent date_ref (within recent_window from now) expire after recent_ttl seconds,
+    older ones never expire.
+    example:
+
+    cache = DiskCache('/data/dds_cache', max_bytes=50 * 1024 ** 3)
+    ds = coverages.get_data(data_id, date_ref, variable, level, cache=cache)
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES,
+                 recent_window=DEFAULT_RECENT_WINDOW, recent_ttl=DEFAULT_RECENT_TTL,
+                 suffix='.nc'):
+        """
+        :param directory: cache directory (created if missing)
+        :param max_bytes: maximum size of the cache in bytes
+        :param recent_window: date_ref values newer than now - recent_window may still change
+        :param recent_ttl: time to live in seconds of the entries with a recent date_ref
+        :param suffix: file suffix of the cache entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.recent_window = recent_window
+        self.recent_ttl = recent_ttl
+        self.suffix = suffix
+
+        self.__lock = threading.Lock()
+        self.__size = None  # bytes of the entries, None until the first scan
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        :param parts: request parameters identifying the entry
+        :return: cache key
+        """
+        raw = json.dumps(parts, default=str, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def path(self, key) -> str:
+        """
+        :param key: cache key
+        :return: path of the entry
+        """
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def is_recent(self, date_ref) -> bool:
+        """
+        :param date_ref: reference date as formatted string or datetime object
+        :return: True if entries for date_ref may still change
+        """
+        if date_ref is None:
+            return False
+
+        if isinstance(date_ref, str):
+            try:
+                date_ref = datetime.strptime(date_ref, date_format)
+            except ValueError:
+                return True
+
+        if date_ref.tzinfo is None:
+            date_ref = pytz.utc.localize(date_ref)
+
+        return date_ref >= datetime.now(pytz.utc) - self.recent_window
+
+    def get(self, key, date_ref=None):
+        """
+        looks up an entry, refreshing its position in the LRU order
+        :param key: cache key
+        :param date_ref: reference date of the entry, for the expiration policy
+        :return: path of the entry or None
+        """
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            metrics.emit('cache', 'disk', cache='disk', result='miss')
+            return None
+
+        now = time.time()
+        if self.is_recent(date_ref) and now - stat.st_mtime > self.recent_ttl:
+            self.invalidate(key)
+            metrics.emit('cache', 'disk', cache='disk', result='miss')
+            return None
+
+        # access time tracks the LRU order, modification time the write time
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except FileNotFoundError:
+            metrics.emit('cache', 'disk', cache='disk', result='miss')
+            return None
+
+        metrics.emit('cache', 'disk', cache='disk', result='hit')
+        return path
+
+    @contextmanager
+    def writer(self, key):
+        """
+        context manager returning a binary file to fill with the entry content.
+        The entry is published atomically when the block exits without errors.
+        :param key: cache key
+        :return: writable file object
+        """
+        with self.path_writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                yield f
+
+    @contextmanager
+    def path_writer(self, key):
+        """
+        like writer, returns the path of the temporary file to fill instead of an open file
+        (e.g. for xarray to_netcdf)
+        :param key: cache key
+        :return: path of the temporary file
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-', suffix=self.suffix)
+        os.close(fd)
+        try:
+            yield tmp_path
+            written = os.path.getsize(tmp_path)
+            replaced = _file_size(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self.__lock:
+            if self.__size is not None:
+                self.__size += written - replaced
+            over = self.__size is None or self.__size > self.max_bytes
+        if over:
+            self.evict(keep=path)
+
+    def invalidate(self, key):
+        """
+        removes an entry
+        :param key: cache key
+        """
+        path = self.path(key)
+        size = _file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.__track_removed(size)
+
+    def __track_removed(self, size):
+        with self.__lock:
+            if self.__size is not None:
+                self.__size = max(0, self.__size - size)
+
+    def __entries(self):
+        for sub_dir in os.scandir(self.directory):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(self.suffix) and not entry.name.startswith('.tmp-'):
+                    try:
+                        yield entry.path, entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+    def size(self) -> int:
+        """
+        :return: total size of the cache entries in bytes
+        """
+        total = sum(stat.st_size for _, stat in self.__entries())
+        with self.__lock:
+            self.__size = total
+        return total
+
+    def evict(self, keep=None):
+        """
+        removes the least recently used entries when the cache does not fit in max_bytes,
+        down to EVICT_TO of max_bytes
+        :param keep: path of an entry that must not be evicted (optional)
+        """
+        entries = list(self.__entries())
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_bytes:
+            with self.__lock:
+                self.__size = total
+            return
+
+        target = self.max_bytes * EVICT_TO
+        entries.sort(key=lambda e: e[1].st_atime)
+        for path, stat in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= stat.st_size
+                logging.debug('[DiskCache] evicted %s', path)
+            except FileNotFoundError:
+                # already removed by another process
+                total -= stat.st_size
+        with self.__lock:
+            self.__size = total
+
+    def clear(self):
+        """
+        removes all the entries
+        """
+        for path, _ in list(self.__entries()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self.__lock:
+            self.__size = 0
+
+
+def _file_size(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class CacheEntry:
+    """
+    A cached value with its expiration time and the http validators
+    """
+    __slots__ = ('value', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, value, expires, etag=None, last_modified=None):
+        self.value = value
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+
+class MetadataCache:
+    """
+    Thread-safe in-memory cache with time to live and LRU eviction, for the
+    anagraphic and catalogue calls whose results change rarely 
+    (sensor classes, aggregation functions, sensor lists, supported data, variables, levels).
+    Expired entries are kept to revalidate them with If-None-Match/If-Modified-Since
+    when the server provided an ETag or a Last-Modified header.
+    example:
+
+    auth = DropsCredentials(url, (user, password), metadata_cache=MetadataCache(ttl=600))
+    sensors.get_sensor_classes(auth=auth)   # request
+    sensors.get_sensor_classes(auth=auth)   # cached
+    auth.metadata_cache().invalidate()      # drop everything
+    """
+
+    def __init__(self, ttl=DEFAULT_METADATA_TTL, max_entries=DEFAULT_METADATA_MAX_ENTRIES):
+        """
+        :param ttl: time to live of the entries in seconds
+        :param max_entries: maximum number of entries
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+
+    def lookup(self, key) -> CacheEntry:
+        """
+        :param key: cache key
+        :return: the entry (possibly expired) or None
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def get(self, key, default=None, copy=True):
+        """
+        :param key: cache key
+        :param default: value returned when the entry is missing or expired
+        :param copy: return a copy of the cached value, 
+                     False to share it with the cache when the caller does not modify it
+        :return: the cached value
+        """
+        entry = self.lookup(key)
+        if entry is None or not entry.is_fresh():
+            return default
+        return _copy.deepcopy(entry.value) if copy else entry.value
+
+    def put(self, key, value, etag=None, last_modified=None, copy=True):
+        """
+        stores a value
+        :param key: cache key
+        :param value: value to store
+        :param etag: ETag header of the response (optional)
+        :param last_modified: Last-Modified header of the response (optional)
+        :param copy: store a copy of the value, False when the value is not modified after the call
+        """
+        if copy:
+            value = _copy.deepcopy(value)
+        entry = CacheEntry(value, time.monotonic() + self.ttl, etag, last_modified)
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def refresh(self, key):
+        """
+        extends the time to live of a revalidated entry
+        :param key: cache key
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                entry.expires = time.monotonic() + self.ttl
+
+    def invalidate(self, match=None):
+        """
+        removes the entries
+        :param match: remove only the keys containing this string (e.g. '/drops_sensors/anag'), 
+                      all the entries if None
+        """
+        with self.__lock:
+            if match is None:
+                self.__entries.clear()
+                return
+            for key in [k for k in self.__entries if match in str(k)]:
+                del self.__entries[key]
+
+    def __len__(self) -> int:
+        return len(self.__entries)
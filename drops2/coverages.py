@@ -1,6 +1,7 @@
-import io
 import logging
+import os
 from datetime import datetime
+from typing import List
 
 import numpy as np
 import pandas as pd
@@ -9,11 +10,52 @@ import requests
 import xarray as xr
 from requests.utils import quote
 
-from .utils import (REQUESTS_TIMEOUT, 
+from . import metrics, subset
+from .cache import DEFAULT_RECENT_WINDOW
+from .utils import (DEFAULT_MAX_WORKERS, REQUESTS_TIMEOUT, 
                     DropsCredentials, DropsException,
+                    as_list,
                     date_format, 
                     datetimes_from_strings, 
-                    format_dates)
+                    format_dates,
+                    get_json,
+                    map_concurrent,
+                    open_dataset_response,
+                    write_response)
+
+# query templates shared with the async client (drops2.aio)
+_SUPPORTED_URL = '/drops_coverages/supported/'
+_DATES_URL = '/drops_coverages/dates/%(data_id)s/%(date_from)s/%(date_to)s/'
+_VARIABLES_URL = '/drops_coverages/variables/%(data_id)s/%(date_ref)s/'
+_LEVELS_URL = '/drops_coverages/levels/%(data_id)s/%(date_ref)s/%(variable)s/'
+_TIMELINE_URL = '/drops_coverages/timeline/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/'
+_COVERAGE_URL = '/drops_coverages/coverage/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/%(date_selected)s/'
+_AGGREGATION_URL = '/drops_coverages/aggregation/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/'
+
+
+def _query_url(auth, query_url, query_data=None):
+    """
+    builds the request url for the selected query
+    :param auth: authentication object
+    :param query_url: query template
+    :param query_data: values for the query template
+    :return: request url
+    """
+    if query_data is None:
+        return auth.dds_url() + query_url
+    return auth.dds_url() + quote(query_url % query_data)
+
+
+def _decode_dates(dates_str, date_as_string):
+    """
+    converts the dates returned by the server
+    :param dates_str: list of formatted date strings
+    :param date_as_string: keep the dates as strings
+    :return: list of datetime objects or date strings
+    """
+    if date_as_string:
+        return dates_str
+    return datetimes_from_strings(dates_str)
 
 
 def get_supported_data(auth=None):
@@ -25,17 +67,9 @@ def get_supported_data(auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + '/drops_coverages/supported/'
-
-    response = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+    req_url = _query_url(auth, _SUPPORTED_URL)
 
-    if response.status_code != 200:
-        raise DropsException(
-            'Error while fetching supported data',
-            response=response
-        )
-
-    data = response.json()
+    data = get_json(auth, req_url, 'Error while fetching supported data')
     return data
 
 
@@ -50,7 +84,6 @@ def get_dates(data_id, date_from, date_to, date_as_string=False, auth=None):
     :param auth: authentication object (optional)
     :return: list of datetime objects or date strings
     """
-    query_url = '/drops_coverages/dates/%(data_id)s/%(date_from)s/%(date_to)s/'
     query_data = dict(
         data_id=data_id,
         date_from=date_from,
@@ -60,9 +93,9 @@ def get_dates(data_id, date_from, date_to, date_as_string=False, auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + quote(query_url % query_data)
+    req_url = _query_url(auth, _DATES_URL, query_data)
     
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+    r = auth.transport().get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
 
     if r.status_code is not requests.codes.ok:
         raise DropsException(
@@ -71,12 +104,7 @@ def get_dates(data_id, date_from, date_to, date_as_string=False, auth=None):
             response=r
         )
 
-    if date_as_string:
-        dates = r.json()
-    else:
-        dates_str = r.json()
-        dates = datetimes_from_strings(dates_str)
-
+    dates = _decode_dates(r.json(), date_as_string)
     return dates
 
 
@@ -89,7 +117,6 @@ def get_variables(data_id, date_ref, auth=None):
     :param auth: authentication object (optional)
     :return: list of variables
     """
-    query_url = '/drops_coverages/variables/%(data_id)s/%(date_ref)s/'
     query_data = dict(
         data_id=data_id,
         date_ref=date_ref
@@ -98,17 +125,11 @@ def get_variables(data_id, date_ref, auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + quote(query_url % query_data)
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
-
-    if r.status_code is not requests.codes.ok:
-        raise DropsException(
-            "Error while fetching variables for %s for date %s" %
-            (data_id, date_ref),
-            response=r
-        )
-
-    variables = r.json()
+    req_url = _query_url(auth, _VARIABLES_URL, query_data)
+    variables = get_json(
+        auth, req_url,
+        "Error while fetching variables for %s for date %s" % (data_id, date_ref)
+    )
 
     return variables
 
@@ -123,7 +144,6 @@ def get_levels(data_id, date_ref, variable, auth=None):
     :param auth: authentication object (optional)
     :return: list of levels
     """
-    query_url = '/drops_coverages/levels/%(data_id)s/%(date_ref)s/%(variable)s/'
     query_data = dict(
         data_id=data_id,
         date_ref=date_ref,
@@ -132,17 +152,11 @@ def get_levels(data_id, date_ref, variable, auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + quote(query_url % query_data)
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
-
-    if r.status_code != requests.codes.ok:
-        raise DropsException(
-            "Error while fetching levels for %s - %s, variable: %s" %
-            (data_id, variable, date_ref),
-            response=r
-        )
-
-    levels = r.json()
+    req_url = _query_url(auth, _LEVELS_URL, query_data)
+    levels = get_json(
+        auth, req_url,
+        "Error while fetching levels for %s - %s, variable: %s" % (data_id, variable, date_ref)
+    )
     return levels
 
 
@@ -158,7 +172,6 @@ def get_timeline(data_id, date_ref, variable, level, date_as_string=False, auth=
     :param auth: authentication object (optional)
     :return: list of date objects or formatted date strings
     """
-    query_url = '/drops_coverages/timeline/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/'
     query_data = dict(
         data_id=data_id,
         date_ref=date_ref,
@@ -170,8 +183,8 @@ def get_timeline(data_id, date_ref, variable, level, date_as_string=False, auth=
         auth = DropsCredentials.default()
 
 
-    req_url = auth.dds_url() + quote(query_url % query_data)
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+    req_url = _query_url(auth, _TIMELINE_URL, query_data)
+    r = auth.transport().get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
     
     if r.status_code is not requests.codes.ok:
         raise DropsException(
@@ -180,15 +193,96 @@ def get_timeline(data_id, date_ref, variable, level, date_as_string=False, auth=
             response=r
         )
 
-    if date_as_string:
-        dates = r.json()
-    else:
-        dates_str = r.json()
-        dates = datetimes_from_strings(dates_str)
-
+    dates = _decode_dates(r.json(), date_as_string)
     return dates
 
 
+
+def _description_from_frame(df) -> dict:
+    """
+    converts a description dataframe back to the nested dict layout
+    """
+    description = {}
+    for (variable, level), dates in df.groupby(['variable', 'level'], sort=False)['date']:
+        description.setdefault(variable, {})[level] = list(dates)
+    return description
+
+
+def _format_timeline(dates) -> List[str]:
+    return [d if isinstance(d, str) else d.strftime(date_format) for d in dates]
+
+
+@format_dates()
+def describe_coverage(data_id, date_ref, date_as_string=False, as_pandas=False, previous=None,
+                      recent_window=DEFAULT_RECENT_WINDOW, max_workers=DEFAULT_MAX_WORKERS, auth=None):
+    """
+    describes the variables, levels and timelines of a coverage on the reference date,
+    fetching the levels and the timelines concurrently
+    :param data_id: coverage id
+    :param date_ref: selected date
+    :param date_as_string: format the dates as strings instead of date objects
+    :param as_pandas: return a dataframe with columns variable, level, date (one row per date)
+    :param previous: a previous description of the same coverage (optional). The levels of all the variables
+                     are queried again, the timelines only for the new (variable, level) pairs and for those
+                     whose last date is within recent_window from now (the run may still be produced)
+    :param recent_window: timedelta, timelines ending after now - recent_window are refreshed
+    :param max_workers: maximum number of concurrent requests
+    :param auth: authentication object (optional)
+    :return: dict {variable: {level: timeline}} or pandas dataframe
+    """
+    if auth is None:
+        auth = DropsCredentials.default()
+
+    if previous is None:
+        previous = {}
+    elif isinstance(previous, pd.DataFrame):
+        previous = _description_from_frame(previous)
+
+    variables = get_variables(data_id, date_ref, auth=auth)
+
+    # one cheap call per variable, new levels appear while the run is produced
+    levels = dict(zip(variables, map_concurrent(
+        lambda v: get_levels(data_id, date_ref, v, auth=auth),
+        variables, max_workers=max_workers
+    )))
+
+    # the date format sorts chronologically
+    recent = (datetime.now(pytz.utc) - recent_window).strftime(date_format)
+    known = {}
+    for v in variables:
+        for l in levels[v]:
+            if l not in previous.get(v, {}):
+                continue
+            dates = _format_timeline(previous[v][l])
+            if len(dates) > 0 and max(dates) < recent:
+                known[(v, l)] = dates
+
+    new_pairs = [(v, l) for v in variables for l in levels[v] if (v, l) not in known]
+    new_timelines = map_concurrent(
+        lambda pair: get_timeline(data_id, date_ref, pair[0], pair[1], date_as_string=True, auth=auth),
+        new_pairs, max_workers=max_workers
+    )
+    timelines = dict(zip(new_pairs, new_timelines))
+    timelines.update(known)
+
+    description = {}
+    for v in variables:
+        description[v] = {}
+        for l in levels[v]:
+            description[v][l] = _decode_dates(timelines[(v, l)], date_as_string)
+
+    if not as_pandas:
+        return description
+
+    rows = [
+        (v, l, d)
+        for v, v_levels in description.items()
+        for l, dates in v_levels.items()
+        for d in dates
+    ]
+    return pd.DataFrame(rows, columns=['variable', 'level', 'date'])
+
+
 def get_data_request(data_id, date_ref, variable, level, date_selected='all', stream=False, auth=None):
     """
     get the data for the selected coverage, variable, level on the selected date and reference date
@@ -197,13 +291,13 @@ def get_data_request(data_id, date_ref, variable, level, date_selected='all', st
     :param variable: selected variable
     :param level: selected level
     :param date_selected: selected date
+    :param stream: stream the response (default False)
     :param auth: authentication object (optional)
     :return: request object and request url
     """
     if auth is None:
         auth = DropsCredentials.default()
 
-    query_url = '/drops_coverages/coverage/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/%(date_selected)s/'
     query_data = dict(
         data_id=data_id,
         date_ref=date_ref,
@@ -211,14 +305,14 @@ def get_data_request(data_id, date_ref, variable, level, date_selected='all', st
         level=level,
         date_selected=date_selected
     )
-    req_url = auth.dds_url() + quote(query_url % query_data)
-    logging.debug('[get_date_request]', req_url)
-    response = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT, stream=stream)
+    req_url = _query_url(auth, _COVERAGE_URL, query_data)
+    response = auth.transport().get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT, stream=stream)
 
     return response, req_url
 
 @format_dates()
-def get_data(data_id, date_ref, variable, level, date_selected='all', auth=None):
+def get_data(data_id, date_ref, variable, level, date_selected='all', auth=None, cache=None,
+             stream_to=None, chunks=None, bbox=None, points=None, interp=subset.NEAREST):
     """
     get the data for the selected coverage, variable, level on the selected date and reference date
     :param data_id: coverage id
@@ -227,9 +321,35 @@ def get_data(data_id, date_ref, variable, level, date_selected='all', auth=None)
     :param level: selected level
     :param date_selected: selected date
     :param auth: authentication object (optional)
-    :return: a xarray dataset
+    :param cache: DiskCache object, cache hits are opened directly from disk (optional)
+    :param stream_to: stream the response to this path, or to a temporary file if True, 
+                      instead of buffering it in memory. Ignored when cache is set (optional)
+    :param chunks: dask chunks for the lazy loading of the dataset, e.g. {} or {'time': 1} (optional)
+    :param bbox: keep only the cells inside (lon_min, lat_min, lon_max, lat_max) (optional)
+    :param points: extract the values at these points, list of (lon, lat) or SensorList (optional)
+    :param interp: interpolation at the points, 'nearest' or 'bilinear'
+    :return: a xarray dataset, with a point dimension replacing lat and lon when points is set
     """
-    response, req_url = get_data_request(data_id, date_ref, variable, level, date_selected, auth=auth)
+    if (bbox is not None or points is not None) and cache is None and stream_to is None:
+        # the server returns the whole grid: keep it on disk and read only the subset
+        stream_to = True
+
+    if cache is not None:
+        if auth is None:
+            auth = DropsCredentials.default()
+
+        cache_key = cache.key(auth.dds_url(), data_id, date_ref, variable, level, date_selected)
+        cached_path = cache.get(cache_key, date_ref)
+        if cached_path is not None:
+            try:
+                return subset.subset(xr.open_dataset(cached_path, chunks=chunks), bbox, points, interp)
+            except FileNotFoundError:
+                # evicted by another process in the meantime
+                pass
+
+    stream = cache is not None or stream_to is not None
+    response, req_url = get_data_request(data_id, date_ref, variable, level, date_selected, 
+                                         stream=stream, auth=auth)
     if response.status_code != requests.codes.ok:
         raise DropsException(
             "Error while fetching data for %s - %s, variable: %s, level: %s, selected date: %s" %
@@ -238,17 +358,120 @@ def get_data(data_id, date_ref, variable, level, date_selected='all', auth=None)
         )
 
     try:
-        raw_data = io.BytesIO(response.content)
-        cf_data = xr.open_dataset(raw_data)
+        if cache is not None:
+            with cache.writer(cache_key) as f:
+                write_response(response, f)
+            with metrics.timed('decode', metrics.endpoint_of(req_url), format='netcdf'):
+                cf_data = xr.open_dataset(cache.path(cache_key), chunks=chunks)
+        else:
+            cf_data = open_dataset_response(response, stream_to, chunks)
     except Exception as exp:
         logging.error('Error loading dataset from %s' % req_url)
         raise exp
+    finally:
+        response.close()
+
+    return subset.subset(cf_data, bbox, points, interp)
+
+
 
-    return cf_data
+def _rename_single_variable(dataset, variable):
+    """
+    names the data variable of a single variable dataset after the requested variable,
+    so that datasets of different variables can be merged
+    """
+    names = list(dataset.data_vars)
+    if len(names) == 1 and names[0] != variable:
+        return dataset.rename({names[0]: variable})
+    return dataset
+
+
+@format_dates(parameters=['date_ref', 'dates_selected'])
+def get_data_multi(data_id, date_ref, variables, levels, dates_selected='all', auth=None, cache=None,
+                   stream_to=None, chunks=None, max_workers=DEFAULT_MAX_WORKERS, 
+                   bbox=None, points=None, interp=subset.NEAREST):
+    """
+    get the data for several variables, levels and selected dates of a coverage as a single dataset.
+    The pieces are downloaded concurrently, concatenated along the `level` and `time` dimensions 
+    and the variables are merged
+    :param data_id: coverage id
+    :param date_ref: reference date
+    :param variables: list of variables
+    :param levels: list of levels, the same for all the variables
+    :param dates_selected: list of selected dates, or 'all'
+    :param auth: authentication object (optional)
+    :param cache: DiskCache object (optional)
+    :param stream_to: a directory where the pieces are streamed, or True for temporary files (optional)
+    :param chunks: dask chunks, with chunks the result is lazy and the pieces are decoded on access (optional)
+    :param max_workers: maximum number of concurrent downloads
+    :param bbox: keep only the cells inside (lon_min, lat_min, lon_max, lat_max) (optional)
+    :param points: extract the values at these points, list of (lon, lat) or SensorList (optional)
+    :param interp: interpolation at the points, 'nearest' or 'bilinear'
+    :return: a xarray dataset
+    """
+    if auth is None:
+        auth = DropsCredentials.default()
+
+    variables = as_list(variables)
+    levels = as_list(levels)
+    dates_selected = as_list(dates_selected)
+
+    items = [(v, l, d) for v in variables for l in levels for d in dates_selected]
+
+    def fetch(item):
+        variable, level, date_selected = item
+        piece_stream_to = stream_to
+        if stream_to is not None and stream_to is not True:
+            piece_stream_to = os.path.join(stream_to, '%s_%s_%s_%s_%s.nc' % (
+                data_id, date_ref, variable, level, date_selected
+            ))
+        dataset = get_data(data_id, date_ref, variable, level, date_selected, auth=auth, cache=cache,
+                           stream_to=piece_stream_to, chunks=chunks, bbox=bbox, points=points, interp=interp)
+        return _rename_single_variable(dataset, variable)
+
+    pieces = iter(map_concurrent(fetch, items, max_workers=max_workers))
+
+    by_variable = []
+    for _ in variables:
+        by_level = []
+        for _ in levels:
+            by_date = [next(pieces) for _ in dates_selected]
+            if len(by_date) == 1:
+                by_level.append(by_date[0])
+            else:
+                by_level.append(xr.concat(by_date, dim='time', data_vars='minimal',
+                                          coords='minimal', compat='override'))
+        by_variable.append(xr.concat(by_level, dim=pd.Index(levels, name='level', dtype=object),
+                                     coords='minimal', compat='override'))
+
+    return xr.merge(by_variable, compat='override', join='outer')
+
+
+def _aggregation_to_pandas(data) -> pd.DataFrame:
+    """
+    converts the aggregation json to a dataframe indexed by the end of the aggregation interval,
+    one column per feature
+    :param data: list of {fid, from, to, values}
+    :return: pandas dataframe
+    """
+    if len(data) == 0:
+        return pd.DataFrame()
+
+    dates_to = np.asarray(data[0]['to'], dtype=np.int64)
+    index = pd.to_datetime(dates_to, unit='ms', utc=True).as_unit('ns')
+
+    columns = [d['fid'] for d in data]
+    # one row per feature, the transposed array is the dataframe block without copies
+    values = np.empty((len(data), len(dates_to)), dtype=np.float64)
+    for i, d in enumerate(data):
+        values[i] = np.asarray(d['values'], dtype=np.float64)
+
+    return pd.DataFrame(values.T, index=index, columns=columns, copy=False)
 
 
 @format_dates()
-def get_aggregation(data_id, date_ref, variable, level, shpfile, shpidfield, as_pandas=True, auth=None):
+def get_aggregation(data_id, date_ref, variable, level, shpfile, shpidfield, as_pandas=True, auth=None, 
+                    cache=None):
     """
     get the aggregation for the selected coverage, variable, level on the selected date and reference date
     :param data_id: coverage id
@@ -259,22 +482,31 @@ def get_aggregation(data_id, date_ref, variable, level, shpfile, shpidfield, as_
     :param shpidfield: shapefile id field
     :param as_pandas: return a pandas dataframe
     :param auth: authentication object (optional)
-    :return: a xarray dataset
+    :param cache: MetadataCache keeping the results for its ttl, e.g. for dashboards 
+                  refreshing the same aggregation (optional)
+    :return: a pandas dataframe or the raw json
     """
     if auth is None:
         auth = DropsCredentials.default()
 
-    query_url = '/drops_coverages/aggregation/%(data_id)s/%(date_ref)s/%(variable)s/%(level)s/'
-   
     query_data = dict(
         data_id=data_id,
         date_ref=date_ref,
         variable=variable,
         level=level
     )
-    req_url = auth.dds_url() + quote(query_url % query_data)
-
-    r = requests.get(
+    req_url = _query_url(auth, _AGGREGATION_URL, query_data)
+
+    if cache is not None:
+        cache_key = auth.cache_identity() + ('aggregation', data_id, date_ref, variable, level, 
+                                             shpfile, shpidfield, as_pandas)
+        cached = cache.get(cache_key)
+        metrics.emit('cache', metrics.endpoint_of(req_url), cache='aggregation', 
+                     result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+
+    r = auth.transport().get(
         req_url, 
         params=dict(
             shpfile=shpfile,
@@ -291,28 +523,82 @@ def get_aggregation(data_id, date_ref, variable, level, shpfile, shpidfield, as_
         )
 
     try:
-        data = r.json()
+        with metrics.timed('decode', metrics.endpoint_of(req_url), format='json'):
+            data = r.json()
     except Exception as exp:
         logging.error('Error loading dataset from %s' % req_url)
         raise exp
 
-    if not as_pandas:
-        return data
-    
-    dates_from, dates_to = data[0]['from'], data[0]['to']
-    
-    # index = [
-    #     (datetime.fromtimestamp(d0/1000, tz=pytz.utc), datetime.fromtimestamp(d1/1000, tz=pytz.utc)) 
-    #     for (d0,d1) in zip(dates_from, dates_to)
-    # ]
-
-    index = [
-        datetime.fromtimestamp(d/1000, tz=pytz.utc) 
-        for d in dates_to
-    ]
+    if as_pandas:
+        with metrics.timed('convert', metrics.endpoint_of(req_url), format='wide'):
+            data = _aggregation_to_pandas(data)
 
-    columns = [d['fid'] for d in data]
-    values = np.array([d['values'] for d in data]).T
-    df = pd.DataFrame(values, index=index, columns=columns)
-    
-    return df
+    if cache is not None:
+        cache.put(cache_key, data)
+
+    return data
+
+
+@format_dates()
+def get_aggregation_batch(data_id, date_refs, variables, levels, shpfile, shpidfield, as_xarray=False,
+                          max_workers=DEFAULT_MAX_WORKERS, auth=None, cache=None):
+    """
+    get the aggregations of a shapefile for several reference dates, variables and levels,
+    fetching them concurrently. A failed combination does not abort the batch,
+    it is reported in the returned errors
+    :param data_id: coverage id
+    :param date_refs: list of reference dates
+    :param variables: list of variables
+    :param levels: list of levels, the same for all the variables
+    :param shpfile: shapefile
+    :param shpidfield: shapefile id field
+    :param as_xarray: return a xarray DataArray with dimensions (date_ref, variable, level, time, fid)
+                      instead of a dataframe
+    :param max_workers: maximum number of concurrent requests
+    :param auth: authentication object (optional)
+    :param cache: MetadataCache passed to get_aggregation (optional)
+    :return: tuple (data, errors): data is a pandas dataframe with index (date_ref, variable, level, time)
+             and one column per feature, or a xarray DataArray; errors is a dict 
+             {(date_ref, variable, level): exception} of the failed combinations.
+             With as_xarray a DropsException is raised when all the combinations fail
+    """
+    if auth is None:
+        auth = DropsCredentials.default()
+
+    date_refs = as_list(date_refs)
+    variables = as_list(variables)
+    levels = as_list(levels)
+
+    items = [(d, v, l) for d in date_refs for v in variables for l in levels]
+    results = map_concurrent(
+        lambda item: get_aggregation(data_id, item[0], item[1], item[2], shpfile, shpidfield,
+                                     auth=auth, cache=cache),
+        items, max_workers=max_workers, return_exceptions=True
+    )
+
+    frames = {}
+    errors = {}
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            logging.warning('Error while fetching aggregation for %s - %s, variable: %s, level: %s: %s' %
+                            (data_id, item[0], item[1], item[2], result))
+            errors[item] = result
+        else:
+            frames[item] = result.rename_axis(index='time', columns='fid')
+
+    if as_xarray and len(frames) == 0 and len(errors) > 0:
+        first_error = next(iter(errors.values()))
+        raise DropsException('All the %d aggregations failed for %s, first error: %s' % 
+                             (len(errors), data_id, first_error)) from first_error
+
+    names = ['date_ref', 'variable', 'level']
+    if len(frames) == 0:
+        index = pd.MultiIndex.from_tuples([], names=names + ['time'])
+        data = pd.DataFrame(index=index, columns=pd.Index([], name='fid'), dtype=np.float64)
+    else:
+        data = pd.concat(frames.values(), keys=list(frames), names=names)
+
+    if as_xarray:
+        data = data.stack().rename('value').to_xarray()
+
+    return data, errors
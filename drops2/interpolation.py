@@ -0,0 +1,241 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.spatial import cKDTree
+
+from .sensors import SensorList
+
+IDW = 'idw'
+LINEAR_REGRESSION = 'linear_regression'
+
+DEFAULT_GEO_WIN = (6.0, 36.0, 18.6, 47.5)
+DEFAULT_IMG_DIM = (630, 575)
+DEFAULT_MAX_NEIGHBOURS = 16
+MIN_DISTANCE = 1e-9  # degrees, a sensor on a cell center gets a finite but dominant weight
+
+# neighbour tables of the worker processes, set once by _init_worker
+_worker_state = None
+
+
+def grid_coordinates(geo_win=DEFAULT_GEO_WIN, img_dim=DEFAULT_IMG_DIM) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    coordinates of the cell centers of a map, with the get_sensor_map semantics
+    :param geo_win: geographical window (lon_min, lat_min, lon_max, lat_max)
+    :param img_dim: dimension of the output image (nrows, ncols)
+    :return: tuple (lats, lons), ascending
+    """
+    lon_min, lat_min, lon_max, lat_max = geo_win
+    nrows, ncols = img_dim
+    d_lat = (lat_max - lat_min) / nrows
+    d_lon = (lon_max - lon_min) / ncols
+    lats = lat_min + (np.arange(nrows) + 0.5) * d_lat
+    lons = lon_min + (np.arange(ncols) + 0.5) * d_lon
+    return lats, lons
+
+
+class NeighbourIndex:
+    """
+    The sensors within radius of every cell of a grid, found once with a KD-tree
+    and reused for all the timesteps
+    """
+
+    def __init__(self, lats, lngs, grid_lats, grid_lons, radius, max_neighbours=DEFAULT_MAX_NEIGHBOURS):
+        """
+        :param lats: latitudes of the sensors
+        :param lngs: longitudes of the sensors
+        :param grid_lats: latitudes of the grid rows
+        :param grid_lons: longitudes of the grid columns
+        :param radius: search radius in degrees of latitude/longitude (euclidean), must be positive
+        :param max_neighbours: maximum number of sensors used for a cell
+        """
+        if not radius > 0:
+            raise ValueError('radius must be positive, got %s' % radius)
+
+        self.n_sensors = len(lats)
+        self.shape = (len(grid_lats), len(grid_lons))
+
+        points = np.column_stack([np.asarray(lngs, dtype=np.float64), np.asarray(lats, dtype=np.float64)])
+        lon_grid, lat_grid = np.meshgrid(grid_lons, grid_lats)
+        cells = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+
+        k = max(1, min(max_neighbours, self.n_sensors))
+        if self.n_sensors == 0:
+            distances = np.full((len(cells), k), np.inf)
+            positions = np.zeros((len(cells), k), dtype=np.intp)
+        else:
+            distances, positions = cKDTree(points).query(cells, k=k, distance_upper_bound=radius)
+            distances = distances.reshape(len(cells), k)
+            positions = positions.reshape(len(cells), k)
+
+        # missing neighbours point to the extra NaN value appended by idw
+        self.positions = positions.astype(np.intp)
+        self.distances = distances
+
+    def weights(self, power=2) -> np.ndarray:
+        """
+        :param power: power of the inverse distance
+        :return: weights of the neighbours, 0 for the missing ones
+        """
+        return 1.0 / np.maximum(self.distances, MIN_DISTANCE) ** power
+
+
+def _idw(values, positions, weights, shape) -> np.ndarray:
+    """
+    inverse distance weighting of one timestep
+    :param values: values of the sensors, NaN for the missing ones
+    :param positions: neighbour positions (n_cells, k), n_sensors for the missing neighbours
+    :param weights: neighbour weights (n_cells, k)
+    :param shape: grid shape
+    :return: grid, NaN where no valid sensor is within radius
+    """
+    neighbours = np.append(values, np.nan)[positions]
+    valid = ~np.isnan(neighbours)
+    w = np.where(valid, weights, 0.0)
+    total = w.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        field = (np.where(valid, neighbours, 0.0) * w).sum(axis=1) / total
+    return field.reshape(shape)
+
+
+def _regression(values, elevation) -> Tuple[float, float]:
+    """
+    least squares fit of values = intercept + slope * elevation on the valid sensors
+    :return: tuple (intercept, slope), slope is 0 when the elevations do not vary
+    """
+    valid = ~np.isnan(values) & ~np.isnan(elevation)
+    if not valid.any():
+        return np.nan, 0.0
+    v, z = values[valid], elevation[valid]
+    if valid.sum() < 2 or np.ptp(z) == 0:
+        return float(v.mean()), 0.0
+    slope, intercept = np.polyfit(z, v, 1)
+    return float(intercept), float(slope)
+
+
+def _interpolate_block(values, method, positions, weights, shape, elevation, dem) -> np.ndarray:
+    """
+    interpolates a block of timesteps
+    :param values: array (n_times, n_sensors)
+    :return: array (n_times, nrows, ncols)
+    """
+    fields = np.empty((len(values),) + shape, dtype=np.float64)
+    for t, row in enumerate(values):
+        if method == IDW:
+            fields[t] = _idw(row, positions, weights, shape)
+            continue
+
+        # trend on elevation, plus the interpolated residuals (the trend alone away from the sensors)
+        intercept, slope = _regression(row, elevation)
+        residuals = _idw(row - (intercept + slope * elevation), positions, weights, shape)
+        fields[t] = intercept + slope * dem + np.nan_to_num(residuals)
+    return fields
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _interpolate_worker(values) -> np.ndarray:
+    return _interpolate_block(values, **_worker_state)
+
+
+def _align(data, sensors, elevation):
+    """
+    keeps the columns of data with known coordinates
+    :return: tuple (data, located sensors, elevation array or None)
+    """
+    if not isinstance(sensors, SensorList):
+        sensors = SensorList(sensors)
+    located = sensors.get_by_ids(data.columns, missing='ignore')
+    ids = list(located.ids)
+    data = data[ids]
+
+    if elevation is not None:
+        if isinstance(elevation, pd.Series):
+            elevation = elevation.reindex(ids).to_numpy(dtype=np.float64)
+        else:
+            by_id = dict(zip(sensors.ids, np.asarray(elevation, dtype=np.float64)))
+            elevation = np.array([by_id[i] for i in ids], dtype=np.float64)
+    return data, located, elevation
+
+
+def _dem_grid(dem, lats, lons) -> np.ndarray:
+    if isinstance(dem, xr.DataArray):
+        dem = dem.interp(lat=lats, lon=lons)
+    dem = np.asarray(dem, dtype=np.float64)
+    if dem.shape != (len(lats), len(lons)):
+        raise ValueError('dem shape %s does not match the grid (%d, %d)' % (dem.shape, len(lats), len(lons)))
+    return dem
+
+
+def interpolate(data: pd.DataFrame, sensors, geo_win=DEFAULT_GEO_WIN, img_dim=DEFAULT_IMG_DIM, radius=0.5,
+                method=IDW, elevation=None, dem=None, power=2, max_neighbours=DEFAULT_MAX_NEIGHBOURS,
+                max_workers=None, block_size=8) -> xr.DataArray:
+    """
+    interpolates the sensor data on a regular grid, as an offline alternative to sensors.get_sensor_map.
+    example:
+
+    df = sensors.get_sensor_data(sensor_class, sensor_list, date_from, date_to, as_pandas=True)
+    grid = interpolation.interpolate(df, sensor_list, geo_win=(6.0, 36.0, 18.6, 47.5), img_dim=(630, 575))
+
+    :param data: dataframe with a column per sensor id and a row per timestep (get_sensor_data wide format)
+    :param sensors: SensorList or list of Sensor objects with the coordinates of the columns
+    :param geo_win: geographical window (lon_min, lat_min, lon_max, lat_max)
+    :param img_dim: dimension of the output image (nrows, ncols)
+    :param radius: search radius of the sensors in degrees of latitude/longitude (euclidean),
+                   must be positive: GRISO (negative radius of get_sensor_map) is not available offline
+    :param method: 'idw' (inverse distance weighting) or 'linear_regression'
+                   (linear trend on elevation plus inverse distance weighting of the residuals)
+    :param elevation: elevations of the sensors, pandas series indexed by sensor id or array
+                      in the order of sensors (required by linear_regression)
+    :param dem: elevation of the grid cells, array of img_dim shape or xarray DataArray with lat and lon
+                coordinates (required by linear_regression)
+    :param power: power of the inverse distance
+    :param max_neighbours: maximum number of sensors used for a cell
+    :param max_workers: spread the timesteps across this many processes (optional, default in process)
+    :param block_size: timesteps sent to a process at once
+    :return: xarray DataArray with dimensions (time, lat, lon)
+    """
+    if method not in (IDW, LINEAR_REGRESSION):
+        raise ValueError('unknown interpolation method %s' % method)
+    if method == LINEAR_REGRESSION and (elevation is None or dem is None):
+        raise ValueError('linear_regression requires the sensor elevation and the dem')
+
+    lats, lons = grid_coordinates(geo_win, img_dim)
+    data, located, elevation = _align(data, sensors, elevation)
+    index = NeighbourIndex(located.lats, located.lngs, lats, lons, radius, max_neighbours)
+
+    state = dict(
+        method=method,
+        positions=index.positions,
+        weights=index.weights(power),
+        shape=index.shape,
+        elevation=elevation,
+        dem=_dem_grid(dem, lats, lons) if method == LINEAR_REGRESSION else None,
+    )
+
+    values = data.to_numpy(dtype=np.float64)
+    blocks = [values[i:i + block_size] for i in range(0, len(values), block_size)]
+    if max_workers is None or max_workers <= 1 or len(blocks) <= 1:
+        fields = [_interpolate_block(block, **state) for block in blocks]
+    else:
+        workers = min(max_workers, len(blocks), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,)) as executor:
+            fields = list(executor.map(_interpolate_worker, blocks))
+
+    grid = np.concatenate(fields) if fields else np.empty((0,) + index.shape)
+    times = data.index
+    if isinstance(times, pd.DatetimeIndex) and times.tz is not None:
+        times = times.tz_convert(None)
+    return xr.DataArray(
+        grid,
+        dims=('time', 'lat', 'lon'),
+        coords=dict(time=np.asarray(times), lat=lats, lon=lons),
+        name='map',
+        attrs=dict(method=method, radius=radius, power=power),
+    )
@@ -0,0 +1,246 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+from urllib.parse import urlsplit
+
+# upper bounds of the latency histograms, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+class Event:
+    """
+    A measurement emitted by the DDS calls:
+    - request: time to the response headers (connection included), labels method and status
+    - download: time spent receiving the body, nbytes
+    - decode: time spent decoding json or NetCDF, label format
+    - convert: time spent converting the decoded data (e.g. sensor series to pandas)
+    - retry, circuit_open: retried and rejected requests
+    - cache: lookups in the caches, labels cache and result (hit or miss)
+    """
+    __slots__ = ('name', 'endpoint', 'seconds', 'nbytes', 'labels')
+
+    def __init__(self, name, endpoint, seconds=None, nbytes=None, labels=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.seconds = seconds
+        self.nbytes = nbytes
+        self.labels = labels or {}
+
+    def __repr__(self):
+        return 'Event(%s, %s, seconds=%s, nbytes=%s, labels=%s)' % (
+            self.name, self.endpoint, self.seconds, self.nbytes, self.labels
+        )
+
+
+def add_hook(hook: Callable[[Event], None]):
+    """
+    registers a callback receiving every Event
+    :param hook: callable accepting an Event, it must be fast and thread-safe
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[Event], None]):
+    """
+    unregisters a callback
+    :param hook: callable previously registered with add_hook
+    """
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    """
+    :return: True if at least a hook is registered
+    """
+    return bool(_hooks)
+
+
+def endpoint_of(url) -> str:
+    """
+    :param url: request url
+    :return: endpoint family of the url, e.g. 'drops_coverages/coverage'
+    """
+    parts = [p for p in urlsplit(url).path.split('/') if p]
+    for i, part in enumerate(parts):
+        if part.startswith('drops_'):
+            return '/'.join(parts[i:i + 2])
+    return '/'.join(parts[-2:])
+
+
+def emit(name, endpoint, seconds=None, nbytes=None, **labels):
+    """
+    sends an Event to the registered hooks, does nothing without hooks
+    """
+    if not _hooks:
+        return
+
+    event = Event(name, endpoint, seconds, nbytes, labels)
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            logging.exception('[metrics] error in hook %r', hook)
+
+
+@contextmanager
+def timed(name, endpoint, **labels):
+    """
+    context manager emitting an Event with the duration of the block.
+    The yielded dict can be used to add nbytes or labels from within the block
+    """
+    fields = dict(labels)
+    start = time.perf_counter()
+    yield fields
+    if _hooks:
+        nbytes = fields.pop('nbytes', None)
+        emit(name, endpoint, time.perf_counter() - start, nbytes, **fields)
+
+
+def instrument_chunks(chunks: Iterable[bytes], endpoint) -> Iterator[bytes]:
+    """
+    wraps the chunks of a streamed body, emitting a download Event with the time spent
+    waiting for the chunks (the consumer time is excluded) and the number of bytes
+    :param chunks: iterable of bytes (e.g. response.iter_content())
+    :param endpoint: endpoint family
+    :return: generator of the same chunks
+    """
+    if not _hooks:
+        yield from chunks
+        return
+
+    waiting = 0.0
+    nbytes = 0
+    iterator = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                waiting += time.perf_counter() - start
+                break
+            waiting += time.perf_counter() - start
+            nbytes += len(chunk)
+            yield chunk
+    finally:
+        emit('download', endpoint, waiting, nbytes)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, n_buckets):
+        self.counts = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class PrometheusExporter:
+    """
+    Hook aggregating the events in Prometheus metrics, rendered in the text exposition format:
+    drops2_<event>_total counters, drops2_<event>_seconds histograms and drops2_<event>_bytes_total counters,
+    labelled by endpoint and by the event labels.
+    example:
+
+    exporter = PrometheusExporter()
+    metrics.add_hook(exporter)
+    ...
+    print(exporter.render())
+    """
+
+    def __init__(self, prefix='drops2', buckets=DEFAULT_BUCKETS):
+        """
+        :param prefix: prefix of the metric names
+        :param buckets: upper bounds of the latency histograms in seconds
+        """
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__bytes = {}
+        self.__histograms = {}
+
+    def __call__(self, event: Event):
+        labels = (('endpoint', event.endpoint),) + tuple(sorted((k, str(v)) for k, v in event.labels.items()))
+        key = (event.name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + 1
+            if event.nbytes is not None:
+                self.__bytes[key] = self.__bytes.get(key, 0) + event.nbytes
+            if event.seconds is not None:
+                histogram = self.__histograms.get(key)
+                if histogram is None:
+                    histogram = self.__histograms[key] = _Histogram(len(self.buckets))
+                position = bisect.bisect_left(self.buckets, event.seconds)
+                if position < len(self.buckets):
+                    histogram.counts[position] += 1
+                histogram.sum += event.seconds
+                histogram.count += 1
+
+    def reset(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__bytes.clear()
+            self.__histograms.clear()
+
+    def render(self) -> str:
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            nbytes = sorted(self.__bytes.items())
+            histograms = sorted(
+                (key, list(h.counts), h.sum, h.count) for key, h in self.__histograms.items()
+            )
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for (event_name, labels), value in counters:
+            name = '%s_%s_total' % (self.prefix, event_name)
+            declare(name, 'counter')
+            lines.append('%s%s %d' % (name, _format_labels(labels), value))
+
+        for (event_name, labels), value in nbytes:
+            name = '%s_%s_bytes_total' % (self.prefix, event_name)
+            declare(name, 'counter')
+            lines.append('%s%s %d' % (name, _format_labels(labels), value))
+
+        for (event_name, labels), counts, total, count in histograms:
+            name = '%s_%s_seconds' % (self.prefix, event_name)
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', repr(bound)),)), cumulative))
+            lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %r' % (name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
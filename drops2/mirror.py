@@ -0,0 +1,251 @@
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from .sensors import _sensor_ids, iter_sensor_data
+from .utils import DropsCredentials, DropsException
+
+DEFAULT_LOOKBACK = timedelta(hours=6)       # late corrections are overwritten within this window
+DEFAULT_INITIAL_WINDOW = timedelta(days=7)  # history fetched for the sensors never seen before
+DEFAULT_BATCH_SIZE = 500                    # sensors per request
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS observations (
+    sensor_id TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    value REAL,
+    samples INTEGER,
+    PRIMARY KEY (sensor_id, time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS watermarks (
+    sensor_id TEXT PRIMARY KEY,
+    last_seen INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+_UPSERT = """
+INSERT INTO observations (sensor_id, time, value, samples) VALUES (?, ?, ?, ?)
+ON CONFLICT (sensor_id, time) DO UPDATE SET value = excluded.value, samples = excluded.samples
+"""
+
+_UPDATE_WATERMARK = """
+INSERT INTO watermarks (sensor_id, last_seen) VALUES (?, ?)
+ON CONFLICT (sensor_id) DO UPDATE SET last_seen = max(last_seen, excluded.last_seen)
+"""
+
+
+def _epoch_seconds(date) -> int:
+    if date.tzinfo is None:
+        date = pytz.utc.localize(date)
+    return int(date.timestamp())
+
+
+def _utc_datetime(seconds) -> datetime:
+    return datetime.fromtimestamp(seconds, tz=pytz.utc)
+
+
+class SensorMirror:
+    """
+    Rolling local copy of the observations of a sensor class, stored in a SQLite database.
+    A high-water mark per sensor records the last observation received (or the end of the
+    last requested window for a sensor without observations), each update
+    requests only the window [last_seen - lookback, now] (so that late corrections within
+    lookback overwrite the stored values) in batched requests, and upserts the series.
+    example:
+
+    mirror = SensorMirror('/data/pluvio.sqlite', 'PLUVIOMETRO')
+    mirror.update(sensors.get_sensor_list('PLUVIOMETRO'))   # every few minutes
+    df = mirror.read(date_from=datetime.now() - timedelta(days=1))
+    """
+
+    def __init__(self, path, sensor_class, lookback=DEFAULT_LOOKBACK,
+                 initial_window=DEFAULT_INITIAL_WINDOW, batch_size=DEFAULT_BATCH_SIZE, auth=None):
+        """
+        :param path: path of the SQLite database (created if missing)
+        :param sensor_class: sensor class string
+        :param lookback: window before the high-water mark requested again on every update
+        :param initial_window: history requested for the sensors not yet in the mirror
+        :param batch_size: maximum number of sensors per request
+        :param auth: authentication object (optional)
+        """
+        if auth is None:
+            auth = DropsCredentials.default()
+
+        self.path = path
+        self.sensor_class = sensor_class
+        self.lookback = lookback
+        self.initial_window = initial_window
+        self.batch_size = batch_size
+        self.auth = auth
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__transaction() as db:
+            db.executescript(_SCHEMA)
+            row = db.execute("SELECT value FROM meta WHERE key = 'sensor_class'").fetchone()
+            if row is None:
+                db.execute("INSERT INTO meta (key, value) VALUES ('sensor_class', ?)", (sensor_class,))
+            elif row[0] != sensor_class:
+                raise DropsException(f'the mirror {path} contains sensor class {row[0]}, not {sensor_class}')
+
+    @contextmanager
+    def __transaction(self):
+        with self.__lock:
+            with self.__connection:
+                yield self.__connection
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def watermarks(self, sensors=None) -> Dict[str, datetime]:
+        """
+        :param sensors: SensorList Object, or list of Sensors or list of sensors id (all if None)
+        :return: dict {sensor id: date of the last observation}
+        """
+        with self.__transaction() as db:
+            rows = db.execute('SELECT sensor_id, last_seen FROM watermarks').fetchall()
+
+        watermarks = {sensor_id: _utc_datetime(last_seen) for sensor_id, last_seen in rows}
+        if sensors is None:
+            return watermarks
+        return {i: watermarks[i] for i in _sensor_ids(sensors) if i in watermarks}
+
+    def __windows(self, ids, now) -> List[tuple]:
+        """
+        groups the sensors by start of the window to request. Sensors whose start is
+        within lookback of the earliest one of the group share a request
+        :return: list of (date_from, ids)
+        """
+        watermarks = self.watermarks()
+        default_start = now - self.initial_window
+        starts = sorted(
+            ((watermarks[i] - self.lookback) if i in watermarks else default_start, i)
+            for i in ids
+        )
+
+        groups = []
+        for start, sensor_id in starts:
+            if groups and start - groups[-1][0] <= self.lookback and len(groups[-1][1]) < self.batch_size:
+                groups[-1][1].append(sensor_id)
+            else:
+                groups.append((start, [sensor_id]))
+        return groups
+
+    def __upsert(self, sensor_id, times, values, valid_samples) -> int:
+        if len(times) == 0:
+            return 0
+
+        seconds = times.astype('datetime64[s]').astype(np.int64)
+        if valid_samples is None:
+            samples = [None] * len(seconds)
+        else:
+            samples = valid_samples.tolist()
+
+        with self.__transaction() as db:
+            db.executemany(_UPSERT, zip([sensor_id] * len(seconds), seconds.tolist(), values.tolist(), samples))
+            db.execute(_UPDATE_WATERMARK, (sensor_id, int(seconds.max())))
+        return len(seconds)
+
+    def update(self, sensors, now=None) -> Dict[str, int]:
+        """
+        fetches the new observations of the selected sensors and upserts them in the mirror.
+        The watermark of a sensor without observations in the window is kept, so that a backlog
+        uploaded later is still requested: a sensor not yet in the mirror gets the start of its
+        first window (plus lookback), not to request the initial window again and again
+        :param sensors: SensorList Object, or list of Sensors or list of sensors id
+        :param now: end of the requested windows (default current time)
+        :return: dict {sensor id: number of observations written}
+        """
+        if now is None:
+            now = datetime.now(pytz.utc)
+        elif now.tzinfo is None:
+            now = pytz.utc.localize(now)
+        else:
+            # the dates are sent to the DDS formatted in utc
+            now = now.astimezone(pytz.utc)
+
+        written = {}
+        for date_from, ids in self.__windows(_sensor_ids(sensors), now):
+            logging.debug('[SensorMirror] %d sensors from %s', len(ids), date_from)
+            series = iter_sensor_data(self.sensor_class, ids, date_from, now, auth=self.auth)
+            for sensor_id, times, values, valid_samples in series:
+                written[sensor_id] = self.__upsert(sensor_id, times, values, valid_samples)
+
+            # the next window of the sensors without observations starts again from date_from
+            # (the watermark only moves forward, an existing one is never lowered)
+            empty = [i for i in ids if written.get(i, 0) == 0]
+            first_seen = _epoch_seconds(min(now, date_from + self.lookback))
+            with self.__transaction() as db:
+                db.executemany(_UPDATE_WATERMARK, [(i, first_seen) for i in empty])
+            for sensor_id in empty:
+                written[sensor_id] = 0
+
+        return written
+
+    def read(self, sensors=None, date_from=None, date_to=None, df_format='wide') -> pd.DataFrame:
+        """
+        reads the mirrored observations
+        :param sensors: SensorList Object, or list of Sensors or list of sensors id (all if None)
+        :param date_from: date from (optional)
+        :param date_to: date to (optional)
+        :param df_format: 'wide' (default, one column per sensor) or 'long' (sensor, time, value, samples)
+        :return: pandas dataframe
+        """
+        if df_format not in ('wide', 'long'):
+            raise DropsException(f'df_format must be one of "wide", "long" [{df_format}]')
+
+        query = 'SELECT sensor_id, time, value, samples FROM observations WHERE 1 = 1'
+        params = []
+        if date_from is not None:
+            query += ' AND time >= ?'
+            params.append(_epoch_seconds(date_from))
+        if date_to is not None:
+            query += ' AND time <= ?'
+            params.append(_epoch_seconds(date_to))
+        if sensors is not None:
+            ids = _sensor_ids(sensors)
+            query += ' AND sensor_id IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps([str(i) for i in ids]))
+
+        with self.__transaction() as db:
+            rows = db.execute(query, params).fetchall()
+
+        sensor_col, time_col, value_col, samples_col = zip(*rows) if rows else ((), (), (), ())
+        df = pd.DataFrame({
+            'sensor': np.asarray(sensor_col, dtype=object),
+            'time': pd.to_datetime(np.asarray(time_col, dtype=np.int64), unit='s', utc=True),
+            'value': np.asarray(value_col, dtype=np.float64),
+            'samples': np.asarray(samples_col, dtype=np.float64),
+        })
+
+        if df_format == 'long':
+            return df
+        return df.pivot(index='time', columns='sensor', values='value')
+
+    def prune(self, older_than) -> int:
+        """
+        removes the observations older than a date, keeping the high-water marks
+        :param older_than: date
+        :return: number of removed observations
+        """
+        with self.__transaction() as db:
+            cursor = db.execute('DELETE FROM observations WHERE time < ?', (_epoch_seconds(older_than),))
+            return cursor.rowcount
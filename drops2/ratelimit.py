@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+# endpoint families of the DDS api, used as keys of the RateLimiter limits
+COVERAGE_DATA = '/drops_coverages/coverage'
+COVERAGE_AGGREGATION = '/drops_coverages/aggregation'
+COVERAGE_CATALOGUE = '/drops_coverages/'
+SENSOR_MAP = '/drops_sensors/map'
+SENSOR_SERIE = '/drops_sensors/serie'
+SENSOR_CATALOGUE = '/drops_sensors/'
+
+POLL_INTERVAL = 0.05  # seconds between two attempts on the shared in-flight slots
+
+
+def _require_fcntl():
+    if fcntl is None:
+        raise RuntimeError('the shared (lock_dir) limits require fcntl, not available on this platform')
+
+
+class TokenBucket:
+    """
+    Token bucket shared between the threads of the process:
+    rate tokens per second are added up to burst, every request takes one
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: tokens per second
+        :param burst: maximum number of tokens
+        """
+        self.rate = rate
+        self.burst = burst
+
+        self.__lock = threading.Lock()
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+
+    def _take(self, now) -> float:
+        """
+        takes a token if available
+        :return: 0 if the token was taken, otherwise the seconds to wait for the next one
+        """
+        with self.__lock:
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0.0
+            return (1 - self.__tokens) / self.rate
+
+    def acquire(self):
+        """
+        blocks until a token is available
+        """
+        while True:
+            wait = self._take(time.monotonic())
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    Token bucket shared between processes through a state file locked with flock
+    """
+
+    def __init__(self, path, rate, burst=1):
+        """
+        :param path: state file, created if missing
+        :param rate: tokens per second
+        :param burst: maximum number of tokens
+        """
+        _require_fcntl()
+        super().__init__(rate, burst)
+        self.path = path
+
+    def _take(self, now) -> float:
+        # wall clock, the monotonic clock is not comparable between processes
+        now = time.time()
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    tokens, updated = (float(v) for v in f.read().split())
+                except ValueError:
+                    tokens, updated = self.burst, now
+
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                f.seek(0)
+                f.truncate()
+                f.write('%r %r' % (tokens, now))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+
+class _Slot:
+    """
+    an acquired in-flight slot, released once
+    """
+
+    def __init__(self, release):
+        self.__release = release
+        self.__lock = threading.Lock()
+
+    def release(self):
+        with self.__lock:
+            release, self.__release = self.__release, None
+        if release is not None:
+            release()
+
+
+class InFlightGovernor:
+    """
+    Bounds the number of requests in flight, between the threads of the process
+    or between processes with lock_dir (one flock'ed file per slot, released by
+    the operating system if a process dies)
+    """
+
+    def __init__(self, max_in_flight, lock_dir=None, name='default'):
+        """
+        :param max_in_flight: maximum number of concurrent requests
+        :param lock_dir: directory of the slot files, to share the limit between processes (optional)
+        :param name: prefix of the slot files
+        """
+        self.max_in_flight = max_in_flight
+        self.lock_dir = lock_dir
+        self.name = name
+
+        self.__semaphore = threading.BoundedSemaphore(max_in_flight)
+        if lock_dir is not None:
+            _require_fcntl()
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def __acquire_file_slot(self):
+        while True:
+            for i in range(self.max_in_flight):
+                f = open(os.path.join(self.lock_dir, '%s.%d.lock' % (self.name, i)), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except BlockingIOError:
+                    f.close()
+            time.sleep(POLL_INTERVAL)
+
+    def acquire(self) -> _Slot:
+        """
+        blocks until a slot is free
+        :return: the slot, to release when the request is completed
+        """
+        self.__semaphore.acquire()
+        if self.lock_dir is None:
+            return _Slot(self.__semaphore.release)
+
+        try:
+            f = self.__acquire_file_slot()
+        except BaseException:
+            self.__semaphore.release()
+            raise
+
+        def release():
+            # closing the file releases the flock
+            f.close()
+            self.__semaphore.release()
+
+        return _Slot(release)
+
+
+class EndpointLimit:
+    """
+    Limits of an endpoint family: requests per second (token bucket) and requests in flight
+    """
+
+    def __init__(self, rate=None, burst=1, max_in_flight=None, lock_dir=None, name='default'):
+        """
+        :param rate: maximum requests per second (optional)
+        :param burst: requests allowed at once above the rate
+        :param max_in_flight: maximum number of concurrent requests (optional)
+        :param lock_dir: share the limits between the processes using this directory (optional)
+        :param name: name of the state files in lock_dir
+        """
+        self.bucket = None
+        if rate is not None:
+            if lock_dir is None:
+                self.bucket = TokenBucket(rate, burst)
+            else:
+                os.makedirs(lock_dir, exist_ok=True)
+                self.bucket = FileTokenBucket(os.path.join(lock_dir, name + '.bucket'), rate, burst)
+
+        self.governor = None
+        if max_in_flight is not None:
+            self.governor = InFlightGovernor(max_in_flight, lock_dir, name)
+
+    def acquire(self):
+        """
+        waits for a token and a free slot
+        :return: the in-flight slot or None
+        """
+        if self.bucket is not None:
+            self.bucket.acquire()
+        if self.governor is not None:
+            return self.governor.acquire()
+        return None
+
+
+class RateLimiter:
+    """
+    Client-side limits per endpoint family, applied by the DropsTransport to every request.
+    The family of a request is the longest key contained in the url path.
+    example:
+
+    limiter = RateLimiter({
+        ratelimit.COVERAGE_DATA: dict(rate=2, burst=4, max_in_flight=4),
+        ratelimit.SENSOR_MAP: dict(max_in_flight=2),
+        ratelimit.SENSOR_SERIE: dict(rate=10, max_in_flight=8),
+    }, lock_dir='/tmp/drops2-limits')    # shared by all the processes of the host
+    transport = DropsTransport(rate_limiter=limiter)
+    """
+
+    def __init__(self, limits, default=None, lock_dir=None):
+        """
+        :param limits: dict {endpoint family: EndpointLimit or dict of EndpointLimit arguments}
+        :param default: limit of the requests not matching any family (optional)
+        :param lock_dir: share the limits between processes using this directory (optional)
+        """
+        self.limits = {}
+        for family, limit in limits.items():
+            self.limits[family] = self.__build(family, limit, lock_dir)
+        self.default = self.__build('default', default, lock_dir) if default is not None else None
+
+        # longest families first, '/drops_sensors/serie' wins over '/drops_sensors/'
+        self.__families = sorted(self.limits, key=len, reverse=True)
+
+    @staticmethod
+    def __build(family, limit, lock_dir) -> EndpointLimit:
+        if isinstance(limit, EndpointLimit):
+            return limit
+        limit = dict(limit)
+        limit.setdefault('lock_dir', lock_dir)
+        limit.setdefault('name', family.strip('/').replace('/', '_') or 'root')
+        return EndpointLimit(**limit)
+
+    def limit_for(self, url) -> EndpointLimit:
+        """
+        :param url: request url
+        :return: the EndpointLimit of the url family, or the default one
+        """
+        path = urlsplit(url).path
+        for family in self.__families:
+            if family in path:
+                return self.limits[family]
+        return self.default
+
+    def acquire(self, url):
+        """
+        waits for the limits of the url family
+        :param url: request url
+        :return: the in-flight slot to release when the request is completed, or None
+        """
+        limit = self.limit_for(url)
+        if limit is None:
+            return None
+        return limit.acquire()
+
+
+def hold_until_closed(response, slot):
+    """
+    keeps the in-flight slot of a streamed response until the response is closed
+    (or garbage collected)
+    :param response: requests response
+    :param slot: in-flight slot
+    """
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            slot.release()
+
+    response.close = close_and_release
+    weakref.finalize(response, slot.release)
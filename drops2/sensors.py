@@ -1,64 +1,117 @@
-import io
 import logging
 from builtins import filter # 2 and 3 compatibility
-from dataclasses import dataclass, field, asdict
-from datetime import timedelta
+from dataclasses import dataclass, asdict
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import chain
 from numbers import Number
 import re
-from typing import Any, List, Tuple
+from typing import Any, Iterable, Iterator, List, Tuple
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import requests
+import shapely
 import xarray as xr
 from pandas import Timedelta
 from requests.utils import quote
-from shapely.geometry import Point
 
-from .utils import (REQUESTS_TIMEOUT, DropsCredentials, DropsException,
-                    datetimes_from_strings, format_dates)
+from . import metrics
+from .utils import (DEFAULT_MAX_WORKERS, REQUESTS_TIMEOUT, STREAM_CHUNK_SIZE,
+                    DropsCredentials, DropsException, date_format,
+                    datetime64_from_strings, datetimes_from_strings,
+                    format_dates, get_json, iter_json_array, map_concurrent,
+                    open_dataset_response)
 
+# query templates shared with the async client (drops2.aio)
+_CLASSES_URL = '/drops_sensors/classes'
+_AGGREGATIONS_URL = '/drops_sensors/aggregations'
+_ANAG_URL = '/drops_sensors/anag/%(sensor_class)s/%(group)s'
+_SERIE_URL = '/drops_sensors/serie'
+_SERIE_AGGR_URL = '/drops_sensors/serieaggr'
+_SERIE_AGGR_SMART_URL = '/drops_sensors/serieaggr-smart'
+_MAP_URL = '/drops_sensors/map/'
 
-def __raw_data_to_pandas(data):
+EARTH_RADIUS_KM = 6371.0
+
+
+def __raw_data_to_pandas(data, df_format='wide'):
     """
-    converts the json data from the server to a dataframe
-    :param data: list of stations data
-    :param auth: authentication object (optional)
+    converts the json data from the server to a dataframe.
+    All the timelines are parsed in one pass and pivoted at once, only the first 
+    record of each sensor and the first value of each timestamp are kept
+    :param data: list of stations data, as decoded json or with numpy arrays (streamed responses)
+    :param df_format: 'wide' for a column per sensor (and per sensor valid samples), 
+                      'long' for a tidy frame with sensor, time, value (and samples) columns
     :return: pandas dataframe
     """
-    
-    series = {}
+    if df_format not in ('wide', 'long'):
+        raise DropsException(f'df_format must be one of "wide", "long" [{df_format}]')
+
+    if len(data) == 0:
+        return pd.DataFrame()
+
+    records = {}
+    for d in data:
+        records.setdefault(d['sensorId'], d)
+
+    sensor_ids = list(records.keys())
     # check if the dataset has validSamples column
     has_valid_samples = 'validSamples' in data[0]
 
-    for d in data:
-        sensor_id = d['sensorId']
-        if sensor_id in series:
-            continue
-        values = d['values']
-        
-        timeline = d['timeline']
-        index = pd.to_datetime(timeline, utc=True)
-        column = pd.Series(values, index=index, dtype=np.float64)        
-        column = column[~column.index.duplicated(keep='first')]        
-        series[sensor_id] = column
-    
-    df = pd.DataFrame(series)
+    lengths = np.fromiter((len(d['timeline']) for d in records.values()), dtype=np.int64, count=len(records))
+    values = np.concatenate([np.asarray(d['values'], dtype=np.float64) for d in records.values()])
+    if has_valid_samples:
+        samples = np.concatenate([np.asarray(d['validSamples'], dtype=np.float64) for d in records.values()])
+
+    sensor_codes = np.repeat(np.arange(len(sensor_ids)), lengths)
+    first_timeline = data[0]['timeline']
+    if isinstance(first_timeline, np.ndarray) and np.issubdtype(first_timeline.dtype, np.datetime64):
+        # already parsed while streaming
+        timeline = np.concatenate([d['timeline'] for d in records.values()])
+        time_codes, time_values = pd.factorize(timeline, sort=True)
+        time_index = pd.DatetimeIndex(time_values).tz_localize('UTC').as_unit('ns')
+    else:
+        timeline = np.concatenate([np.asarray(d['timeline'], dtype=object) for d in records.values()])
+        # the date format sorts chronologically, parse only the distinct timestamps
+        time_codes, time_strings = pd.factorize(timeline, sort=True)
+        # nanoseconds like the streamed timelines, whatever resolution pandas infers
+        time_index = pd.DatetimeIndex(pd.to_datetime(time_strings, format=date_format, utc=True)).as_unit('ns')
+
+    # keep the first value for each (sensor, time) pair
+    _, first = np.unique(sensor_codes * len(time_index) + time_codes, return_index=True)
+    sensor_codes, time_codes, values = sensor_codes[first], time_codes[first], values[first]
+    if has_valid_samples:
+        samples = samples[first]
+
+    if df_format == 'long':
+        columns = {
+            'sensor': np.asarray(sensor_ids, dtype=object)[sensor_codes],
+            'time': time_index[time_codes],
+            'value': values
+        }
+        if has_valid_samples:
+            columns['samples'] = samples.astype(np.int32)
+        return pd.DataFrame(columns)
+
+    shape = (len(time_index), len(sensor_ids))
+    values_block = np.full(shape, np.nan, dtype=np.float64)
+    values_block[time_codes, sensor_codes] = values
+    df = pd.DataFrame(values_block, index=time_index, columns=sensor_ids)
 
     if has_valid_samples:
-        for d in data:
-            sensor_id = d['sensorId']
-            timeline = d['timeline']
-            index = pd.to_datetime(timeline, utc=True)
-            samples = d['validSamples']
-            column = pd.Series(samples, index=index, dtype=np.int32)        
-            column = column[~column.index.duplicated(keep='first')]        
-            df[f'{sensor_id}_samples'] = column
-    
+        samples_block = np.full(shape, np.nan, dtype=np.float64)
+        samples_block[time_codes, sensor_codes] = samples
+        if len(samples) == samples_block.size:
+            samples_block = samples_block.astype(np.int32)
+        samples_df = pd.DataFrame(samples_block, index=time_index, 
+                                  columns=[f'{sensor_id}_samples' for sensor_id in sensor_ids])
+        df = pd.concat([df, samples_df], axis=1)
+
     return df
 
-@dataclass
+@dataclass(slots=True)
 class Sensor():
     id: str
     station: int
@@ -72,34 +125,126 @@ class Sensor():
         return inside
 
     def __repr__(self) -> str:
-        return self.__dict__.__repr__()
+        return asdict(self).__repr__()
+
 
-@dataclass
 class SensorList():
     """
     A list of sensors    
+    The sensors are stored as parallel arrays (id, station, name, lat, lng, mu), 
+    Sensor objects are created only when accessed. 
+    Lookups by id and by station use dict indexes built on first use, and the spatial 
+    selections run vectorized on the coordinate arrays.
     """
-    list: List[Sensor]
-    __df: gpd.GeoDataFrame = field(init=False, default=None, repr=False)
+    COLUMNS = ('id', 'station', 'name', 'lat', 'lng', 'mu')
+
+    def __init__(self, list: List[Sensor] = None, *, columns: dict = None):
+        """
+        :param list: list of Sensor objects
+        :param columns: dictionary of arrays, one for each of SensorList.COLUMNS (alternative to list)
+        """
+        if columns is None:
+            columns = SensorList.__columns_of(list if list is not None else [])
+        self.__set_columns(columns)
+
+    @staticmethod
+    def __columns_of(sensors: Iterable[Sensor]) -> dict:
+        sensors = tuple(sensors)
+        return {
+            name: [getattr(s, name) for s in sensors] 
+            for name in SensorList.COLUMNS
+        }
+
+    def __set_columns(self, columns: dict):
+        self.__columns = {
+            name: np.asarray(columns[name], dtype=np.float64 if name in ('lat', 'lng') else object)
+            for name in SensorList.COLUMNS
+        }
+        self.__sensors = None
+        self.__df = None
+        self.__by_id = None
+        self.__by_station = None
 
     @staticmethod 
     def from_json(sensor_list: dict, geo_win: Tuple[float, float, float, float]|None) -> 'SensorList':       
-        sensors = []
-        for sensor_dict in sensor_list:
-            sensor_id = sensor_dict['id']
-            station = sensor_dict['station']
-            name = sensor_dict['stationName']
-            lat = sensor_dict['lat']
-            lng = sensor_dict['lon']
-            mu = sensor_dict['sensorMU']
-
-            sensor = Sensor(
-                sensor_id, station, name, lat, lng, mu
-            )
-            if geo_win is None or sensor.is_inside(geo_win):
-                sensors.append(sensor)
-
-        return SensorList(sensors)
+        columns = dict(
+            id=[d['id'] for d in sensor_list],
+            station=[d['station'] for d in sensor_list],
+            name=[d['stationName'] for d in sensor_list],
+            lat=[d['lat'] for d in sensor_list],
+            lng=[d['lon'] for d in sensor_list],
+            mu=[d['sensorMU'] for d in sensor_list],
+        )
+        sensors = SensorList(columns=columns)
+
+        if geo_win is not None:
+            sensors = sensors.select_bbox(geo_win)
+
+        return sensors
+
+    def __sensor(self, position: int) -> Sensor:
+        c = self.__columns
+        return Sensor(
+            c['id'][position], c['station'][position], c['name'][position],
+            float(c['lat'][position]), float(c['lng'][position]), c['mu'][position]
+        )
+
+    @property
+    def list(self) -> Tuple[Sensor, ...]:
+        """
+        :return: the sensors as a tuple of Sensor objects (created on first access).
+                 Assign a new sequence of sensors to replace them
+        """
+        if self.__sensors is None:
+            self.__sensors = tuple(self.__sensor(p) for p in range(len(self)))
+        return self.__sensors
+
+    @list.setter
+    def list(self, sensors: Iterable[Sensor]):
+        self.__set_columns(SensorList.__columns_of(sensors))
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        :return: ids of the sensors
+        """
+        return self.__columns['id']
+
+    @property
+    def stations(self) -> np.ndarray:
+        """
+        :return: station ids of the sensors
+        """
+        return self.__columns['station']
+
+    @property
+    def lats(self) -> np.ndarray:
+        """
+        :return: latitudes of the sensors
+        """
+        return self.__columns['lat']
+
+    @property
+    def lngs(self) -> np.ndarray:
+        """
+        :return: longitudes of the sensors
+        """
+        return self.__columns['lng']
+
+    def __id_index(self) -> dict:
+        if self.__by_id is None:
+            ids = self.ids
+            # reversed, so that the first sensor with a duplicated id wins
+            self.__by_id = dict(zip(ids[::-1].tolist(), range(len(ids) - 1, -1, -1)))
+        return self.__by_id
+
+    def __station_index(self) -> dict:
+        if self.__by_station is None:
+            by_station = {}
+            for position, station in enumerate(self.stations.tolist()):
+                by_station.setdefault(station, []).append(position)
+            self.__by_station = by_station
+        return self.__by_station
 
     def __get_by_id(self, s_id: str) -> Sensor:
         """
@@ -107,11 +252,10 @@ class SensorList():
         :param s_id: sensor id
         :return: sensor
         """
-        sensors_with_id = filter(lambda s: s.id==s_id, self.list)
         try:
-            return next(sensors_with_id)
-        except StopIteration as e:
-            raise KeyError(s_id + ' not in sensor list')
+            return self.__sensor(self.__id_index()[s_id])
+        except KeyError as e:
+            raise KeyError(str(s_id) + ' not in sensor list')
 
     def get_by_station(self, station: int) -> Sensor:
         """
@@ -119,42 +263,135 @@ class SensorList():
         :param station: station id
         :return: sensor
         """
-        sensors_with_id = filter(lambda s: s.station==station, self.list)
         try:
-            return next(sensors_with_id)
-        except StopIteration as e:
-            raise KeyError(station + ' not in sensor list')
+            return self.__sensor(self.__station_index()[station][0])
+        except KeyError as e:
+            raise KeyError(str(station) + ' not in sensor list')
+
+    def get_by_ids(self, ids: Iterable[str], missing='raise') -> 'SensorList':
+        """
+        Returns the sensors with the given ids
+        :param ids: sensor ids
+        :param missing: 'raise' to raise a KeyError for unknown ids, 'ignore' to skip them
+        :return: sensor list, in the order of ids
+        """
+        by_id = self.__id_index()
+        positions = []
+        for s_id in ids:
+            if s_id in by_id:
+                positions.append(by_id[s_id])
+            elif missing == 'raise':
+                raise KeyError(str(s_id) + ' not in sensor list')
+        return self.take(positions)
+
+    def get_by_stations(self, stations: Iterable[int]) -> 'SensorList':
+        """
+        Returns all the sensors of the given stations
+        :param stations: station ids
+        :return: sensor list
+        """
+        by_station = self.__station_index()
+        positions = list(chain.from_iterable(by_station.get(station, []) for station in stations))
+        return self.take(positions)
+
+    def take(self, positions) -> 'SensorList':
+        """
+        Returns the sensors at the given positions
+        :param positions: array of positions
+        :return: sensor list
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        return SensorList(columns={name: column[positions] for name, column in self.__columns.items()})
+
+    def select(self, mask: np.ndarray) -> 'SensorList':
+        """
+        Returns the sensors selected by a boolean mask
+        :param mask: boolean array, one value for each sensor
+        :return: sensor list
+        """
+        return self.take(np.flatnonzero(mask))
+
+    def select_bbox(self, geo_win: Tuple[float, float, float, float]) -> 'SensorList':
+        """
+        Returns the sensors inside the geographical window
+        :param geo_win: geographical window (lon_min, lat_min, lon_max, lat_max)
+        :return: sensor list
+        """
+        lat, lng = self.lats, self.lngs
+        mask = (geo_win[1] <= lat) & (lat <= geo_win[3]) & (geo_win[0] <= lng) & (lng <= geo_win[2])
+        return self.select(mask)
+
+    def select_radius(self, lat: float, lng: float, radius: float) -> 'SensorList':
+        """
+        Returns the sensors within radius km from the given point (haversine distance)
+        :param lat: latitude of the center
+        :param lng: longitude of the center
+        :param radius: radius in km
+        :return: sensor list
+        """
+        lat1, lng1 = np.radians(self.lats), np.radians(self.lngs)
+        lat0, lng0 = np.radians(lat), np.radians(lng)
+        a = np.sin((lat1 - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat1) * np.sin((lng1 - lng0) / 2) ** 2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        return self.select(distance <= radius)
 
+    def select_polygon(self, polygon) -> 'SensorList':
+        """
+        Returns the sensors inside (or on the boundary of) the polygon
+        :param polygon: shapely geometry in lon/lat coordinates
+        :return: sensor list
+        """
+        mask = shapely.intersects_xy(polygon, self.lngs, self.lats)
+        return self.select(mask)
+
+    def __len__(self) -> int:
+        return len(self.__columns['id'])
+
+    def __iter__(self) -> Iterator[Sensor]:
+        return iter(self.list)
 
     def __getitem__(self, item: Any) -> Sensor:
         if isinstance(item, str):
             return self.__get_by_id(item)
+        elif isinstance(item, slice):
+            return [self.__sensor(p) for p in range(len(self))[item]]
         else:
-            return self.list[item]
+            return self.__sensor(range(len(self))[item])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SensorList):
+            return NotImplemented
+        return all(
+            np.array_equal(self.__columns[name], other.__columns[name]) 
+            for name in SensorList.COLUMNS
+        )
+
+    def __repr__(self) -> str:
+        return 'SensorList(list=%r)' % (self.list,)
 
-   
     def as_serializable(self) -> List[dict]:
         """
         Returns a serializable list of the sensors
         :return: list of sensors as dictionaries    
         """
-        return [asdict(s) for s in self.list]
+        columns = [self.__columns[name].tolist() for name in SensorList.COLUMNS]
+        return [dict(zip(SensorList.COLUMNS, values)) for values in zip(*columns)]
 
 
     def to_geopandas(self) -> gpd.GeoDataFrame:
         """
         Converts the list of sensors to a geopandas dataframe
-        Stores the dataframe in a private variable to avoid multiple conversions
+        The dataframe is built once, each call returns a shallow copy
         :return: geopandas dataframe
         """
         if self.__df is None:
-            index = [s.id for s in self.list]
-            data = [(s.station, s.name, s.mu) for s in self.list]
-            geometry = [Point((s.lng, s.lat)) for s in self.list]
-            self.__df = gpd.GeoDataFrame(data, index=index, columns=['station', 'name', 'mu'], geometry=geometry)
-            self.__df.index.name = 'id'
+            c = self.__columns
+            index = pd.Index(c['id'], name='id')
+            data = pd.DataFrame({'station': c['station'], 'name': c['name'], 'mu': c['mu']}, index=index)
+            geometry = gpd.points_from_xy(c['lng'], c['lat'])
+            self.__df = gpd.GeoDataFrame(data.infer_objects(), geometry=geometry)
 
-        return self.__df.copy()
+        return self.__df.copy(deep=False)
 
 
 def get_sensor_classes(auth=None):
@@ -166,16 +403,8 @@ def get_sensor_classes(auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + '/drops_sensors/classes'
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
-
-    if r.status_code is not requests.codes.ok:
-        raise DropsException(
-            "Error while fetching sensor classes",
-            response=r
-        )
-
-    data = r.json()
+    req_url = auth.dds_url() + _CLASSES_URL
+    data = get_json(auth, req_url, "Error while fetching sensor classes")
     return data
 
 def get_aggregation_functions(sensor_class=None, auth=None):
@@ -187,19 +416,11 @@ def get_aggregation_functions(sensor_class=None, auth=None):
     if auth is None:
         auth = DropsCredentials.default()
 
-    req_url = auth.dds_url() + '/drops_sensors/aggregations'
+    req_url = auth.dds_url() + _AGGREGATIONS_URL
     if sensor_class is not None:
         req_url += '/' + sensor_class
-        
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
 
-    if r.status_code is not requests.codes.ok:
-        raise DropsException(
-            "Error while fetching aggregation functions",
-            response=r
-        )
-
-    return r.json()
+    return get_json(auth, req_url, "Error while fetching aggregation functions")
 
 def get_sensor_list(sensor_class, group='Dewetra%Default', geo_win=None, auth=None):
     """
@@ -213,40 +434,85 @@ def get_sensor_list(sensor_class, group='Dewetra%Default', geo_win=None, auth=No
     if auth is None:
         auth = DropsCredentials.default()
 
-    query_url = '/drops_sensors/anag/%(sensor_class)s/%(group)s'
     query_data = dict(
         sensor_class=sensor_class,
         group=group
     )
-    req_url = auth.dds_url() + quote(query_url % query_data)
-    r = requests.get(req_url, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
-
-    if r.status_code is not requests.codes.ok:
-        raise DropsException(
-            "Error while fetching sensor anagraphic for %s on group %s" % (sensor_class, group),
-            response=r
-        )
-
-    sensor_list_json = r.json()
+    req_url = auth.dds_url() + quote(_ANAG_URL % query_data)
+    sensor_list_json = get_json(
+        auth, req_url,
+        "Error while fetching sensor anagraphic for %s on group %s" % (sensor_class, group),
+        # only read by SensorList.from_json
+        copy=False
+    )
     sensor_list = SensorList.from_json(sensor_list=sensor_list_json, geo_win=geo_win)
     return sensor_list
 
-def _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth):
-    req_url = auth.dds_url() + quote(query_url)
-    r = requests.post(req_url, json=post_data, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+def _sensor_ids(sensors) -> List[str]:
+    """
+    extracts the sensor ids from the sensors argument
+    :param sensors: SensorList Object, or list of Sensors or list of sensors id
+    :return: list of sensors id
+    """
+    if isinstance(sensors, SensorList):
+        return sensors.ids.tolist()
 
-    data = None
-    if r.status_code is not requests.codes.ok:
-        raise DropsException("Error while fetching sensor data", response=r)
+    if all([type(s) is Sensor for s in sensors]):
+        id_sensors = [s.id for s in sensors]
+    elif all([type(s) is str for s in sensors]):
+        id_sensors = sensors
+    else:
+        raise DropsException("sensor list not valid")
 
-    data = r.json()
+    return id_sensors
 
+
+def _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time=None, aggr_func=None) -> dict:
+    """
+    builds the post data for the sensor series requests
+    :return: post data dictionary
+    """
+    post_data = {
+        'sensorClass': sensor_class,
+        'from': date_from,
+        'to': date_to,
+        'ids': _sensor_ids(sensors)
+    }
+
+    if aggr_time:
+        if type(aggr_time) in (timedelta, Timedelta):
+            aggr_seconds = aggr_time.total_seconds()
+        elif isinstance(aggr_time, Number):
+            aggr_seconds = aggr_time
+        else:
+            raise DropsException(f'aggr_time object is neither numeric or timedelta object [{aggr_time}]')
+        post_data['step'] = aggr_seconds
+
+    if aggr_func:
+        post_data['aggrFunction'] = aggr_func
+
+    return post_data
+
+
+def _convert_sensor_data(data, as_pandas, date_as_string, df_format='wide'):
+    """
+    converts the json series returned by the server
+    :param data: list of sensors data
+    :param as_pandas: convert the data to a pandas dataframe
+    :param date_as_string: keep the dates as strings (ignored when as_pandas is set)
+    :param df_format: layout of the dataframe, 'wide' or 'long'
+    :return: raw data as json, or pandas dataframe
+    """
     if as_pandas:
-        df = __raw_data_to_pandas(data)
+        with metrics.timed('convert', 'drops_sensors/serie', format=df_format):
+            df = __raw_data_to_pandas(data, df_format)
         return df
     
     if not date_as_string:
         for sensor_data in data:
+            if isinstance(sensor_data['timeline'], np.ndarray):
+                # streamed records, already converted
+                continue
             dates_str = sensor_data['timeline']
             dates = datetimes_from_strings(dates_str)
             sensor_data['timeline'] = dates
@@ -254,6 +520,185 @@ def _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth):
     return data
 
 
+def _sensor_record_arrays(sensor_data, parse_dates=True) -> dict:
+    """
+    converts the series of a sensor record to numpy arrays
+    :param sensor_data: decoded sensor record
+    :param parse_dates: convert the timeline to datetime64 (UTC), otherwise keep the strings
+    :return: the record, with numpy arrays for timeline, values and validSamples
+    """
+    timeline = sensor_data['timeline']
+    if parse_dates:
+        sensor_data['timeline'] = datetime64_from_strings(timeline)
+    else:
+        sensor_data['timeline'] = np.asarray(timeline, dtype=str)
+    sensor_data['values'] = np.asarray(sensor_data['values'], dtype=np.float64)
+    if 'validSamples' in sensor_data:
+        sensor_data['validSamples'] = np.asarray(sensor_data['validSamples'], dtype=np.int32)
+    return sensor_data
+
+
+def _iter_sensor_records(query_url, post_data, auth, parse_dates=True) -> Iterator[dict]:
+    """
+    streams the sensor series, decoding the records one at a time as they arrive
+    :param query_url: series query url
+    :param post_data: post data
+    :param auth: authentication object
+    :param parse_dates: convert the timelines to datetime64 (UTC)
+    :return: generator of sensor records with numpy arrays
+    """
+    req_url = auth.dds_url() + quote(query_url)
+    # the series queries are read only, they can be retried
+    r = auth.transport().post(req_url, json=post_data, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT, 
+                              stream=True, idempotent=True)
+
+    try:
+        if r.status_code is not requests.codes.ok:
+            raise DropsException("Error while fetching sensor data", response=r)
+
+        chunks = metrics.instrument_chunks(r.iter_content(chunk_size=STREAM_CHUNK_SIZE), metrics.endpoint_of(req_url))
+        for sensor_data in iter_json_array(chunks):
+            yield _sensor_record_arrays(sensor_data, parse_dates)
+    finally:
+        r.close()
+
+
+def _fetch_sensor_data(query_url, post_data, auth, stream=False, parse_dates=True) -> List[dict]:
+    if stream:
+        return list(_iter_sensor_records(query_url, post_data, auth, parse_dates))
+
+    req_url = auth.dds_url() + quote(query_url)
+    r = auth.transport().post(req_url, json=post_data, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT,
+                              idempotent=True)
+
+    if r.status_code is not requests.codes.ok:
+        raise DropsException("Error while fetching sensor data", response=r)
+
+    with metrics.timed('decode', metrics.endpoint_of(req_url), format='json'):
+        return r.json()
+
+
+def _time_windows(date_from, date_to, chunk_time) -> List[Tuple[str, str]]:
+    """
+    splits the date range in consecutive windows sharing their boundaries
+    :param date_from: date from as formatted string
+    :param date_to: date to as formatted string
+    :param chunk_time: window length as number of seconds or timedelta object
+    :return: list of (date_from, date_to) formatted strings
+    """
+    if type(chunk_time) in (timedelta, Timedelta):
+        step = timedelta(seconds=chunk_time.total_seconds())
+    elif isinstance(chunk_time, Number):
+        step = timedelta(seconds=chunk_time)
+    else:
+        raise DropsException(f'chunk_time object is neither numeric or timedelta object [{chunk_time}]')
+
+    if step.total_seconds() <= 0:
+        raise DropsException(f'chunk_time must be positive [{chunk_time}]')
+
+    start = datetime.strptime(date_from, date_format)
+    end = datetime.strptime(date_to, date_format)
+
+    windows = []
+    while True:
+        stop = min(start + step, end)
+        windows.append((start.strftime(date_format), stop.strftime(date_format)))
+        if stop >= end:
+            break
+        start = stop
+
+    return windows
+
+
+_SERIES_KEYS = ('timeline', 'values', 'validSamples')
+
+
+def _merge_sensor_data(chunks) -> List[dict]:
+    """
+    stitches the series of the chunked requests, dropping the timestamps
+    repeated at the window boundaries
+    :param chunks: list of responses, ordered by time window
+    :return: list of sensors data
+    """
+    merged = {}
+    for chunk in chunks:
+        for sensor_data in chunk:
+            sensor_id = sensor_data['sensorId']
+            if sensor_id not in merged:
+                parts = {key: [sensor_data[key]] for key in _SERIES_KEYS if key in sensor_data}
+                merged[sensor_id] = (sensor_data, parts)
+                continue
+
+            _, parts = merged[sensor_id]
+            last_dates = [t[-1] for t in parts['timeline'] if len(t) > 0]
+            timeline = sensor_data['timeline']
+            start = 0
+            if last_dates:
+                if isinstance(timeline, np.ndarray):
+                    start = int(np.searchsorted(timeline, last_dates[-1], side='right'))
+                else:
+                    start = bisect_right(timeline, last_dates[-1])
+
+            for key in parts:
+                if key in sensor_data:
+                    parts[key].append(sensor_data[key][start:])
+
+    data = []
+    for sensor_data, parts in merged.values():
+        for key, key_parts in parts.items():
+            if isinstance(key_parts[0], np.ndarray):
+                sensor_data[key] = np.concatenate(key_parts)
+            else:
+                sensor_data[key] = list(chain.from_iterable(key_parts))
+        data.append(sensor_data)
+
+    return data
+
+
+def _fetch_sensor_data_chunked(query_url, post_data, auth, chunk_time=None, chunk_ids=None,
+                               max_workers=DEFAULT_MAX_WORKERS, stream=False, parse_dates=True) -> List[dict]:
+    """
+    splits the request by time window and sensor ids batch and fetches the chunks concurrently
+    :return: list of sensors data, as returned by a single request
+    """
+    ids = post_data['ids']
+    if chunk_ids:
+        batches = [ids[i:i + chunk_ids] for i in range(0, len(ids), chunk_ids)]
+    else:
+        batches = [ids]
+
+    if chunk_time:
+        windows = _time_windows(post_data['from'], post_data['to'], chunk_time)
+    else:
+        windows = [(post_data['from'], post_data['to'])]
+
+    chunks_post_data = [
+        dict(post_data, ids=batch, **{'from': date_from, 'to': date_to})
+        for batch in batches
+        for date_from, date_to in windows
+    ]
+    chunks = map_concurrent(
+        lambda chunk_post_data: _fetch_sensor_data(query_url, chunk_post_data, auth, stream, parse_dates),
+        chunks_post_data,
+        max_workers=max_workers
+    )
+    # requests are ordered by batch and then by time window
+    return _merge_sensor_data(chunks)
+
+
+def _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth,
+                     chunk_time=None, chunk_ids=None, max_workers=DEFAULT_MAX_WORKERS,
+                     df_format='wide', stream=False):
+    parse_dates = as_pandas or not date_as_string
+    if chunk_time or chunk_ids:
+        data = _fetch_sensor_data_chunked(query_url, post_data, auth, chunk_time, chunk_ids, max_workers,
+                                          stream, parse_dates)
+    else:
+        data = _fetch_sensor_data(query_url, post_data, auth, stream, parse_dates)
+
+    return _convert_sensor_data(data, as_pandas, date_as_string, df_format)
+
+
 @format_dates()
 def get_sensor_data_aggr(
     sensor_class, 
@@ -264,7 +709,12 @@ def get_sensor_data_aggr(
     aggr_func, 
     date_as_string=False, 
     as_pandas=False, 
-    auth=None    
+    auth=None,
+    chunk_time=None,
+    chunk_ids=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    df_format='wide',
+    stream=False
 ):
     """
     get data from selected sensors on the selected date range, aggregating on time using the selected `aggr_func` function
@@ -277,43 +727,24 @@ def get_sensor_data_aggr(
     :param date_as_string: return dates as string or datetime objects (default)
     :param as_pandas: return data converted as pandas dataframe (default)
     :param auth: authentication object (optional)
+    :param chunk_time: split the request in time windows of this length, as number of seconds 
+                       or timedelta object. Should be a multiple of aggr_time (optional)
+    :param chunk_ids: split the request in batches of this number of sensors (optional)
+    :param max_workers: number of concurrent requests when chunking (default 4)
+    :param df_format: layout of the dataframe: 'wide' (default) with a column per sensor, or 'long' 
+                      with sensor, time, value (and samples) columns
+    :param stream: decode the response incrementally, converting each sensor series to numpy arrays 
+                   as it arrives. Raw records hold numpy arrays (datetime64 timelines, in UTC) (default False)
     :return: raw data as json, or pandas dataframe
     """
     if auth is None:
         auth = DropsCredentials.default()
     
-    query_url = '/drops_sensors/serieaggr-smart'     
-    
-    if type(sensors) is SensorList:
-        sensors = sensors.list
+    query_url = _SERIE_AGGR_SMART_URL
+    post_data = _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time, aggr_func)
 
-    if all([type(s) is Sensor for s in sensors]):
-        id_sensors = [s.id for s in sensors]
-    elif all([type(s) is str for s in sensors]):
-        id_sensors = sensors
-    else:
-        raise DropsException("sensor list not valid")
-
-    post_data = {
-        'sensorClass': sensor_class,
-        'from': date_from,
-        'to': date_to,
-        'ids': id_sensors
-    }
-
-    if aggr_time:
-        if type(aggr_time) in (timedelta, Timedelta):
-            aggr_seconds = aggr_time.total_seconds()
-        elif isinstance(aggr_time, Number):
-            aggr_seconds = aggr_time
-        else:
-            raise DropsException(f'aggr_time object is neither numeric or timedelta object [{aggr_time}]')
-        post_data['step'] = aggr_seconds
-
-    if aggr_func:
-        post_data['aggrFunction'] = aggr_func
-
-    return _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth)
+    return _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth,
+                            chunk_time, chunk_ids, max_workers, df_format, stream)
 
 @format_dates()
 def get_sensor_data(
@@ -324,7 +755,12 @@ def get_sensor_data(
     aggr_time=None, 
     date_as_string=False, 
     as_pandas=False, 
-    auth=None
+    auth=None,
+    chunk_time=None,
+    chunk_ids=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    df_format='wide',
+    stream=False
 ):
     """
     get data from selected sensors on the selected date range
@@ -336,45 +772,111 @@ def get_sensor_data(
     :param date_as_string: return dates as string or datetime objects (default)
     :param as_pandas: return data converted as pandas dataframe (default)
     :param auth: authentication object (optional)
+    :param chunk_time: split the request in time windows of this length, as number of seconds 
+                       or timedelta object (optional)
+    :param chunk_ids: split the request in batches of this number of sensors (optional)
+    :param max_workers: number of concurrent requests when chunking (default 4)
+    :param df_format: layout of the dataframe: 'wide' (default) with a column per sensor, or 'long' 
+                      with sensor, time, value (and samples) columns
+    :param stream: decode the response incrementally, converting each sensor series to numpy arrays 
+                   as it arrives. Raw records hold numpy arrays (datetime64 timelines, in UTC) (default False)
     :return: raw data as json, or pandas dataframe
     """
     if auth is None:
         auth = DropsCredentials.default()
     
     if aggr_time is None:
-        query_url = '/drops_sensors/serie' 
+        query_url = _SERIE_URL
     else: 
-        query_url = '/drops_sensors/serieaggr'
+        query_url = _SERIE_AGGR_URL
     
-    if type(sensors) is SensorList:
-        sensors = sensors.list
+    post_data = _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time)
 
-    if all([type(s) is Sensor for s in sensors]):
-        id_sensors = [s.id for s in sensors]
-    elif all([type(s) is str for s in sensors]):
-        id_sensors = sensors
+    return _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth,
+                            chunk_time, chunk_ids, max_workers, df_format, stream)
+
+
+
+@format_dates()
+def iter_sensor_data(
+    sensor_class,
+    sensors,
+    date_from,
+    date_to,
+    aggr_time=None,
+    aggr_func=None,
+    auth=None,
+    chunk_ids=None
+) -> Iterator[Tuple[str, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    iterates over the series of the selected sensors while the response is streamed,
+    each series is yielded as soon as it is decoded
+    example:
+
+    for sensor_id, times, values, valid_samples in iter_sensor_data(sensor_class, sensor_list, date_from, date_to):
+        check_series(sensor_id, times, values)
+
+    :param sensor_class: sensor class string
+    :param sensors: SensorList Object, or list of Sensors or list of sensors id
+    :param date_from: date from
+    :param date_to: date to
+    :param aggr_time: aggregation time as number of seconds or datetime.timedelta object or pd.timedelta object (optional)
+    :param aggr_func: aggregation function (returned by `get_aggregation_funtions`), requires aggr_time (optional)
+    :param auth: authentication object (optional)
+    :param chunk_ids: request the sensors in consecutive batches of this size (optional)
+    :return: generator of (sensor_id, times, values, valid_samples) tuples: times is a datetime64 array (UTC), 
+             values a float64 array, valid_samples an int32 array or None
+    """
+    if auth is None:
+        auth = DropsCredentials.default()
+
+    if aggr_func:
+        query_url = _SERIE_AGGR_SMART_URL
+    elif aggr_time:
+        query_url = _SERIE_AGGR_URL
     else:
-        raise DropsException("sensor list not valid")
+        query_url = _SERIE_URL
+
+    post_data = _sensor_data_post(sensor_class, sensors, date_from, date_to, aggr_time, aggr_func)
+    ids = post_data['ids']
+    batch_size = chunk_ids or max(len(ids), 1)
+
+    seen = set()
+    for i in range(0, len(ids), batch_size):
+        batch_post_data = dict(post_data, ids=ids[i:i + batch_size])
+        for sensor_data in _iter_sensor_records(query_url, batch_post_data, auth):
+            sensor_id = sensor_data['sensorId']
+            if sensor_id in seen:
+                continue
+            seen.add(sensor_id)
+            yield sensor_id, sensor_data['timeline'], sensor_data['values'], sensor_data.get('validSamples')
+
+
+def _sensor_map_post(sensor_class, dates_selected, group,
+                     cum_hours, geo_win, interpolator,
+                     img_dim, radius, mode=None) -> dict:
+    """
+    builds the post data for the sensor map requests
+    :return: post data dictionary
+    """
+    if interpolator is None:
+        interpolator = 'GRISO' if sensor_class == 'PLUVIOMETRO' else 'LinearRegression'
 
     post_data = {
-        'sensorClass': sensor_class,
-        'from': date_from,
-        'to': date_to,
-        'ids': id_sensors
+        "mapOptions": {
+            "imgGeoRes": ";".join([str(f) for f in list(geo_win) + [img_dim[1], img_dim[0]]]),
+            "radius": str(radius),
+            "sensorClass": sensor_class,
+            "raggr": group,
+            "interpolator": interpolator,
+        },
+        "timeline": dates_selected,
+        "cumh": cum_hours
     }
+    if mode is not None:        
+        post_data['mapOptions']['operation'] = mode
 
-    if aggr_time:
-        if type(aggr_time) in (timedelta, Timedelta):
-            aggr_seconds = aggr_time.total_seconds()
-        elif isinstance(aggr_time, Number):
-            aggr_seconds = aggr_time
-        else:
-            raise DropsException(f'aggr_time object is neither numeric or timedelta object [{aggr_time}]')
-        post_data['step'] = aggr_seconds
-
-    
-    return _get_sensor_data(query_url, post_data, as_pandas, date_as_string, auth)
-
+    return post_data
 
 
 def get_sensor_map_request(sensor_class, dates_selected, group,
@@ -401,34 +903,141 @@ def get_sensor_map_request(sensor_class, dates_selected, group,
     if auth is None:
         auth = DropsCredentials.default()
 
-    query_url = '/drops_sensors/map/'
-    post_data = {
-        "mapOptions": {
-            "imgGeoRes": ";".join([str(f) for f in list(geo_win) + [img_dim[1], img_dim[0]]]),
-            "radius": str(radius),
-            "sensorClass": sensor_class,
-            "raggr": group,
-            "interpolator": interpolator,
-        },
-        "timeline": dates_selected,
-        "cumh": cum_hours
-    }
-    if mode is not None:        
-        post_data['mapOptions']['operation'] = mode
+    post_data = _sensor_map_post(sensor_class, dates_selected, group,
+                                 cum_hours, geo_win, interpolator,
+                                 img_dim, radius, mode)
 
-    req_url = auth.dds_url() + quote(query_url)
+    req_url = auth.dds_url() + quote(_MAP_URL)
 
-    response = requests.post(req_url, json=post_data, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT, stream=stream)
+    response = auth.transport().post(req_url, json=post_data, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT, 
+                                     stream=stream, idempotent=True)
 
     return response, req_url
 
+def _fetch_sensor_map(sensor_class, dates_selected, group, cum_hours, geo_win, interpolator,
+                      img_dim, radius, mode, auth, stream_to, chunks) -> xr.Dataset:
+    """
+    requests and opens a sensor map
+    :return: xarray dataset
+    """
+    response, req_url = get_sensor_map_request(sensor_class, dates_selected, group,
+                   cum_hours, geo_win, interpolator,
+                   img_dim, radius,  mode, stream=stream_to is not None, auth=auth)
+
+    if response.status_code is not requests.codes.ok:
+        raise DropsException(
+            "Error while fetching data for %s" %
+            (sensor_class,),
+            response=response
+        )
+
+    try:
+        cf_data = open_dataset_response(response, stream_to, chunks)
+    except Exception as exp:
+        logging.error('Error loading dataset from %s' % req_url)
+        raise exp
+    finally:
+        response.close()
+
+    return cf_data
+
+
+def _time_dim(dataset) -> str:
+    """
+    :return: the dimension of the timesteps of a sensor map, 'time' if none has dates
+    """
+    for dim in dataset.dims:
+        if dim in dataset.coords and np.issubdtype(dataset[dim].dtype, np.datetime64):
+            return dim
+    return 'time'
+
+
+def _get_sensor_map_split(sensor_class, dates_selected, group, cum_hours, geo_win, interpolator,
+                          img_dim, radius, mode, auth, cache, dates_per_request, max_workers, 
+                          chunks) -> xr.Dataset:
+    """
+    get a sensor map requesting the dates in concurrent batches and caching one file per date
+    :return: xarray dataset, concatenated along time (lazily with chunks)
+    """
+    if auth is None:
+        auth = DropsCredentials.default()
+    if isinstance(dates_selected, str):
+        dates_selected = [dates_selected]
+
+    frames = {}
+    keys = {}
+    if cache is not None:
+        for date_selected in dates_selected:
+            keys[date_selected] = cache.key(auth.dds_url(), 'sensor_map', sensor_class, date_selected, group, 
+                                            cum_hours, list(geo_win), interpolator, list(img_dim), radius, mode)
+            # maps of recent dates change while the late observations arrive
+            cached_path = cache.get(keys[date_selected], date_selected)
+            if cached_path is None:
+                continue
+            try:
+                frames[date_selected] = xr.open_dataset(cached_path, chunks=chunks)
+            except FileNotFoundError:
+                # evicted by another process in the meantime
+                pass
+
+    missing = [d for d in dates_selected if d not in frames]
+    step = dates_per_request or max(len(missing), 1)
+    batches = [missing[i:i + step] for i in range(0, len(missing), step)]
+
+    def fetch(batch):
+        dataset = _fetch_sensor_map(sensor_class, batch, group, cum_hours, geo_win, interpolator,
+                                    img_dim, radius, mode, auth, stream_to=True, chunks=chunks)
+        if cache is None:
+            return dataset
+
+        time_dim = _time_dim(dataset)
+        if dataset.sizes.get(time_dim) != len(batch):
+            logging.warning('Sensor map for %s: %s timesteps for %s dates, not cached' %
+                            (sensor_class, dataset.sizes.get(time_dim), len(batch)))
+            return dataset
+
+        for i, date_selected in enumerate(batch):
+            with cache.path_writer(keys[date_selected]) as tmp_path:
+                dataset.isel({time_dim: [i]}).to_netcdf(tmp_path)
+        dataset.close()
+        return None
+
+    pieces = {}
+    for batch, dataset in zip(batches, map_concurrent(fetch, batches, max_workers=max_workers)):
+        if dataset is not None:
+            pieces[batch[0]] = dataset
+            continue
+        for date_selected in batch:
+            frames[date_selected] = xr.open_dataset(cache.path(keys[date_selected]), chunks=chunks)
+
+    parts = [
+        frames[d] if d in frames else pieces[d]
+        for d in dates_selected if d in frames or d in pieces
+    ]
+    if len(parts) == 1:
+        return parts[0]
+    time_dim = _time_dim(parts[0])
+    dataset = xr.concat(parts, dim=time_dim, data_vars='minimal', coords='minimal', compat='override')
+    if cache is not None and pieces and time_dim in dataset.coords:
+        # the uncached pieces hold all the timesteps of their batch, stored under its first date
+        dataset = dataset.sortby(time_dim)
+    if chunks is None:
+        # loaded in memory by concat, release the files
+        dataset.load()
+        for part in parts:
+            part.close()
+    return dataset
+
+
 @format_dates(parameters=['dates_selected'])
 def get_sensor_map(sensor_class, dates_selected, group='Dewetra%Default',
                    cum_hours=3, geo_win=(6.0, 36.0, 18.6, 47.5),
                    interpolator=None,
                    img_dim=(630, 575), radius=0.5,
                    mode=None,
-                   auth=None):
+                   auth=None,
+                   stream_to=None, chunks=None,
+                   cache=None, dates_per_request=None, max_workers=DEFAULT_MAX_WORKERS):
     """
     get a map for the selected sensor class on the selected geowindow
     :param sensor_class: sensor class string
@@ -446,32 +1055,27 @@ def get_sensor_map(sensor_class, dates_selected, group='Dewetra%Default',
                             'GRISO' for pluviometers, otherwise to 'LinearRegression'
     :param mode: can be 'AVERAGE', 'MIN', 'MAX'. Works for Temperature and Relative Humidity (optional)
     :param auth: authentication object (optional)                            
-    :return: xarray dataset
+    :param stream_to: stream the response to this path, or to a temporary file if True, 
+                      instead of buffering it in memory. Ignored with cache or dates_per_request (optional)
+    :param chunks: dask chunks for the lazy loading of the dataset (optional)
+    :param cache: DiskCache object keeping one map per date, only the dates missing 
+                  from the cache are requested (optional)
+    :param dates_per_request: split dates_selected in requests of this many dates, 
+                              sent concurrently (optional)
+    :param max_workers: maximum number of concurrent requests with dates_per_request
+    :return: xarray dataset, concatenated along time with cache or dates_per_request (lazily with chunks)
     """
 
     if interpolator is None:
         interpolator = 'GRISO' if sensor_class == 'PLUVIOMETRO' else 'LinearRegression'
-        
 
-    response, req_url = get_sensor_map_request(sensor_class, dates_selected, group,
-                   cum_hours, geo_win, interpolator,
-                   img_dim, radius,  mode, auth=auth)
+    if cache is not None or dates_per_request is not None:
+        return _get_sensor_map_split(sensor_class, dates_selected, group, cum_hours, geo_win, interpolator,
+                                     img_dim, radius, mode, auth, cache, dates_per_request, max_workers, 
+                                     chunks)
 
-    if response.status_code is not requests.codes.ok:
-        raise DropsException(
-            "Error while fetching data for %s" %
-            (sensor_class,),
-            response=response
-        )
-
-    try:
-        raw_data = io.BytesIO(response.content)
-        cf_data = xr.open_dataset(raw_data)
-    except Exception as exp:
-        logging.error('Error loading dataset from %s' % req_url)
-        raise exp
-
-    return cf_data
+    return _fetch_sensor_map(sensor_class, dates_selected, group, cum_hours, geo_win, interpolator,
+                             img_dim, radius, mode, auth, stream_to, chunks)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,234 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+import xarray as xr
+
+NEAREST = 'nearest'
+BILINEAR = 'bilinear'
+
+LAT_NAMES = ('lat', 'latitude', 'nav_lat')
+LON_NAMES = ('lon', 'longitude', 'lng', 'nav_lon')
+MAX_CACHED_INDEXES = 64
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def grid_dims(dataset) -> Tuple[str, str]:
+    """
+    :param dataset: xarray dataset on a regular lat/lon grid
+    :return: names of the (lat, lon) dimensions
+    """
+    lat = next((n for n in LAT_NAMES if n in dataset.dims), None)
+    lon = next((n for n in LON_NAMES if n in dataset.dims), None)
+    if lat is None or lon is None:
+        raise ValueError('lat/lon dimensions not found in %s' % (tuple(dataset.dims),))
+    return lat, lon
+
+
+def _digest(*arrays) -> str:
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def _axis_slice(coord, low, high) -> slice:
+    """
+    positions of the coordinate values within [low, high], for ascending or descending axes
+    """
+    inside = np.flatnonzero((coord >= low) & (coord <= high))
+    if len(inside) == 0:
+        return slice(0, 0)
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+def select_bbox(dataset, bbox) -> xr.Dataset:
+    """
+    selects the cells inside the bounding box, lazily
+    :param dataset: xarray dataset on a regular lat/lon grid
+    :param bbox: bounding box (lon_min, lat_min, lon_max, lat_max), same layout of geo_win
+    :return: xarray dataset
+    """
+    lat, lon = grid_dims(dataset)
+    lon_min, lat_min, lon_max, lat_max = bbox
+    return dataset.isel({
+        lat: _axis_slice(dataset[lat].values, lat_min, lat_max),
+        lon: _axis_slice(dataset[lon].values, lon_min, lon_max),
+    })
+
+
+class PointIndex:
+    """
+    Positions and weights of a list of points on a grid: the nearest cell,
+    or the 4 cells around each point for the bilinear interpolation
+    """
+
+    def __init__(self, lats, lons, points_lon, points_lat, method=NEAREST):
+        """
+        :param lats: latitudes of the grid, monotonic
+        :param lons: longitudes of the grid, monotonic
+        :param points_lon: longitudes of the points
+        :param points_lat: latitudes of the points
+        :param method: 'nearest' or 'bilinear'
+        """
+        if method not in (NEAREST, BILINEAR):
+            raise ValueError('unknown interpolation method %s' % method)
+        self.method = method
+
+        lat_pos, lat_frac, lat_inside = self.__axis(np.asarray(lats, dtype=np.float64), points_lat)
+        lon_pos, lon_frac, lon_inside = self.__axis(np.asarray(lons, dtype=np.float64), points_lon)
+        # points outside the grid are masked with NaN
+        self.inside = lat_inside & lon_inside
+
+        if method == NEAREST:
+            self.positions = [(np.where(lat_frac < 0.5, lat_pos, lat_pos + 1),
+                               np.where(lon_frac < 0.5, lon_pos, lon_pos + 1))]
+            self.weights = [np.ones(len(lat_pos))]
+        else:
+            self.positions = [
+                (lat_pos, lon_pos), (lat_pos, lon_pos + 1),
+                (lat_pos + 1, lon_pos), (lat_pos + 1, lon_pos + 1),
+            ]
+            self.weights = [
+                (1 - lat_frac) * (1 - lon_frac), (1 - lat_frac) * lon_frac,
+                lat_frac * (1 - lon_frac), lat_frac * lon_frac,
+            ]
+
+    @staticmethod
+    def __axis(coord, values):
+        """
+        :return: position of the lower neighbour, fraction of the cell to the upper one, inside mask
+        """
+        values = np.asarray(values, dtype=np.float64)
+        descending = len(coord) > 1 and coord[0] > coord[-1]
+        if descending:
+            coord, values = -coord, -values
+
+        if len(coord) == 1:
+            inside = values == coord[0]
+            return np.zeros(len(values), dtype=np.intp), np.zeros(len(values)), inside
+
+        inside = (values >= coord[0]) & (values <= coord[-1])
+        pos = np.clip(np.searchsorted(coord, values, side='right') - 1, 0, len(coord) - 2)
+        frac = np.clip((values - coord[pos]) / (coord[pos + 1] - coord[pos]), 0.0, 1.0)
+        return pos.astype(np.intp), frac, inside
+
+
+def point_index(lats, lons, points_lon, points_lat, method=NEAREST) -> PointIndex:
+    """
+    the PointIndex of the points on the grid, cached per grid geometry and points
+    so that repeated extractions skip the search
+    """
+    key = (_digest(lats, lons), _digest(points_lon, points_lat), method)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+
+    index = PointIndex(lats, lons, points_lon, points_lat, method)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _points_coords(points):
+    """
+    :param points: list of (lon, lat), array (n, 2), SensorList or list of Sensor objects
+    :return: tuple (lons, lats, ids or None)
+    """
+    if hasattr(points, 'lngs') and hasattr(points, 'lats'):
+        return np.asarray(points.lngs), np.asarray(points.lats), np.asarray(points.ids)
+    if len(points) > 0 and hasattr(points[0], 'lng'):
+        return (np.array([s.lng for s in points], dtype=np.float64),
+                np.array([s.lat for s in points], dtype=np.float64),
+                np.array([s.id for s in points], dtype=object))
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[:, 0], points[:, 1], None
+
+
+def _load_window(gridded, lat, lon, positions):
+    """
+    loads the cells of gridded within the bounding window of the positions
+    :return: tuple (loaded dataset, positions relative to the window)
+    """
+    lat_all = np.concatenate([p[0] for p in positions])
+    lon_all = np.concatenate([p[1] for p in positions])
+    if len(lat_all) == 0:
+        return gridded, positions
+    lat_min, lon_min = int(lat_all.min()), int(lon_all.min())
+    window = gridded.isel({
+        lat: slice(lat_min, int(lat_all.max()) + 1),
+        lon: slice(lon_min, int(lon_all.max()) + 1),
+    }).load()
+    return window, [(lat_pos - lat_min, lon_pos - lon_min) for lat_pos, lon_pos in positions]
+
+
+def select_points(dataset, points, method=NEAREST) -> xr.Dataset:
+    """
+    extracts the values at the points with a single gather per grid cell corner,
+    lazily for datasets opened with dask chunks
+    :param dataset: xarray dataset on a regular lat/lon grid
+    :param points: list of (lon, lat), array (n, 2), SensorList or list of Sensor objects
+                   (the sensor ids become the point coordinate)
+    :param method: 'nearest' or 'bilinear'
+    :return: xarray dataset with a point dimension replacing lat and lon
+    """
+    lat, lon = grid_dims(dataset)
+    points_lon, points_lat, ids = _points_coords(points)
+    index = point_index(dataset[lat].values, dataset[lon].values, points_lon, points_lat, method)
+
+    grid_vars = [name for name, var in dataset.data_vars.items() if lat in var.dims and lon in var.dims]
+    gridded = dataset[grid_vars].drop_vars([lat, lon], errors='ignore')
+    positions = index.positions
+    if gridded.chunks == {}:
+        # the NetCDF backends read scattered points one at a time:
+        # read whole fields (one per timestep) and gather them in memory
+        try:
+            gridded = gridded.chunk({dim: 1 for dim in gridded.dims if dim not in (lat, lon)})
+        except ImportError:
+            # without dask, read at once the window around the points
+            gridded, positions = _load_window(gridded, lat, lon, positions)
+
+    result = None
+    for (lat_pos, lon_pos), weights in zip(positions, index.weights):
+        corner = gridded.isel({lat: xr.DataArray(lat_pos, dims='point'), lon: xr.DataArray(lon_pos, dims='point')})
+        if method == BILINEAR:
+            corner = corner * xr.DataArray(weights, dims='point')
+        result = corner if result is None else result + corner
+
+    result = result.where(xr.DataArray(index.inside, dims='point'))
+    result = result.assign_coords(
+        point_lon=('point', points_lon),
+        point_lat=('point', points_lat),
+    )
+    if ids is not None:
+        result = result.assign_coords(point=ids)
+
+    other_vars = [name for name in dataset.data_vars if name not in grid_vars]
+    return xr.merge([result, dataset[other_vars]]) if other_vars else result
+
+
+def subset(dataset, bbox=None, points=None, method=NEAREST) -> xr.Dataset:
+    """
+    applies the bbox and points selections, when set
+    """
+    result = dataset
+    if bbox is not None:
+        result = select_bbox(result, bbox)
+    if points is not None:
+        result = select_points(result, points, method)
+
+    if result is not dataset:
+        # the lazy subset reads from the file of dataset, a temporary file is removed with dataset
+        weakref.finalize(result, dataset.close)
+    return result
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pandas as pd
+import pytz
+import xarray as xr
+
+from . import coverages
+from .utils import DropsCredentials, date_format, format_dates
+
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_RECENT_WINDOW = timedelta(days=2)   # runs that may still receive new timesteps
+
+
+class CoverageSync:
+    """
+    Incremental mirror of a coverage variable and level in a local archive.
+    Every run (date_ref) is stored in its own Zarr store (appending the new timesteps in place),
+    or as one NetCDF file per timestep. A json manifest records the synced timesteps and the
+    completed runs, so a restarted job only queries the runs that may still change
+    and downloads only the missing timesteps.
+    example:
+
+    sync = CoverageSync('/data/mirror/wrf_t2m', 'COSMOI2', 'T_2M', '-')
+    sync.sync(datetime.now() - timedelta(days=3), datetime.now())
+    ds = sync.open('202401010000')
+    """
+
+    def __init__(self, directory, data_id, variable, level, store='zarr',
+                 recent_window=DEFAULT_RECENT_WINDOW, auth=None):
+        """
+        :param directory: archive directory (created if missing)
+        :param data_id: coverage id
+        :param variable: selected variable
+        :param level: selected level
+        :param store: 'zarr' (default, requires zarr) or 'netcdf'
+        :param recent_window: runs newer than now - recent_window are never marked as complete
+        :param auth: authentication object (optional)
+        """
+        if store not in ('zarr', 'netcdf'):
+            raise ValueError("store must be 'zarr' or 'netcdf', got %r" % (store,))
+
+        if auth is None:
+            auth = DropsCredentials.default()
+
+        self.directory = directory
+        self.data_id = data_id
+        self.variable = variable
+        self.level = level
+        self.store = store
+        self.recent_window = recent_window
+        self.auth = auth
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self.__load_manifest()
+
+    def __manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def __load_manifest(self) -> dict:
+        try:
+            with open(self.__manifest_path()) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = dict(runs={}, complete=[])
+
+        key = dict(data_id=self.data_id, variable=self.variable, level=self.level, store=self.store)
+        if any(manifest.get(k, v) != v for k, v in key.items()):
+            raise ValueError('the archive in %s was created for %s' % (self.directory, manifest))
+        manifest.update(key)
+        return manifest
+
+    def __save_manifest(self):
+        # atomic replace, a crash never leaves a truncated manifest
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.__manifest_path())
+
+    def path(self, date_ref) -> str:
+        """
+        :param date_ref: reference date as formatted string
+        :return: path of the zarr store or of the NetCDF directory of the run
+        """
+        if self.store == 'zarr':
+            return os.path.join(self.directory, date_ref + '.zarr')
+        return os.path.join(self.directory, date_ref)
+
+    def __is_recent(self, date_ref) -> bool:
+        date = pytz.utc.localize(datetime.strptime(date_ref, date_format))
+        return date >= datetime.now(pytz.utc) - self.recent_window
+
+    def __stored_timesteps(self, date_ref) -> List[str]:
+        """
+        timesteps actually present in the archive, used to recover from an interrupted append
+        """
+        path = self.path(date_ref)
+        if not os.path.exists(path):
+            return []
+
+        if self.store == 'netcdf':
+            return sorted(name[:-3] for name in os.listdir(path) if name.endswith('.nc'))
+
+        with xr.open_zarr(path) as ds:
+            return list(pd.DatetimeIndex(ds['time'].values).strftime(date_format))
+
+    def synced(self, date_ref) -> List[str]:
+        """
+        :param date_ref: reference date as formatted string
+        :return: timesteps of the run recorded in the manifest
+        """
+        return self.manifest['runs'].get(date_ref, [])
+
+    @format_dates(parameters=['date_from', 'date_to'])
+    def missing(self, date_from, date_to) -> Dict[str, List[str]]:
+        """
+        finds the timesteps available on the server and not yet in the archive.
+        Runs marked as complete in the manifest are not queried
+        :param date_from: date from
+        :param date_to: date to
+        :return: dict {date_ref: list of missing timesteps}
+        """
+        date_refs = coverages.get_dates(self.data_id, date_from, date_to, date_as_string=True, auth=self.auth)
+        complete = set(self.manifest['complete'])
+
+        missing = {}
+        for date_ref in date_refs:
+            if date_ref in complete:
+                continue
+            timeline = coverages.get_timeline(self.data_id, date_ref, self.variable, self.level,
+                                              date_as_string=True, auth=self.auth)
+            synced = set(self.synced(date_ref))
+            new_timesteps = [t for t in timeline if t not in synced]
+            if new_timesteps:
+                missing[date_ref] = new_timesteps
+            elif not self.__is_recent(date_ref):
+                self.manifest['complete'].append(date_ref)
+                self.__save_manifest()
+
+        return missing
+
+    def __append(self, date_ref, dataset):
+        path = self.path(date_ref)
+        if self.store == 'zarr':
+            if os.path.exists(path):
+                dataset.to_zarr(path, append_dim='time')
+            else:
+                dataset.to_zarr(path, mode='w')
+            return
+
+        os.makedirs(path, exist_ok=True)
+        for time in dataset['time'].values:
+            timestep = pd.Timestamp(time).strftime(date_format)
+            part_path = os.path.join(path, timestep + '.nc.part')
+            dataset.sel(time=[time]).to_netcdf(part_path)
+            os.replace(part_path, os.path.join(path, timestep + '.nc'))
+
+    def sync_run(self, date_ref, timesteps) -> List[str]:
+        """
+        downloads the selected timesteps of a run and appends them to the archive
+        :param date_ref: reference date as formatted string
+        :param timesteps: list of timesteps as formatted strings
+        :return: list of the appended timesteps
+        """
+        stored = self.__stored_timesteps(date_ref)
+        if set(stored) != set(self.synced(date_ref)):
+            logging.warning('[CoverageSync] manifest out of date for %s, using the archive content', date_ref)
+            self.manifest['runs'][date_ref] = stored
+
+        synced = set(stored)
+        timesteps = sorted(t for t in timesteps if t not in synced)
+        if not timesteps:
+            return []
+
+        # the whole run in a single request when nothing is stored yet
+        if not synced:
+            with coverages.get_data(self.data_id, date_ref, self.variable, self.level, 'all',
+                                    auth=self.auth, stream_to=True) as ds:
+                wanted = pd.to_datetime(timesteps, format=date_format)
+                ds = ds.sel(time=ds['time'].to_index().isin(wanted))
+                self.__append(date_ref, ds.load())
+                appended = list(ds['time'].to_index().strftime(date_format))
+        else:
+            appended = []
+            for timestep in timesteps:
+                with coverages.get_data(self.data_id, date_ref, self.variable, self.level, timestep,
+                                        auth=self.auth, stream_to=True) as ds:
+                    self.__append(date_ref, ds.load())
+                appended.append(timestep)
+                self.manifest['runs'][date_ref] = sorted(synced.union(appended))
+                self.__save_manifest()
+
+        self.manifest['runs'][date_ref] = sorted(synced.union(appended))
+        self.__save_manifest()
+        logging.debug('[CoverageSync] %s: appended %d timesteps', date_ref, len(appended))
+        return appended
+
+    @format_dates(parameters=['date_from', 'date_to'])
+    def sync(self, date_from, date_to) -> Dict[str, List[str]]:
+        """
+        downloads the missing timesteps of the runs between date_from and date_to
+        :param date_from: date from
+        :param date_to: date to
+        :return: dict {date_ref: list of appended timesteps}
+        """
+        appended = {}
+        for date_ref, timesteps in self.missing(date_from, date_to).items():
+            appended[date_ref] = self.sync_run(date_ref, timesteps)
+        return appended
+
+    def open(self, date_ref, chunks=None) -> xr.Dataset:
+        """
+        opens a run of the archive
+        :param date_ref: reference date as formatted string
+        :param chunks: dask chunks (optional), without chunks the NetCDF timesteps are loaded in memory
+        :return: xarray dataset
+        """
+        path = self.path(date_ref)
+        if self.store == 'zarr':
+            return xr.open_zarr(path, chunks=chunks)
+
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.nc'))
+        if chunks is not None:
+            return xr.open_mfdataset(files, combine='nested', concat_dim='time', chunks=chunks)
+
+        # open_mfdataset requires dask
+        parts = [xr.open_dataset(f) for f in files]
+        try:
+            return xr.concat(parts, dim='time', data_vars='minimal', coords='minimal', compat='override').load()
+        finally:
+            for part in parts:
+                part.close()
@@ -0,0 +1,325 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .ratelimit import hold_until_closed
+
+DEFAULT_POOL_CONNECTIONS = 10  # number of per-host pools kept alive
+DEFAULT_POOL_MAXSIZE = 10      # max connections kept alive for each host
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# transient failures, including a connection reset while the body is read
+RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class DropsCircuitOpenException(requests.exceptions.ConnectionError):
+    """
+    raised without contacting the server when the circuit breaker of the host is open
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    Retries of the failed requests with exponential backoff and full jitter.
+    Connection errors (also a reset while the body is read), timeouts and the statuses
+    in retry_statuses are retried, the Retry-After header of the response is respected
+    when present.
+    """
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30.0,
+                 retry_statuses=(429, 502, 503, 504), max_retry_after=120.0):
+        """
+        :param max_retries: maximum number of retries (0 disables the retries)
+        :param backoff_factor: base delay in seconds, the delay cap doubles at each attempt
+        :param max_backoff: maximum delay in seconds between two attempts
+        :param retry_statuses: http statuses retried
+        :param max_retry_after: maximum delay in seconds accepted from a Retry-After header
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+
+    def is_retryable(self, status_code) -> bool:
+        return status_code in self.retry_statuses
+
+    @staticmethod
+    def retry_after(response):
+        """
+        :param response: requests response
+        :return: delay in seconds requested by the Retry-After header, or None
+        """
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt, response=None) -> float:
+        """
+        :param attempt: number of the failed attempt, starting from 0
+        :param response: the failed response, if any
+        :return: delay in seconds before the next attempt
+        """
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single host. After failure_threshold consecutive failures
+    the circuit opens and the requests fail immediately for reset_timeout seconds,
+    then a single trial request is let through: the circuit closes if it succeeds,
+    otherwise it opens again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: consecutive failures opening the circuit
+        :param reset_timeout: seconds before a trial request is allowed on an open circuit
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.__opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        :return: True if a request can be sent
+        """
+        with self.__lock:
+            if self.__opened_at is None:
+                return True
+            if self.__trial or time.monotonic() - self.__opened_at < self.reset_timeout:
+                return False
+            self.__trial = True
+            return True
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial = False
+
+    def cancel(self):
+        """
+        gives back the trial request of a half-open circuit whose outcome is unknown
+        (the request did not complete for a reason unrelated to the server)
+        """
+        with self.__lock:
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= self.failure_threshold:
+                if self.__opened_at is None:
+                    logging.warning('[CircuitBreaker] circuit opened after %d failures', self.__failures)
+                self.__opened_at = time.monotonic()
+                self.__trial = False
+
+
+class DropsTransport:
+    """
+    Pooled HTTP transport used by all the DDS calls.
+    Connections are kept alive and reused across calls, the transport can be
+    shared between threads.
+    Failed requests are retried according to the retry policy (GET always, POST only
+    when the call declares it idempotent) and a circuit breaker per host stops
+    sending requests to a failing server.
+    With stream=True the body is read after request returns, so a connection
+    dropped while streaming the body is not retried and reaches the caller.
+    example:
+
+    transport = DropsTransport(pool_maxsize=32, pool_block=True,
+                               retry=RetryPolicy(max_retries=5), circuit_breaker=dict(failure_threshold=10))
+    auth = DropsCredentials(url, (user, password), transport=transport)
+    sensors.get_sensor_data(..., auth=auth)
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 retry=None, circuit_breaker=None, rate_limiter=None):
+        """
+        :param pool_connections: number of host pools to cache
+        :param pool_maxsize: maximum number of connections kept alive for each host
+        :param pool_block: block when no free connection is available for the host
+                           instead of opening a new (not pooled) one
+        :param retry: RetryPolicy, None for the default policy, False to disable the retries
+        :param circuit_breaker: CircuitBreaker arguments as dict, None for the defaults,
+                                False to disable the circuit breakers
+        :param rate_limiter: RateLimiter applying client-side limits per endpoint family (optional)
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.retry = RetryPolicy() if retry is None else retry
+        self.circuit_breaker = {} if circuit_breaker is None else circuit_breaker
+        self.rate_limiter = rate_limiter
+
+        self.__lock = threading.Lock()
+        self.__session = None
+        self.__breakers = {}
+
+    def session(self) -> requests.Session:
+        """
+        :return: the underlying requests session, created on first use
+        """
+        if self.__session is None:
+            with self.__lock:
+                if self.__session is None:
+                    self.__session = self.__build_session()
+        return self.__session
+
+    def __build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def breaker(self, url):
+        """
+        :param url: request url
+        :return: the CircuitBreaker of the host of url, or None if disabled
+        """
+        if self.circuit_breaker is False:
+            return None
+
+        host = urlsplit(url).netloc
+        breaker = self.__breakers.get(host)
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.setdefault(host, CircuitBreaker(**self.circuit_breaker))
+        return breaker
+
+    def request(self, method, url, idempotent=None, **kwargs) -> requests.Response:
+        """
+        performs an http request on the pooled session, retrying the transient failures
+        :param method: http method
+        :param url: request url
+        :param idempotent: the request can be safely repeated,
+                           by default True for GET, HEAD, OPTIONS, PUT, DELETE
+        :param kwargs: same arguments accepted by requests
+        :return: requests response
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        max_retries = self.retry.max_retries if (self.retry and idempotent) else 0
+        breaker = self.breaker(url)
+
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                metrics.emit('circuit_open', metrics.endpoint_of(url))
+                raise DropsCircuitOpenException('circuit open for %s' % urlsplit(url).netloc)
+
+            slot = self.rate_limiter.acquire(url) if self.rate_limiter is not None else None
+
+            logging.debug('[%s] %s', method, url)
+            start = time.perf_counter()
+            try:
+                response = self.session().request(method, url, **kwargs)
+            except RETRYABLE_EXCEPTIONS as exp:
+                if slot is not None:
+                    slot.release()
+                metrics.emit('request', metrics.endpoint_of(url), time.perf_counter() - start,
+                             method=method, status=type(exp).__name__)
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt >= max_retries:
+                    raise
+                delay = self.retry.backoff(attempt)
+                reason = str(exp)
+            except BaseException:
+                if slot is not None:
+                    slot.release()
+                if breaker is not None:
+                    breaker.cancel()
+                raise
+            else:
+                if metrics.enabled():
+                    self.__emit_response_metrics(method, url, response, time.perf_counter() - start,
+                                                 kwargs.get('stream', False))
+                if breaker is not None:
+                    if response.status_code >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if attempt >= max_retries or not self.retry.is_retryable(response.status_code):
+                    if slot is not None:
+                        if kwargs.get('stream'):
+                            # the body is still downloading
+                            hold_until_closed(response, slot)
+                        else:
+                            slot.release()
+                    return response
+                delay = self.retry.backoff(attempt, response)
+                reason = '%s %s' % (response.status_code, response.reason)
+                response.close()
+                if slot is not None:
+                    slot.release()
+
+            attempt += 1
+            metrics.emit('retry', metrics.endpoint_of(url), method=method)
+            logging.warning('[%s] %s: %s, retry %d/%d in %.1fs', method, url, reason, attempt, max_retries, delay)
+            time.sleep(delay)
+
+    @staticmethod
+    def __emit_response_metrics(method, url, response, seconds, stream):
+        endpoint = metrics.endpoint_of(url)
+        # requests does not expose the connection time, it is part of the time to the headers
+        ttfb = response.elapsed.total_seconds()
+        metrics.emit('request', endpoint, ttfb, method=method, status=response.status_code)
+        if not stream:
+            metrics.emit('download', endpoint, max(0.0, seconds - ttfb), len(response.content))
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs) -> requests.Response:
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    def close(self):
+        """
+        closes all the pooled connections
+        """
+        with self.__lock:
+            if self.__session is not None:
+                self.__session.close()
+                self.__session = None
@@ -1,14 +1,33 @@
+import codecs
+import copy as _copy
+import hashlib
 import inspect
+import io
 import json
-from typing import Tuple
+import os
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
 from builtins import filter, map, zip  # 2 and 3 compatibility
 from datetime import date, datetime
+from itertools import chain
+from numbers import Number
 
+import numpy as np
+import pandas as pd
 import pytz
+import xarray as xr
 from decorator import decorate
 
+from . import metrics
+from .transport import DropsTransport
+
 date_format = '%Y%m%d%H%M'
 REQUESTS_TIMEOUT = (10, 300)  # connect timeout, read timeout
+DEFAULT_MAX_WORKERS = 4       # worker threads for the parallel fetches
+STREAM_CHUNK_SIZE = 1024 ** 2  # bytes read at once when streaming responses to disk
 
 
 class DropsCredentials:
@@ -26,9 +45,18 @@ class DropsCredentials:
     with DropsCredentials(url, (user, password)) as auth: # use the instance as a context manager
         sensors.get_sensor_classes(auth=auth)           # do something
 
+    # the http connections are pooled in a DropsTransport owned by the instance,
+    # a custom transport can be shared between credentials
+    transport = DropsTransport(pool_maxsize=32)
+    DropsCredentials(url, (user, password), transport=transport)
+
+    # catalogue and anagraphic calls can be cached in memory
+    DropsCredentials(url, (user, password), metadata_cache=MetadataCache(ttl=600))
+
     """
     # singleton instance
     __instance = None
+    __transport_lock = threading.Lock()
     
     @staticmethod
     def load(settings_file='.drops.rc'):
@@ -54,8 +82,9 @@ class DropsCredentials:
         return dds_url, auth_info
 
     @staticmethod
-    def set(dds_url, user, password):
-        DropsCredentials.__instance = DropsCredentials(dds_url, (user, password))
+    def set(dds_url, user, password, transport=None, metadata_cache=None):
+        DropsCredentials.__instance = DropsCredentials(dds_url, (user, password), transport=transport,
+                                                       metadata_cache=metadata_cache)
 
     @staticmethod
     def default():
@@ -76,9 +105,44 @@ class DropsCredentials:
         :return: the authentication info
         """
         return self.__auth_info
+
+
+    def transport(self) -> DropsTransport:
+        """
+        :return: the pooled http transport, created on first use
+        """
+        if self.__transport is None:
+            with DropsCredentials.__transport_lock:
+                if self.__transport is None:
+                    self.__transport = DropsTransport()
+        return self.__transport
+
+
+    def cache_identity(self) -> Tuple[str, str, str]:
+        """
+        :return: (dds url, user, password digest), to key the cached results on the credentials
+        """
+        user, password = self.__auth_info
+        digest = hashlib.sha256(str(password).encode('utf-8')).hexdigest()[:16]
+        return self.__dds_url, user, digest
+
+
+    def metadata_cache(self):
+        """
+        :return: the MetadataCache for the catalogue calls, or None if caching is disabled
+        """
+        return self.__metadata_cache
+
+
+    def close(self):
+        """
+        closes the pooled http connections
+        """
+        if self.__transport is not None:
+            self.__transport.close()
     
 
-    def __init__(self, dds_url=None, auth_info=None, *, settings_file=None):
+    def __init__(self, dds_url=None, auth_info=None, *, settings_file=None, transport=None, metadata_cache=None):
         if dds_url is None or auth_info is None:
             if settings_file is not None:
                 dds_url, auth_info = DropsCredentials.__load_settings(settings_file)                
@@ -88,11 +152,14 @@ class DropsCredentials:
             
         self.__dds_url = dds_url
         self.__auth_info = auth_info
+        self.__transport = transport
+        self.__metadata_cache = metadata_cache
 
     def __enter__(self):
         return self
     
     def __exit__(self, type, value, traceback):
+        self.close()
         return True
 
 
@@ -131,45 +198,330 @@ class DropsException(Exception):
         return repr(self.message)
 
 
+def get_json(auth, req_url, error_message, params=None, copy=True):
+    """
+    performs a GET request and decodes the json response, using the metadata cache 
+    of the credentials when enabled (with conditional revalidation of the expired entries)
+    :param auth: authentication object
+    :param req_url: request url
+    :param error_message: message of the DropsException raised on errors
+    :param params: query parameters (optional)
+    :param copy: return a copy of the cached value, False only when the caller does not modify it
+    :return: decoded json
+    """
+    cache = auth.metadata_cache()
+    if cache is None:
+        r = auth.transport().get(req_url, params=params, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+        if r.status_code != 200:
+            raise DropsException(error_message, response=r)
+        with metrics.timed('decode', metrics.endpoint_of(req_url), format='json'):
+            return r.json()
+
+    key = auth.cache_identity() + (req_url, tuple(sorted((params or {}).items())))
+    entry = cache.lookup(key)
+    if entry is not None and entry.is_fresh():
+        metrics.emit('cache', metrics.endpoint_of(req_url), cache='metadata', result='hit')
+        return _copy.deepcopy(entry.value) if copy else entry.value
+    metrics.emit('cache', metrics.endpoint_of(req_url), cache='metadata', result='miss')
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+    r = auth.transport().get(req_url, params=params, headers=headers, auth=auth.auth_info(), timeout=REQUESTS_TIMEOUT)
+    if r.status_code == 304 and entry is not None:
+        cache.refresh(key)
+        return _copy.deepcopy(entry.value) if copy else entry.value
+
+    if r.status_code != 200:
+        raise DropsException(error_message, response=r)
+
+    with metrics.timed('decode', metrics.endpoint_of(req_url), format='json'):
+        data = r.json()
+    cache.put(key, data, r.headers.get('ETag'), r.headers.get('Last-Modified'), copy=copy)
+    return data
+
+
+_DATE_TYPES = (datetime, date, np.datetime64)  # pd.Timestamp is a datetime
+
+
+def _format_date(value, date_format_str):
+    if isinstance(value, np.datetime64):
+        return pd.Timestamp(value).strftime(date_format_str)
+    return value.strftime(date_format_str)
+
+
+def _format_date_value(value, date_format_str):
+    """
+    formats a date, or a sequence made only of dates, leaving any other value untouched
+    """
+    if isinstance(value, _DATE_TYPES):
+        return _format_date(value, date_format_str)
+
+    if isinstance(value, (np.ndarray, pd.Index, pd.Series)):
+        if value.dtype.kind == 'M':
+            return list(pd.DatetimeIndex(np.ravel(value)).strftime(date_format_str))
+        if value.dtype.kind != 'O':
+            return value
+
+    elif not isinstance(value, (list, tuple)):
+        return value
+
+    # the first element rules out the lists of ids without scanning them
+    if len(value) == 0 or not isinstance(value[0], _DATE_TYPES):
+        return value
+    if not all(isinstance(el, _DATE_TYPES) for el in value):
+        return value
+
+    try:
+        return list(pd.DatetimeIndex(value).strftime(date_format_str))
+    except (TypeError, ValueError):
+        # mixed time zones, format one at a time
+        return [_format_date(el, date_format_str) for el in value]
+
+
 def format_dates(date_format_str=date_format, parameters=None):
     """
-    converts date objects to string with given format for the decorated functions
-    filters by parameter name if specified
+    converts date objects (datetime, date, pandas Timestamp, numpy datetime64, 
+    or sequences and arrays of them) to string with given format for the decorated functions.
+    The parameters to convert are resolved once, when the function is decorated
     :param date_format_str: the date format (default '%Y%m%d%H%M')
     :param parameters: list of parameters to check for conversion (default all)
     :return: the decorated function
     """
 
     def wrapper_func(func): 
-        def wrapper(*args, **kwargs):
-            # names and values as a dictionary:
-            if hasattr(inspect, 'getfullargspec'):
-                args_name = inspect.getfullargspec(func)[0]
-            else:
-                # older versions of python < 3.10
-                args_name = inspect.getargspec(func)[0]
-            # skip the first argument, it is the function to decorate
-            args_dict = dict(zip(args_name, args[1:]))
-            args_dict.update(kwargs)
-            for arg_name, arg_value in args_dict.items():
-                if parameters is None or any([arg_name == p for p in parameters]):
-                    if type(arg_value) in (datetime, date):
-                        arg_str = arg_value.strftime(date_format_str)
-                        args_dict[arg_name] = arg_str
-
-                    elif type(arg_value) in (list, tuple):
-                        # check for array of dates
-                        if all([type(el) in (datetime, date) for el in arg_value]):
-                            arg_str_arr = [el.strftime(date_format_str) for el in arg_value]
-                            args_dict[arg_name] = arg_str_arr
-
-            return func(**args_dict)
+        signature_parameters = inspect.signature(func).parameters.values()
+        positional = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+        names = [p.name for p in signature_parameters if p.kind in positional]
+        keyword_names = [p.name for p in signature_parameters if p.kind == inspect.Parameter.KEYWORD_ONLY]
+        if parameters is None:
+            date_parameters = names + keyword_names
+        else:
+            date_parameters = [n for n in names + keyword_names if n in parameters]
+        # (name, position) of the parameters to convert, position is None for keyword only
+        positions = [(n, names.index(n) if n in names else None) for n in date_parameters]
+        # without a parameters list the extra keyword arguments are converted too
+        convert_extra = parameters is None and any(
+            p.kind == inspect.Parameter.VAR_KEYWORD for p in signature_parameters)
+
+        def wrapper(func, *args, **kwargs):
+            if len(args) > 0:
+                args = list(args)
+            for name, position in positions:
+                if position is not None and position < len(args):
+                    args[position] = _format_date_value(args[position], date_format_str)
+                elif name in kwargs:
+                    kwargs[name] = _format_date_value(kwargs[name], date_format_str)
+            if convert_extra:
+                for name in kwargs.keys() - set(date_parameters):
+                    kwargs[name] = _format_date_value(kwargs[name], date_format_str)
+
+            return func(*args, **kwargs)
 
         return decorate(func, wrapper)
 
     return wrapper_func 
 
 
-
 def datetimes_from_strings(dates_str):
     return [pytz.utc.localize(datetime.strptime(d, date_format), is_dst=None) for d in dates_str]
+
+
+def datetime64_from_strings(dates_str) -> np.ndarray:
+    """
+    vectorized parsing of dates formatted with date_format
+    :param dates_str: sequence of formatted date strings
+    :return: numpy datetime64[ns] array (UTC)
+    """
+    # the width of the longest string, a fixed width would silently truncate the longer ones
+    raw = np.asarray(dates_str, dtype='S')
+    if raw.size == 0:
+        return np.empty(0, dtype='datetime64[ns]')
+
+    digits = raw.view(np.uint8).reshape(raw.size, -1)
+    if (raw.dtype.itemsize != 12 or digits.shape[0] != len(dates_str)
+            or not ((digits >= ord('0')) & (digits <= ord('9'))).all()):
+        # not in date_format, let pandas guess
+        return pd.to_datetime(list(dates_str), utc=True).tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+    # rearrange YYYYmmddHHMM as YYYY-mm-ddTHH:MM and let numpy parse it
+    iso = np.empty((digits.shape[0], 16), dtype=np.uint8)
+    iso[:, 0:4] = digits[:, 0:4]
+    iso[:, 4] = ord('-')
+    iso[:, 5:7] = digits[:, 4:6]
+    iso[:, 7] = ord('-')
+    iso[:, 8:10] = digits[:, 6:8]
+    iso[:, 10] = ord('T')
+    iso[:, 11:13] = digits[:, 8:10]
+    iso[:, 13] = ord(':')
+    iso[:, 14:16] = digits[:, 10:12]
+    return iso.view('S16').ravel().astype('datetime64[m]').astype('datetime64[ns]')
+
+
+def as_list(value) -> list:
+    """
+    wraps a single value (string, number, date or any other non iterable) in a list
+    :param value: a single value or a sequence of values
+    :return: list of values
+    """
+    if isinstance(value, (str, bytes, Number) + _DATE_TYPES) or not hasattr(value, '__iter__'):
+        return [value]
+    return list(value)
+
+
+def map_concurrent(func: Callable, items: Iterable, max_workers=DEFAULT_MAX_WORKERS, 
+                   return_exceptions=False) -> List:
+    """
+    applies func to every item on a bounded thread pool
+    :param func: function to apply
+    :param items: iterable of arguments
+    :param max_workers: maximum number of worker threads
+    :param return_exceptions: return the exception raised by an item in place of its result,
+                              instead of raising it and dropping the other results
+    :return: list of results, in the same order of items
+    """
+    items = list(items)
+    if return_exceptions:
+        func = _returning_exceptions(func)
+
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def _returning_exceptions(func: Callable) -> Callable:
+    def wrapper(item):
+        try:
+            return func(item)
+        except Exception as exp:
+            return exp
+    return wrapper
+
+
+def write_response(response, f, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    writes the body of a streamed response to a file, one chunk at a time
+    :param response: requests response opened with stream=True
+    :param f: binary file object
+    :param chunk_size: size of the chunks in bytes
+    """
+    chunks = metrics.instrument_chunks(response.iter_content(chunk_size=chunk_size), 
+                                       metrics.endpoint_of(response.url))
+    for chunk in chunks:
+        if chunk:
+            f.write(chunk)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def open_dataset_response(response, stream_to=None, chunks=None) -> xr.Dataset:
+    """
+    opens the NetCDF body of a response as a xarray dataset
+    :param response: requests response (opened with stream=True when stream_to is set)
+    :param stream_to: path where the body is streamed, or True for a temporary file 
+                      removed with the dataset. If None the body is decoded in memory
+    :param chunks: dask chunks for the lazy loading of the dataset (optional, requires dask)
+    :return: xarray dataset
+    """
+    endpoint = metrics.endpoint_of(response.url)
+    if stream_to is None or stream_to is False:
+        with metrics.timed('decode', endpoint, format='netcdf'):
+            return xr.open_dataset(io.BytesIO(response.content), chunks=chunks)
+
+    if stream_to is True:
+        fd, path = tempfile.mkstemp(prefix='drops2-', suffix='.nc')
+        with os.fdopen(fd, 'wb') as f:
+            write_response(response, f)
+        with metrics.timed('decode', endpoint, format='netcdf'):
+            dataset = xr.open_dataset(path, chunks=chunks)
+        weakref.finalize(dataset, _remove_file, path)
+        return dataset
+
+    # write next to the destination and move it in place when complete
+    part_path = str(stream_to) + '.part'
+    try:
+        with open(part_path, 'wb') as f:
+            write_response(response, f)
+        os.replace(part_path, stream_to)
+    except BaseException:
+        _remove_file(part_path)
+        raise
+
+    with metrics.timed('decode', endpoint, format='netcdf'):
+        return xr.open_dataset(stream_to, chunks=chunks)
+
+
+def iter_json_array(chunks):
+    """
+    incremental parser for a json array, yields the elements as soon as they are complete 
+    without decoding the whole document
+    :param chunks: iterable of bytes (e.g. response.iter_content())
+    :return: generator of the decoded elements
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    # characters needed before trying again to decode an incomplete element,
+    # doubled at every failure to keep the parsing linear on large elements
+    retry_at = 0
+
+    # None marks the end of the stream
+    for chunk in chain(chunks, [None]):
+        final = chunk is None
+        if not final and not chunk:
+            continue
+        buffer = buffer[pos:] + text_decoder.decode(chunk or b'', final=final)
+        pos = 0
+        if not final and len(buffer) < retry_at:
+            continue
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Expected a json array, found %r' % buffer[pos:pos + 20])
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # incomplete element, wait for more data
+                retry_at = 2 * (len(buffer) - pos)
+                break
+
+            if not isinstance(element, (dict, list, str)) and (
+                    end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+                # a number is complete only when followed by a delimiter,
+                # otherwise it may continue in the next chunk
+                if final and end < len(buffer):
+                    raise ValueError('Invalid json value %r' % buffer[pos:end + 20])
+                retry_at = 0
+                break
+
+            retry_at = 0
+            pos = end
+            yield element
+
+    raise ValueError('Truncated json array')
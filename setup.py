@@ -27,4 +27,8 @@ setuptools.setup(
         'scipy',
         'xarray',
       ],
+    extras_require={
+        'aio': ['aiohttp'],
+        'zarr': ['zarr'],
+    },
 )
\ No newline at end of file
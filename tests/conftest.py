@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_dds import MockConfig, MockDDS  # noqa: E402
+
+from drops2.utils import DropsCredentials  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def mock_dds(tmp_path_factory):
+    """
+    the mock DDS server of the benchmarks, with small payloads
+    """
+    config = MockConfig(n_sensors=60, coverage_mb=0.05, coverage_times=4, n_variables=2, n_levels=2,
+                        n_features=5, aggregation_times=6, map_shape=(8, 10),
+                        workdir=str(tmp_path_factory.mktemp('mock_dds')))
+    mock = MockDDS(config).start()
+    yield mock
+    mock.stop()
+
+
+@pytest.fixture
+def auth(mock_dds):
+    with DropsCredentials(mock_dds.url, ('test', 'test')) as credentials:
+        yield credentials
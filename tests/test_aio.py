@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from drops2 import aio, coverages, metrics, sensors  # noqa: E402
+from drops2.transport import RetryPolicy  # noqa: E402
+from drops2.utils import DropsCredentials, DropsException  # noqa: E402
+
+DATA_ID = 'MODEL_0'
+DATE_REF = '202001010000'
+
+
+def test_aio_mirrors_the_sync_functions(mock_dds, auth):
+    async def run():
+        async with aio.AsyncDropsClient(auth, max_concurrency=4) as client:
+            variables = await aio.get_variables(DATA_ID, DATE_REF, client=client)
+            levels = await asyncio.gather(*[aio.get_levels(DATA_ID, DATE_REF, v, client=client) for v in variables])
+            timeline = await aio.get_timeline(DATA_ID, DATE_REF, variables[0], levels[0][0], date_as_string=True,
+                                              client=client)
+            sensor_list = await aio.get_sensor_list('PLUVIOMETRO', client=client)
+            df = await aio.get_sensor_data('PLUVIOMETRO', sensor_list.ids[:3].tolist(), '202006010000',
+                                           '202006010100', as_pandas=True, client=client)
+            ds = await aio.get_data(DATA_ID, DATE_REF, variables[0], levels[0][0], client=client)
+            return variables, levels, timeline, sensor_list, df, ds
+
+    variables, levels, timeline, sensor_list, df, ds = asyncio.run(run())
+    assert variables == coverages.get_variables(DATA_ID, DATE_REF, auth=auth)
+    assert levels[0] == coverages.get_levels(DATA_ID, DATE_REF, variables[0], auth=auth)
+    assert timeline == coverages.get_timeline(DATA_ID, DATE_REF, variables[0], levels[0][0], date_as_string=True,
+                                              auth=auth)
+    assert sensor_list == sensors.get_sensor_list('PLUVIOMETRO', auth=auth)
+    assert df.equals(sensors.get_sensor_data('PLUVIOMETRO', sensor_list.ids[:3].tolist(), '202006010000',
+                                             '202006010100', as_pandas=True, auth=auth))
+    assert ds.identical(coverages.get_data(DATA_ID, DATE_REF, variables[0], levels[0][0], auth=auth))
+
+
+def test_aio_errors(mock_dds):
+    async def run():
+        auth = DropsCredentials(mock_dds.url + '/missing', ('test', 'test'))
+        await aio.get_variables(DATA_ID, DATE_REF, auth=auth)
+
+    with pytest.raises(DropsException):
+        asyncio.run(run())
+
+
+def test_aio_retries_the_connection_errors():
+    events = []
+    metrics.add_hook(events.append)
+
+    async def run():
+        auth = DropsCredentials('http://127.0.0.1:1/dds/rest', ('test', 'test'))
+        async with aio.AsyncDropsClient(auth, retry=RetryPolicy(max_retries=2, backoff_factor=0)) as client:
+            await client.get('http://127.0.0.1:1/dds/rest/drops_sensors/classes')
+
+    try:
+        with pytest.raises(aiohttp.ClientConnectionError):
+            asyncio.run(run())
+    finally:
+        metrics.remove_hook(events.append)
+    assert [e.name for e in events] == ['request', 'retry', 'request', 'retry', 'request']
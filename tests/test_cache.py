@@ -0,0 +1,170 @@
+import os
+import time
+
+from drops2 import sensors
+from drops2.cache import DiskCache, MetadataCache
+from drops2.utils import DropsCredentials, get_json
+
+
+class _Response:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.reason = ''
+        self.headers = headers or {}
+        self.url = 'http://dds/drops_sensors/classes'
+        self.__data = data
+
+    def json(self):
+        return self.__data
+
+
+class _Transport:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+def test_metadata_cache_ttl_and_lru():
+    cache = MetadataCache(ttl=60, max_entries=2)
+    value = {'a': [1]}
+    cache.put('a', value)
+    value['a'].append(2)
+    assert cache.get('a') == {'a': [1]}
+
+    cache.get('a')['a'].append(3)
+    assert cache.get('a') == {'a': [1]}
+    assert cache.get('a', copy=False) is cache.get('a', copy=False)
+
+    cache.put('b', 1)
+    cache.get('a')
+    cache.put('c', 2)
+    assert cache.get('b') is None and len(cache) == 2
+
+    cache.invalidate('a')
+    assert cache.get('a') is None and cache.get('c') == 2
+
+    expired = MetadataCache(ttl=0)
+    expired.put('a', 1)
+    assert expired.get('a', 'missing') == 'missing'
+    assert expired.lookup('a') is not None
+
+
+def test_get_json_cache_keyed_on_credentials(mock_dds):
+    cache = MetadataCache()
+    first = DropsCredentials(mock_dds.url, ('first', 'secret'), metadata_cache=cache)
+    other_user = DropsCredentials(mock_dds.url, ('second', 'secret'), metadata_cache=cache)
+    other_password = DropsCredentials(mock_dds.url, ('first', 'other'), metadata_cache=cache)
+
+    mock_dds.reset_stats()
+    classes = sensors.get_sensor_classes(auth=first)
+    classes.append('modified')
+    assert sensors.get_sensor_classes(auth=first) == classes[:-1]
+    assert mock_dds.requests == 1
+
+    sensors.get_sensor_classes(auth=other_user)
+    sensors.get_sensor_classes(auth=other_password)
+    assert mock_dds.requests == 3
+
+    # the anagraphic is shared with the cache, SensorList does not modify it
+    assert sensors.get_sensor_list('PLUVIOMETRO', auth=first) == sensors.get_sensor_list('PLUVIOMETRO', auth=first)
+    assert mock_dds.requests == 4
+
+
+def test_get_json_revalidated_entry_evicted_in_flight():
+    cache = MetadataCache(ttl=0)
+    transport = _Transport([_Response(200, ['A'], {'ETag': '"v1"'})])
+    auth = DropsCredentials('http://dds', ('user', 'password'), transport=transport, metadata_cache=cache)
+    assert get_json(auth, 'http://dds/drops_sensors/classes', 'error') == ['A']
+
+    def not_modified(url, headers=None, **kwargs):
+        cache.invalidate()
+        return _Response(304)
+
+    transport.get = not_modified
+    assert get_json(auth, 'http://dds/drops_sensors/classes', 'error') == ['A']
+    assert len(cache) == 0
+
+
+def test_get_json_sends_validators():
+    transport = _Transport([
+        _Response(200, ['A'], {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2020 00:00:00 GMT'}),
+        _Response(304),
+    ])
+    auth = DropsCredentials('http://dds', ('user', 'password'), transport=transport,
+                            metadata_cache=MetadataCache(ttl=0))
+    get_json(auth, 'http://dds/drops_sensors/classes', 'error')
+    assert get_json(auth, 'http://dds/drops_sensors/classes', 'error') == ['A']
+    assert transport.headers[1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'}
+
+
+def test_disk_cache_write_get_evict(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+    key_a, key_b = DiskCache.key('a'), DiskCache.key('b')
+    assert cache.get(key_a) is None
+
+    with cache.writer(key_a) as f:
+        f.write(b'123456')
+    assert open(cache.get(key_a), 'rb').read() == b'123456'
+
+    time.sleep(0.01)
+    with cache.writer(key_b) as f:
+        f.write(b'123456')
+    # over max_bytes, the least recently used entry is evicted
+    assert cache.get(key_a) is None and cache.get(key_b) is not None
+    assert cache.size() == 6
+
+
+def test_disk_cache_scans_only_to_evict(tmp_path, monkeypatch):
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        if path == str(tmp_path):
+            scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', counting_scandir)
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for i in range(100):
+        with cache.writer(DiskCache.key(i)) as f:
+            f.write(b'0123456789')
+    # the size is scanned on the first write, then tracked
+    assert len(scans) == 1
+
+    # an overwrite counts only the difference
+    with cache.writer(DiskCache.key(0)) as f:
+        f.write(b'01234')
+    cache.invalidate(DiskCache.key(1))
+    assert len(scans) == 1
+
+    for i in range(100, 200):
+        with cache.writer(DiskCache.key(i)) as f:
+            f.write(b'0123456789')
+    # a full cache is evicted down to 900 bytes, so it is scanned at most once every 10 writes
+    assert 1 < len(scans) <= 1 + 10
+    assert cache.size() <= 1000
+
+
+def test_disk_cache_failed_write_is_not_published(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    key = DiskCache.key('a')
+    try:
+        with cache.writer(key) as f:
+            f.write(b'partial')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.get(key) is None and cache.size() == 0
+
+
+def test_disk_cache_recent_entries_expire(tmp_path):
+    cache = DiskCache(str(tmp_path), recent_ttl=-1)
+    key = DiskCache.key('a')
+    with cache.writer(key) as f:
+        f.write(b'1')
+    assert cache.get(key, '202001010000') is not None
+    assert cache.get(key, time.strftime('%Y%m%d%H%M', time.gmtime())) is None
@@ -0,0 +1,119 @@
+import gc
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from drops2 import coverages
+from drops2.cache import DiskCache
+from drops2.utils import DropsCredentials, DropsException, as_list
+
+DATA_ID = 'MODEL_0'
+DATE_REF = '202001010000'
+
+
+def test_as_list():
+    assert as_list('a') == ['a']
+    assert as_list(0) == [0]
+    assert as_list(1.5) == [1.5]
+    d = datetime(2020, 1, 1)
+    assert as_list(d) == [d]
+    assert as_list(None) == [None]
+    assert as_list(('a', 'b')) == ['a', 'b']
+    assert as_list(x for x in 'ab') == ['a', 'b']
+
+
+def test_catalogue(mock_dds, auth):
+    assert coverages.get_variables(DATA_ID, DATE_REF, auth=auth) == ['VAR_0', 'VAR_1']
+    assert coverages.get_levels(DATA_ID, datetime(2020, 1, 1), 'VAR_0', auth=auth) == ['1000', '900']
+    timeline = coverages.get_timeline(DATA_ID, DATE_REF, 'VAR_0', '1000', date_as_string=True, auth=auth)
+    assert timeline == ['202001010000', '202001010100', '202001010200', '202001010300']
+
+
+def test_get_data_multi_scalar_arguments(mock_dds, auth):
+    ds = coverages.get_data_multi(DATA_ID, DATE_REF, 'VAR_0', 0, 'all', auth=auth)
+    assert list(ds.data_vars) == ['VAR_0']
+    assert list(ds['level'].values) == [0]
+    assert ds.sizes['time'] == mock_dds.config.coverage_times
+
+
+def test_get_aggregation_batch_scalar_arguments(mock_dds, auth):
+    data, errors = coverages.get_aggregation_batch(DATA_ID, datetime(2020, 1, 1), 'VAR_0', 0, 'shp', 'id', auth=auth)
+    assert errors == {}
+    assert data.index.names == ['date_ref', 'variable', 'level', 'time']
+    assert set(data.index.get_level_values('level')) == {0}
+    assert data.shape == (mock_dds.config.aggregation_times, mock_dds.config.n_features)
+
+    array, _ = coverages.get_aggregation_batch(DATA_ID, [DATE_REF], ['VAR_0', 'VAR_1'], [0], 'shp', 'id',
+                                               as_xarray=True, auth=auth)
+    assert array.dims == ('date_ref', 'variable', 'level', 'time', 'fid')
+    assert array.shape[:3] == (1, 2, 1)
+
+
+def test_get_aggregation_batch_all_failed(mock_dds):
+    with DropsCredentials(mock_dds.url + '/missing', ('test', 'test')) as auth:
+        data, errors = coverages.get_aggregation_batch(DATA_ID, DATE_REF, ['VAR_0', 'VAR_1'], 0, 'shp', 'id', 
+                                                       auth=auth)
+        assert len(data) == 0
+        assert set(errors) == {(DATE_REF, 'VAR_0', 0), (DATE_REF, 'VAR_1', 0)}
+
+        with pytest.raises(DropsException):
+            coverages.get_aggregation_batch(DATA_ID, DATE_REF, 'VAR_0', 0, 'shp', 'id', as_xarray=True, auth=auth)
+
+
+def test_describe_coverage_refresh(mock_dds, auth):
+    n_variables, n_levels = mock_dds.config.n_variables, mock_dds.config.n_levels
+    description = coverages.describe_coverage(DATA_ID, DATE_REF, date_as_string=True, auth=auth)
+    assert sorted(description) == ['VAR_0', 'VAR_1']
+    assert description['VAR_0']['1000'][0] == DATE_REF
+
+    # past run: the levels are queried again, the known timelines are reused
+    partial = {'VAR_0': dict(description['VAR_0'])}
+    del partial['VAR_0']['900']
+    mock_dds.reset_stats()
+    refreshed = coverages.describe_coverage(DATA_ID, DATE_REF, date_as_string=True, previous=partial, auth=auth)
+    assert refreshed == description
+    assert mock_dds.requests == 1 + n_variables + (n_variables * n_levels - 1)
+
+    frame = coverages.describe_coverage(DATA_ID, DATE_REF, as_pandas=True, auth=auth)
+    mock_dds.reset_stats()
+    assert coverages.describe_coverage(DATA_ID, DATE_REF, date_as_string=True, previous=frame, auth=auth) == description
+    assert mock_dds.requests == 1 + n_variables
+
+
+def test_describe_coverage_refreshes_recent_timelines(mock_dds, auth):
+    date_ref = datetime.now(timezone.utc).strftime('%Y%m%d0000')
+    description = coverages.describe_coverage(DATA_ID, date_ref, date_as_string=True, auth=auth)
+    stale = {v: {l: dates[:1] for l, dates in levels.items()} for v, levels in description.items()}
+    mock_dds.reset_stats()
+    assert coverages.describe_coverage(DATA_ID, date_ref, date_as_string=True, previous=stale, auth=auth) == description
+    n_variables, n_levels = mock_dds.config.n_variables, mock_dds.config.n_levels
+    assert mock_dds.requests == 1 + n_variables + n_variables * n_levels
+
+
+def test_get_data_disk_cache(mock_dds, auth, tmp_path):
+    cache = DiskCache(str(tmp_path))
+    mock_dds.reset_stats()
+    first = coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=auth, cache=cache)
+    second = coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=auth, cache=cache)
+    assert mock_dds.requests == 1
+    assert second.identical(first)
+    assert cache.size() > 0
+
+
+def test_get_data_stream_to(mock_dds, auth, tmp_path):
+    buffered = coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=auth)
+
+    path = str(tmp_path / 'run.nc')
+    streamed = coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=auth, stream_to=path)
+    assert os.path.exists(path) and not os.path.exists(path + '.part')
+    assert streamed.identical(buffered)
+    streamed.close()
+
+    temporary = coverages.get_data(DATA_ID, DATE_REF, 'VAR_0', '1000', 'all', auth=auth, stream_to=True)
+    temporary_path = temporary.encoding['source']
+    assert temporary.identical(buffered)
+    temporary.close()
+    del temporary
+    gc.collect()
+    assert not os.path.exists(temporary_path)
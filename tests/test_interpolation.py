@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from drops2 import interpolation, sensors
+from drops2.sensors import Sensor, SensorList
+
+GEO_WIN = (10.0, 40.0, 14.0, 44.0)
+IMG_DIM = (4, 4)  # cell centers at .5
+
+
+def _sensors():
+    return SensorList([
+        Sensor('a', 1, 'a', 40.5, 10.5, 'C'),
+        Sensor('b', 2, 'b', 40.5, 11.5, 'C'),
+    ])
+
+
+def _data(a, b):
+    index = pd.DatetimeIndex(['2020-06-01 00:00', '2020-06-01 01:00'], tz='UTC')
+    return pd.DataFrame({'a': a, 'b': b, 'unknown': [5.0, 5.0]}, index=index)
+
+
+@pytest.mark.parametrize('radius', [0, -0.5, float('nan')])
+def test_non_positive_radius(radius):
+    with pytest.raises(ValueError):
+        interpolation.interpolate(_data([1.0, 2.0], [3.0, 4.0]), _sensors(), GEO_WIN, IMG_DIM, radius=radius)
+
+
+def test_grid_coordinates():
+    lats, lons = interpolation.grid_coordinates(GEO_WIN, IMG_DIM)
+    assert list(lats) == [40.5, 41.5, 42.5, 43.5]
+    assert list(lons) == [10.5, 11.5, 12.5, 13.5]
+
+
+def test_idw():
+    grid = interpolation.interpolate(_data([1.0, 2.0], [3.0, np.nan]), _sensors(), GEO_WIN, IMG_DIM, radius=1.5)
+    assert grid.dims == ('time', 'lat', 'lon') and grid.shape == (2, 4, 4)
+    assert grid['time'].dtype.kind == 'M'
+    # on the sensors, the sensor values
+    assert grid.values[0, 0, 0] == pytest.approx(1.0)
+    assert grid.values[0, 0, 1] == pytest.approx(3.0)
+    # the missing value of b is skipped
+    assert grid.values[1, 0, 1] == pytest.approx(2.0)
+    # a at distance 1, b at sqrt(2): inverse squared distance weights 1 and 1/2
+    assert grid.values[0, 1, 0] == pytest.approx((1.0 + 3.0 / 2) / (1 + 1 / 2))
+    # no sensor within radius
+
+    assert np.isnan(grid.values[0, 3, 3])
+
+
+def test_linear_regression_recovers_the_trend():
+    sensor_list = SensorList([
+        Sensor('a', 1, 'a', 40.5, 10.5, 'C'),
+        Sensor('b', 2, 'b', 43.5, 13.5, 'C'),
+        Sensor('c', 3, 'c', 40.5, 13.5, 'C'),
+    ])
+    elevation = pd.Series({'a': 0.0, 'b': 1000.0, 'c': 500.0})
+    data = pd.DataFrame({'a': [20.0], 'b': [14.0], 'c': [17.0]}, index=pd.DatetimeIndex(['2020-06-01']))
+    dem = np.full(IMG_DIM, 2000.0)
+    grid = interpolation.interpolate(data, sensor_list, GEO_WIN, IMG_DIM, radius=0.1,
+                                     method=interpolation.LINEAR_REGRESSION, elevation=elevation, dem=dem)
+    np.testing.assert_allclose(grid.values[0, 1:3, 1:3], 20.0 - 0.006 * 2000)
+
+    with pytest.raises(ValueError):
+        interpolation.interpolate(data, sensor_list, method=interpolation.LINEAR_REGRESSION)
+
+
+def test_process_pool_matches_in_process():
+    data = _data([1.0, 2.0], [3.0, 4.0])
+    local = interpolation.interpolate(data, _sensors(), GEO_WIN, IMG_DIM, radius=2)
+    spread = interpolation.interpolate(data, _sensors(), GEO_WIN, IMG_DIM, radius=2, max_workers=2, block_size=1)
+    np.testing.assert_array_equal(local.values, spread.values)
+
+
+def test_interpolate_sensor_data(mock_dds, auth):
+    sensor_list = sensors.get_sensor_list('TERMOMETRO', auth=auth)[:10]
+    df = sensors.get_sensor_data('TERMOMETRO', sensor_list, '202006010000', '202006010100', as_pandas=True, auth=auth)
+    grid = interpolation.interpolate(df, sensor_list, img_dim=(20, 20), radius=5)
+    assert grid.shape == (7, 20, 20)
+    assert np.nanmin(grid.values) >= df.min().min() - 1e-9
+    assert np.nanmax(grid.values) <= df.max().max() + 1e-9
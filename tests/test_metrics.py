@@ -0,0 +1,45 @@
+from drops2 import coverages, metrics
+from drops2.cache import MetadataCache
+
+
+class _Collect:
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+
+def test_aggregation_cache_events_share_the_request_endpoint(mock_dds, auth):
+    collect = _Collect()
+    metrics.add_hook(collect)
+    try:
+        cache = MetadataCache()
+        for _ in range(2):
+            coverages.get_aggregation('MODEL_0', '202001010000', 'VAR_0', '1000', 'shp', 'id', auth=auth, cache=cache)
+    finally:
+        metrics.remove_hook(collect)
+
+    requests = [e for e in collect.events if e.name == 'request']
+    lookups = [e for e in collect.events if e.name == 'cache']
+    assert len(requests) == 1
+    assert [e.labels['result'] for e in lookups] == ['miss', 'hit']
+    assert {e.endpoint for e in lookups} == {requests[0].endpoint} == {'drops_coverages/aggregation'}
+
+
+def test_prometheus_exporter():
+    exporter = metrics.PrometheusExporter(buckets=(0.1, 1.0))
+    exporter(metrics.Event('request', 'drops_sensors/anag', seconds=0.5, labels={'status': 200}))
+    exporter(metrics.Event('download', 'drops_sensors/anag', seconds=0.05, nbytes=10))
+    text = exporter.render()
+    assert 'drops2_request_total{endpoint="drops_sensors/anag",status="200"} 1' in text
+    assert 'drops2_request_seconds_bucket{endpoint="drops_sensors/anag",status="200",le="0.1"} 0' in text
+    assert 'drops2_request_seconds_bucket{endpoint="drops_sensors/anag",status="200",le="1.0"} 1' in text
+    assert 'drops2_download_bytes_total{endpoint="drops_sensors/anag"} 10' in text
+    exporter.reset()
+    assert exporter.render() == '\n'
+
+
+def test_endpoint_of():
+    assert metrics.endpoint_of('http://host/dds/rest/drops_coverages/coverage/A/1/') == 'drops_coverages/coverage'
+    assert metrics.endpoint_of('http://host/other/path') == 'other/path'
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from drops2 import mirror
+from drops2.mirror import SensorMirror
+
+NOW = datetime(2020, 6, 1, 12, tzinfo=pytz.utc)
+
+
+def test_sensor_mirror_update_and_read(mock_dds, auth, tmp_path):
+    with SensorMirror(str(tmp_path / 'mirror.sqlite'), 'PLUVIOMETRO', initial_window=timedelta(hours=1),
+                      auth=auth) as m:
+        written = m.update(['100000', '100001'], now=NOW)
+        assert written == {'100000': 7, '100001': 7}
+        assert m.watermarks() == {'100000': NOW, '100001': NOW}
+
+        df = m.read(date_from=NOW - timedelta(minutes=30))
+        assert list(df.columns) == ['100000', '100001'] and len(df) == 4
+        assert len(m.read(['100000'], df_format='long')) == 7
+
+        # the next update starts from the watermark minus lookback (6 hours)
+        assert m.update(['100000'], now=NOW + timedelta(hours=1))['100000'] == 7 * 6 + 1
+        assert m.watermarks(['100000']) == {'100000': NOW + timedelta(hours=1)}
+        assert m.prune(NOW) == 6 * 6 + 6
+
+
+def test_sensor_mirror_watermark_without_observations(monkeypatch, tmp_path):
+    requests = []
+    late = []
+
+    def iter_sensor_data(sensor_class, ids, date_from, date_to, auth=None):
+        requests.append((list(ids), date_from, date_to))
+        for sensor_id in ids:
+            if sensor_id == 'with_data' and not late:
+                times = np.array([np.datetime64('2020-06-01T11:50')], dtype='datetime64[ns]')
+                yield sensor_id, times, np.array([1.0]), np.array([1])
+            elif sensor_id == 'empty' and late:
+                # backlog uploaded after the first update, older than lookback
+                times = np.array([np.datetime64('2020-06-01T08:00')], dtype='datetime64[ns]')
+                yield sensor_id, times, np.array([2.0]), np.array([1])
+            elif sensor_id == 'empty':
+                yield sensor_id, np.array([], dtype='datetime64[ns]'), np.array([]), np.array([])
+            # 'missing' is not in the response
+
+    monkeypatch.setattr(mirror, 'iter_sensor_data', iter_sensor_data)
+    with SensorMirror(str(tmp_path / 'mirror.sqlite'), 'PLUVIOMETRO', lookback=timedelta(hours=1),
+                      initial_window=timedelta(days=1), auth=object()) as m:
+        ids = ['with_data', 'empty', 'missing']
+        assert m.update(ids, now=NOW) == {'with_data': 1, 'empty': 0, 'missing': 0}
+        first_window = NOW - timedelta(days=1)
+        assert m.watermarks() == {
+            'with_data': datetime(2020, 6, 1, 11, 50, tzinfo=pytz.utc),
+            'empty': first_window + timedelta(hours=1),
+            'missing': first_window + timedelta(hours=1),
+        }
+
+        late.append(True)
+        # a non utc now is sent in utc
+        rome_now = (NOW + timedelta(minutes=10)).astimezone(pytz.timezone('Europe/Rome'))
+        assert m.update(ids, now=rome_now) == {'with_data': 0, 'empty': 1, 'missing': 0}
+        assert all(date_to.utcoffset() == timedelta(0) for _, _, date_to in requests)
+        # the backlog is requested from the start of the first window, not lost
+        assert [date_from for r_ids, date_from, _ in requests[1:] if 'empty' in r_ids] == [first_window]
+        assert m.watermarks() == {
+            'with_data': datetime(2020, 6, 1, 11, 50, tzinfo=pytz.utc),
+            'empty': datetime(2020, 6, 1, 8, tzinfo=pytz.utc),
+            'missing': first_window + timedelta(hours=1),
+        }
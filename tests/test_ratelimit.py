@@ -0,0 +1,80 @@
+import threading
+import time
+
+from drops2 import ratelimit
+from drops2.ratelimit import EndpointLimit, FileTokenBucket, InFlightGovernor, RateLimiter, TokenBucket
+from drops2.transport import DropsTransport
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = time.monotonic()
+    assert bucket._take(now) == 0 and bucket._take(now) == 0
+    assert bucket._take(now) > 0
+    # a token is available again after 0.1 s
+    assert bucket._take(now + 0.11) == 0
+
+
+def test_token_bucket_acquire_waits():
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.035
+
+
+def test_file_token_bucket_is_shared(tmp_path):
+    path = str(tmp_path / 'bucket')
+    first, second = FileTokenBucket(path, rate=0.001, burst=1), FileTokenBucket(path, rate=0.001, burst=1)
+    assert first._take(0) == 0
+    assert second._take(0) > 0
+
+
+def test_in_flight_governor(tmp_path):
+    for lock_dir in (None, str(tmp_path)):
+        governor = InFlightGovernor(2, lock_dir=lock_dir)
+        slots = [governor.acquire(), governor.acquire()]
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (governor.acquire().release(), acquired.set()))
+        thread.start()
+        assert not acquired.wait(0.1)
+        slots[0].release()
+        # released once only
+        slots[0].release()
+        assert acquired.wait(1)
+        thread.join()
+        slots[1].release()
+
+
+def test_rate_limiter_families():
+    limiter = RateLimiter({
+        ratelimit.SENSOR_SERIE: dict(max_in_flight=1),
+        ratelimit.SENSOR_CATALOGUE: dict(max_in_flight=2),
+    })
+    serie = limiter.limit_for('http://host/dds/rest/drops_sensors/serieaggr')
+    catalogue = limiter.limit_for('http://host/dds/rest/drops_sensors/classes')
+    assert serie.governor.max_in_flight == 1 and catalogue.governor.max_in_flight == 2
+    assert limiter.limit_for('http://host/dds/rest/drops_coverages/coverage/') is None
+    assert limiter.acquire('http://host/dds/rest/drops_coverages/coverage/') is None
+
+    limiter = RateLimiter({}, default=EndpointLimit(max_in_flight=1))
+    assert limiter.limit_for('http://host/any') is limiter.default
+
+
+def test_transport_releases_the_slots(mock_dds):
+    limiter = RateLimiter({ratelimit.SENSOR_CATALOGUE: dict(max_in_flight=1)})
+    transport = DropsTransport(rate_limiter=limiter)
+    url = mock_dds.url + '/drops_sensors/classes'
+    for _ in range(3):
+        assert transport.get(url, timeout=5).status_code == 200
+
+    # a streamed response keeps its slot until it is closed
+    governor = limiter.limit_for(url).governor
+    response = transport.get(url, stream=True, timeout=5)
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (governor.acquire().release(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+    response.close()
+    assert acquired.wait(1)
+    thread.join()
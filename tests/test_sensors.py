@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from drops2 import sensors
+from drops2.cache import DiskCache
+from drops2.sensors import Sensor, SensorList, _convert_sensor_data, _sensor_ids
+from drops2.utils import DropsException
+
+
+def _sensor_list():
+    return SensorList([
+        Sensor('1', 10, 'a', 44.0, 8.0, 'mm'),
+        Sensor('2', 10, 'b', 45.0, 9.0, 'mm'),
+        Sensor('3', 11, 'c', 46.0, 10.0, 'mm'),
+    ])
+
+
+def test_sensor_list_lookups():
+    sl = _sensor_list()
+    assert len(sl) == 3
+    assert sl['2'].name == 'b'
+    assert sl[-1].id == '3'
+    assert [s.id for s in sl[:2]] == ['1', '2']
+    assert sl.get_by_station(10).id == '1'
+    assert list(sl.get_by_stations([10]).ids) == ['1', '2']
+    assert list(sl.get_by_ids(['3', '1']).ids) == ['3', '1']
+    assert list(sl.get_by_ids(['3', 'x'], missing='ignore').ids) == ['3']
+    with pytest.raises(KeyError):
+        sl.get_by_ids(['x'])
+    with pytest.raises(KeyError):
+        sl['x']
+
+
+def test_sensor_list_spatial_selections():
+    sl = _sensor_list()
+    assert list(sl.select_bbox((7.5, 43.5, 9.5, 45.5)).ids) == ['1', '2']
+    assert list(sl.select_radius(44.0, 8.0, 10).ids) == ['1']
+    assert list(sl.select(np.array([False, True, True])).ids) == ['2', '3']
+
+
+def test_sensor_list_from_json_roundtrip(mock_dds, auth):
+    sl = sensors.get_sensor_list('PLUVIOMETRO', auth=auth)
+    assert len(sl) == mock_dds.config.n_sensors
+    assert SensorList(list(sl)) == sl
+    assert _sensor_ids(sl) == _sensor_ids(sl.list) == list(sl.ids)
+    assert len(sensors.get_sensor_list('PLUVIOMETRO', geo_win=(6.0, 36.0, 12.0, 47.5), auth=auth)) < len(sl)
+
+
+def test_sensor_list_list_is_immutable_and_assignable():
+    sl = _sensor_list()
+    with pytest.raises(AttributeError):
+        sl.list.append(Sensor('4', 12, 'd', 47.0, 11.0, 'mm'))
+
+    sl.get_by_ids(['1'])
+    sl.list = [*sl.list, Sensor('4', 12, 'd', 47.0, 11.0, 'mm')]
+    assert len(sl) == 4
+    assert list(sl.ids) == ['1', '2', '3', '4']
+    assert sl['4'].station == 12
+    assert len(sl.get_by_ids(['4'])) == 1
+    assert _sensor_ids(sl) == ['1', '2', '3', '4']
+
+
+def test_to_geopandas_returns_a_new_frame():
+    sl = _sensor_list()
+    df = sl.to_geopandas()
+    df['value'] = [1, 2, 3]
+    assert 'value' not in sl.to_geopandas().columns
+    assert list(sl.to_geopandas().index) == ['1', '2', '3']
+
+
+def test_get_sensor_map_split_and_cached_without_dask(mock_dds, auth, tmp_path):
+    dates = ['202006010000', '202006010100', '202006010200']
+    whole = sensors.get_sensor_map('PLUVIOMETRO', dates, auth=auth)
+    split = sensors.get_sensor_map('PLUVIOMETRO', dates, dates_per_request=1, auth=auth)
+    # the mock serves the same field for every date, only the shapes match
+    assert split['map'].shape == whole['map'].shape
+
+    cache = DiskCache(str(tmp_path))
+    sensors.get_sensor_map('PLUVIOMETRO', dates[:2], cache=cache, auth=auth)
+    mock_dds.reset_stats()
+    cached = sensors.get_sensor_map('PLUVIOMETRO', dates, cache=cache, dates_per_request=2, auth=auth)
+    # only the missing date is requested
+    assert mock_dds.requests == 1
+    assert cached.sizes['time'] == 3
+
+
+def test_get_sensor_map_split_sorts_the_uncached_batches(monkeypatch, auth, tmp_path):
+    def fetch(sensor_class, batch, *args, **kwargs):
+        times = pd.to_datetime(batch, format='%Y%m%d%H%M')
+        if len(batch) > 1:
+            # one timestep more than the requested dates, not cached
+            times = times.append(pd.DatetimeIndex([times[0] + timedelta(minutes=30)]))
+        hours = (times - times[0].normalize()) / timedelta(hours=1)
+        return xr.Dataset({'map': ('times', np.asarray(hours))}, coords={'times': times})
+
+    monkeypatch.setattr(sensors, '_fetch_sensor_map', fetch)
+    cache = DiskCache(str(tmp_path))
+    dates = ['202006010000', '202006010100', '202006010200']
+    sensors.get_sensor_map('PLUVIOMETRO', dates[1:2], cache=cache, auth=auth)
+    dataset = sensors.get_sensor_map('PLUVIOMETRO', dates, cache=cache, dates_per_request=2, auth=auth)
+    assert list(dataset['map'].values) == [0.0, 0.5, 1.0, 2.0]
+
+
+@pytest.mark.parametrize('df_format', ['wide', 'long'])
+def test_get_sensor_data_stream_matches_buffered(mock_dds, auth, df_format):
+    ids = ['100000', '100001', '100002']
+    args = ('PLUVIOMETRO', ids, '202006010000', '202006011200')
+    df = sensors.get_sensor_data(*args, as_pandas=True, df_format=df_format, auth=auth)
+    df_stream = sensors.get_sensor_data(*args, as_pandas=True, df_format=df_format, stream=True, auth=auth)
+    assert len(df) == (73 if df_format == 'wide' else 73 * 3)
+    assert df_stream.equals(df)
+
+
+def test_iter_sensor_data(mock_dds, auth):
+    records = list(sensors.iter_sensor_data('PLUVIOMETRO', ['100000', '100001'], '202006010000', '202006010100',
+                                            auth=auth))
+    assert [r[0] for r in records] == ['100000', '100001']
+    sensor_id, times, values, samples = records[0]
+    assert times[0] == np.datetime64('2020-06-01T00:00') and len(times) == len(values) == len(samples) == 7
+
+
+def test_get_sensor_data_chunked_matches_single_request(mock_dds, auth):
+    ids = ['100000', '100001', '100002']
+    args = ('PLUVIOMETRO', ids, '202006010000', '202006020000')
+    df = sensors.get_sensor_data(*args, as_pandas=True, auth=auth)
+    mock_dds.reset_stats()
+    chunked = sensors.get_sensor_data(*args, as_pandas=True, chunk_time=timedelta(hours=5), chunk_ids=2, auth=auth)
+    assert mock_dds.requests == 5 * 2
+    # the mock values depend on the position in the requested window, compare the layout
+    assert chunked.index.equals(df.index) and chunked.columns.equals(df.columns)
+    assert chunked.filter(like='_samples').equals(df.filter(like='_samples'))
+
+    raw = sensors.get_sensor_data(*args, chunk_time=3600 * 5, auth=auth)
+    assert [len(d['timeline']) for d in raw] == [145] * 3
+
+    with pytest.raises(DropsException):
+        sensors.get_sensor_data(*args, chunk_time=-1, auth=auth)
+
+
+def _series():
+    return [
+        {'sensorId': 'a', 'timeline': ['202006010000', '202006010010'], 'values': [1.0, 2.0], 'validSamples': [1, 1]},
+        {'sensorId': 'b', 'timeline': ['202006010010', '202006010020'], 'values': [3.0, 4.0], 'validSamples': [1, 0]},
+        # the first record of a sensor wins
+        {'sensorId': 'a', 'timeline': ['202006010000'], 'values': [9.0], 'validSamples': [1]},
+    ]
+
+
+def test_convert_sensor_data_wide():
+    df = _convert_sensor_data(_series(), as_pandas=True, date_as_string=False)
+    assert list(df.columns) == ['a', 'b', 'a_samples', 'b_samples']
+    assert str(df.index.tz) == 'UTC' and df.index.dtype.unit == 'ns'
+    assert len(df) == 3
+    np.testing.assert_array_equal(df['a'].values, [1.0, 2.0, np.nan])
+    np.testing.assert_array_equal(df['b'].values, [np.nan, 3.0, 4.0])
+    np.testing.assert_array_equal(df['b_samples'].values, [np.nan, 1, 0])
+
+
+def test_convert_sensor_data_long_and_raw():
+    df = _convert_sensor_data(_series(), as_pandas=True, date_as_string=False, df_format='long')
+    assert list(df.columns) == ['sensor', 'time', 'value', 'samples']
+    assert list(df['sensor']) == ['a', 'a', 'b', 'b'] and list(df['value']) == [1.0, 2.0, 3.0, 4.0]
+
+    with pytest.raises(DropsException):
+        _convert_sensor_data(_series(), as_pandas=True, date_as_string=False, df_format='tall')
+    assert _convert_sensor_data([], as_pandas=True, date_as_string=False).empty
+
+    raw = _convert_sensor_data(_series(), as_pandas=False, date_as_string=False)
+    assert raw[0]['timeline'][1].minute == 10
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from drops2 import coverages, subset
+from drops2.sensors import Sensor
+
+
+def _grid(descending_lat=False):
+    lats = np.array([40.0, 41.0, 42.0])
+    lons = np.array([10.0, 11.0, 12.0, 13.0])
+    if descending_lat:
+        lats = lats[::-1]
+    # value = 10 * lat + lon, linear so the bilinear interpolation is exact
+    values = 10 * lats[:, None] + lons[None, :]
+    return xr.Dataset({'v': (('time', 'lat', 'lon'), values[None])}, coords={'lat': lats, 'lon': lons, 'time': [0]})
+
+
+@pytest.mark.parametrize('descending_lat', [False, True])
+def test_point_index_nearest(descending_lat):
+    lats = np.array([40.0, 41.0, 42.0])[::-1 if descending_lat else 1]
+    index = subset.PointIndex(lats, [10.0, 11.0, 12.0], [10.4, 11.6, 9.0], [41.6, 40.2, 41.0])
+    (lat_pos, lon_pos), = index.positions
+    # nearest latitudes 42 and 40
+    assert list(lats[lat_pos[:2]]) == [42.0, 40.0]
+    assert list(lon_pos[:2]) == [0, 2]
+    # the last point is west of the grid
+    assert list(index.inside) == [True, True, False]
+
+
+@pytest.mark.parametrize('descending_lat', [False, True])
+def test_point_index_bilinear_weights(descending_lat):
+    lats = np.array([40.0, 42.0])[::-1 if descending_lat else 1]
+    index = subset.PointIndex(lats, [10.0, 12.0], [10.5], [40.5], method=subset.BILINEAR)
+    weights = {(int(la[0]), int(lo[0])): w[0] for (la, lo), w in zip(index.positions, index.weights)}
+    assert sum(weights.values()) == pytest.approx(1)
+    south = 1 if descending_lat else 0
+    north = 1 - south
+    # a quarter of the way east, a quarter of the way north
+    assert weights[(south, 0)] == pytest.approx(0.75 * 0.75)
+    assert weights[(south, 1)] == pytest.approx(0.75 * 0.25)
+    assert weights[(north, 0)] == pytest.approx(0.25 * 0.75)
+    assert weights[(north, 1)] == pytest.approx(0.25 * 0.25)
+
+
+@pytest.mark.parametrize('descending_lat', [False, True])
+def test_select_points(descending_lat):
+    ds = _grid(descending_lat)
+    points = [(10.5, 40.5), (12.25, 41.75), (20.0, 41.0)]
+    bilinear = subset.select_points(ds, points, subset.BILINEAR)
+    np.testing.assert_allclose(bilinear['v'].values[0], [415.5, 429.75, np.nan])
+    nearest = subset.select_points(ds, points)
+    assert nearest['v'].values[0][1] == 432.0
+    assert list(nearest['point_lon'].values) == [10.5, 12.25, 20.0]
+
+    sensors = [Sensor('a', 1, 'a', 41.0, 11.0, 'mm')]
+    by_sensor = subset.select_points(ds, sensors)
+    assert list(by_sensor['point'].values) == ['a'] and by_sensor['v'].values[0, 0] == 421.0
+
+
+@pytest.mark.parametrize('descending_lat', [False, True])
+def test_select_bbox(descending_lat):
+    ds = subset.select_bbox(_grid(descending_lat), (10.5, 40.5, 12.5, 42.0))
+    assert sorted(ds['lat'].values) == [41.0, 42.0]
+    assert list(ds['lon'].values) == [11.0, 12.0]
+
+
+def test_point_index_cache():
+    args = ([40.0, 41.0], [10.0, 11.0], [10.2], [40.2])
+    assert subset.point_index(*args) is subset.point_index(*args)
+    assert subset.point_index(*args) is not subset.point_index(*args, method=subset.BILINEAR)
+
+
+def test_get_data_points(mock_dds, auth):
+    ds = coverages.get_data('MODEL_0', '202001010000', 'VAR_0', '1000', 'all', auth=auth,
+                            points=[(10.0, 40.0), (12.0, 44.0)], interp=subset.BILINEAR)
+    assert ds['VAR_0'].dims == ('time', 'point')
+    assert ds['VAR_0'].shape == (mock_dds.config.coverage_times, 2)
+
+
+@pytest.mark.parametrize('method', [subset.NEAREST, subset.BILINEAR])
+def test_select_points_from_file(tmp_path, method):
+    ds = _grid(descending_lat=True)
+    path = str(tmp_path / 'grid.nc')
+    ds.to_netcdf(path)
+    points = [(11.5, 41.5), (12.25, 40.75)]
+    with xr.open_dataset(path) as on_disk:
+        from_file = subset.select_points(on_disk, points, method)
+        np.testing.assert_allclose(from_file['v'].values, subset.select_points(ds, points, method)['v'].values)
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from drops2.sync import MANIFEST_FILE, CoverageSync
+
+DATA_ID = 'MODEL_0'
+
+
+def _sync(directory, auth, store='netcdf'):
+    return CoverageSync(str(directory), DATA_ID, 'VAR_0', '1000', store=store, auth=auth)
+
+
+@pytest.mark.parametrize('store', ['netcdf', 'zarr'])
+def test_coverage_sync(mock_dds, auth, tmp_path, store):
+    if store == 'zarr':
+        pytest.importorskip('zarr')
+    n_times = mock_dds.config.coverage_times
+    sync = _sync(tmp_path, auth, store)
+    appended = sync.sync('202001010000', '202001011200')
+    assert sorted(appended) == ['202001010000', '202001011200']
+    assert len(appended['202001010000']) == n_times
+    assert sync.synced('202001010000') == appended['202001010000']
+    assert os.path.exists(os.path.join(str(tmp_path), MANIFEST_FILE))
+
+    # nothing new on the server, the past runs are marked as complete
+    assert sync.sync('202001010000', '202001011200') == {}
+    assert sorted(sync.manifest['complete']) == ['202001010000', '202001011200']
+
+    # a restarted job reads the manifest and queries only the dates
+    restarted = _sync(tmp_path, auth, store)
+    mock_dds.reset_stats()
+    assert restarted.missing('202001010000', '202001011200') == {}
+    assert mock_dds.requests == 1
+
+    with restarted.open('202001010000') as ds:
+        assert ds.sizes['time'] == n_times
+
+
+def test_coverage_sync_rejects_another_archive(mock_dds, auth, tmp_path):
+    _sync(tmp_path, auth).sync('202001010000', '202001010000')
+    with pytest.raises(ValueError):
+        CoverageSync(str(tmp_path), DATA_ID, 'VAR_1', '1000', store='netcdf', auth=auth)
+    with pytest.raises(ValueError):
+        CoverageSync(str(tmp_path), DATA_ID, 'VAR_0', '1000', store='parquet', auth=auth)
@@ -0,0 +1,200 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from drops2.transport import CircuitBreaker, DropsCircuitOpenException, DropsTransport, RetryPolicy
+from drops2.utils import DropsCredentials, map_concurrent
+
+NO_DELAY = RetryPolicy(max_retries=3, backoff_factor=0)
+
+
+class _Scripted:
+    """
+    local server answering with the scripted statuses, then 200;
+    'reset' closes the connection halfway through the body
+    """
+
+    def __init__(self, statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.requests = []
+        scripted = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def __answer(self):
+                if self.headers.get('Content-Length'):
+                    self.rfile.read(int(self.headers['Content-Length']))
+                scripted.requests.append(self.command)
+                status = scripted.statuses.pop(0) if scripted.statuses else 200
+                if status == 'reset':
+                    self.send_response(200)
+                    self.send_header('Content-Length', '10')
+                    self.end_headers()
+                    self.wfile.write(b'ok')
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.send_response(status)
+                for key, value in scripted.headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            do_GET = __answer
+            do_POST = __answer
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/dds/rest/drops_sensors/classes' % self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def scripted():
+    servers = []
+
+    def start(statuses, headers=None):
+        server = _Scripted(statuses, headers)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_get_retried_until_success(scripted):
+    server = scripted([503, 502])
+    response = DropsTransport(retry=NO_DELAY).get(server.url)
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+
+
+def test_retries_exhausted_return_the_last_response(scripted):
+    server = scripted([503] * 10)
+    response = DropsTransport(retry=NO_DELAY, circuit_breaker=False).get(server.url)
+    assert response.status_code == 503
+    assert len(server.requests) == 4
+
+
+def test_post_retried_only_when_idempotent(scripted):
+    server = scripted([503, 503])
+    transport = DropsTransport(retry=NO_DELAY)
+    assert transport.post(server.url, json={}).status_code == 503
+    assert transport.post(server.url, json={}, idempotent=True).status_code == 200
+    assert len(server.requests) == 3
+
+
+def test_not_retryable_status(scripted):
+    server = scripted([404])
+    assert DropsTransport(retry=NO_DELAY).get(server.url).status_code == 404
+    assert len(server.requests) == 1
+
+
+def test_retry_after():
+    class Response:
+        headers = {'Retry-After': '7'}
+
+    policy = RetryPolicy(max_retry_after=5)
+    assert policy.retry_after(Response()) == 7
+    assert policy.backoff(0, Response()) == 5
+    assert RetryPolicy.retry_after(None) is None
+    assert 0 <= RetryPolicy(backoff_factor=1, max_backoff=3).backoff(10) <= 3
+
+
+def test_connection_errors_retried_and_raised():
+    transport = DropsTransport(retry=NO_DELAY, circuit_breaker=False)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.get('http://127.0.0.1:1/dds/rest/drops_sensors/classes', timeout=1)
+
+
+def test_reset_while_reading_the_body_retried(scripted):
+    server = scripted(['reset', 'reset'])
+    response = DropsTransport(retry=NO_DELAY, circuit_breaker=False).get(server.url)
+    assert response.status_code == 200 and response.content == b'ok'
+    assert len(server.requests) == 3
+
+    server = scripted(['reset'] * 5)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        DropsTransport(retry=NO_DELAY, circuit_breaker=False).get(server.url)
+    assert len(server.requests) == 4
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+
+    time.sleep(0.06)
+    # a single trial request after reset_timeout
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open and breaker.allow()
+
+
+def test_unexpected_error_gives_back_the_trial(scripted, monkeypatch):
+    server = scripted([500])
+    transport = DropsTransport(retry=False, circuit_breaker=dict(failure_threshold=1, reset_timeout=0.05))
+    assert transport.get(server.url).status_code == 500
+    breaker = transport.breaker(server.url)
+    assert breaker.is_open
+    time.sleep(0.06)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('not a server failure')
+
+    session = transport.session()
+    monkeypatch.setattr(session, 'request', fail)
+    with pytest.raises(RuntimeError):
+        transport.get(server.url)
+    monkeypatch.undo()
+
+    # the server recovered: the next trial closes the circuit
+    assert transport.get(server.url).status_code == 200
+    assert not breaker.is_open
+
+
+def test_transport_opens_the_circuit_per_host(scripted):
+    server = scripted([500] * 10)
+    transport = DropsTransport(retry=False, circuit_breaker=dict(failure_threshold=2, reset_timeout=60))
+    assert transport.get(server.url).status_code == 500
+    assert transport.get(server.url).status_code == 500
+    with pytest.raises(DropsCircuitOpenException):
+        transport.get(server.url)
+    assert len(server.requests) == 2
+    assert transport.breaker('http://other-host/').allow()
+
+
+def test_credentials_share_one_pooled_session(mock_dds):
+    auth = DropsCredentials(mock_dds.url, ('test', 'test'))
+    transports = map_concurrent(lambda _: auth.transport(), range(8), max_workers=8)
+    assert all(t is transports[0] for t in transports)
+
+    session = auth.transport().session()
+    statuses = map_concurrent(lambda _: auth.transport().get(mock_dds.url + '/drops_sensors/classes').status_code,
+                              range(16), max_workers=8)
+    assert statuses == [200] * 16
+    assert auth.transport().session() is session
+
+    auth.close()
+    assert auth.transport().session() is not session
+    auth.close()
@@ -0,0 +1,84 @@
+import json
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from drops2.utils import datetime64_from_strings, format_dates, iter_json_array
+
+
+@format_dates()
+def _echo(date_ref, when, ids=None, *, until=None, **kwargs):
+    return date_ref, when, ids, until, kwargs
+
+
+@format_dates(parameters=['date_ref'])
+def _echo_date_ref(date_ref, when):
+    return date_ref, when
+
+
+def test_format_dates_converts_every_parameter_by_default():
+    d = datetime(2020, 1, 2, 3, 4)
+    assert _echo(d, d, until=d, extra=d) == ('202001020304', '202001020304', None, '202001020304',
+                                             {'extra': '202001020304'})
+    assert _echo(date_ref=d, when=date(2020, 1, 2))[:2] == ('202001020304', '202001020000')
+
+
+def test_format_dates_only_listed_parameters():
+    d = datetime(2020, 1, 2, 3, 4)
+    assert _echo_date_ref(d, d) == ('202001020304', d)
+
+
+def test_format_dates_sequences():
+    d = datetime(2020, 1, 2, 3, 4)
+    ids = ['1', '2']
+    assert _echo([d, d], pd.Timestamp(d), ids)[:3] == (['202001020304'] * 2, '202001020304', ids)
+    assert _echo(np.array([d], dtype='datetime64[ns]'), np.datetime64(d))[:2] == (['202001020304'], '202001020304')
+    # not all dates, left untouched
+    assert _echo([d, 'x'], None)[0] == [d, 'x']
+
+
+def test_datetime64_from_strings():
+    parsed = datetime64_from_strings(['202001020304', '202012312359'])
+    assert parsed.dtype == np.dtype('datetime64[ns]')
+    assert list(parsed) == [np.datetime64('2020-01-02T03:04'), np.datetime64('2020-12-31T23:59')]
+    assert datetime64_from_strings([]).size == 0
+
+
+def test_datetime64_from_strings_other_formats():
+    # longer strings are not truncated to date_format
+    parsed = datetime64_from_strings(['20200102030405', '20201231235959'])
+    assert list(parsed) == [np.datetime64('2020-01-02T03:04:05'), np.datetime64('2020-12-31T23:59:59')]
+    parsed = datetime64_from_strings(['2020-01-02 03:04', '2020-01-02 03:05'])
+    assert list(parsed) == [np.datetime64('2020-01-02T03:04'), np.datetime64('2020-01-02T03:05')]
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_json_array_any_chunking():
+    elements = [{'sensorId': 'è%d' % i, 'values': list(range(i)), 'text': 'a, ] "b" è'} for i in range(20)]
+    data = json.dumps(elements, ensure_ascii=False).encode('utf-8')
+    for size in (1, 2, 7, 64, len(data)):
+        # multi byte characters split across chunks are decoded
+        assert list(iter_json_array(_chunks(data, size))) == elements
+
+    # numbers and strings split at every byte offset
+    elements = [{'a': 1}, 100, 123.5e-3, -7, 'a, ] "b" è', True, None, [12, 'x'], 0]
+    data = json.dumps(elements, ensure_ascii=False).encode('utf-8')
+    for offset in range(1, len(data)):
+        assert list(iter_json_array([data[:offset], data[offset:]])) == elements
+
+
+def test_iter_json_array_empty_and_errors():
+    assert list(iter_json_array([b' [ ', b'', b' ]'])) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'{"a": 1}']))
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[{"a": 1}, {"a"']))
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[1', b'2x]']))
+    with pytest.raises(ValueError):
+        list(iter_json_array([]))